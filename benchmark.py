@@ -1,111 +1,450 @@
-import subprocess
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import selectors
+import socket
+import sys
 import time
-import dns.resolver
-import matplotlib.pyplot as plt
+import tracemalloc
 
+import dns.dnssec
+import dns.message
+import dns.name
+import dns.rdatatype
+import dns.rrset
+from cryptography.hazmat.primitives.asymmetric import ec
 
+from src.cache import AnswerCache, CompactAnswerCache, InfraCache, NegativeCache, TrustCache, VerificationCache
+from src.mock import MockHierarchy
+from src.resolver import DNSResolver
+from src.server import WorkerPool
+from src.utils import run_sync
+from src.wire import Referral, query_template
+import src.dnssec
 
-# a global variable to store the local DNS server
-local_dns = ""
 
-# list of 5 websites from https://www.alexa.com/topsites
+
+# list of 5 websites from https://www.alexa.com/topsites, used by the live comparison
 sites = [
-    "https://www.google.com",
-    "https://www.youtube.com",
-    "https://www.facebook.com",
-    "https://www.baidu.com",
-    "https://www.wikipedia.org",
-    # "https://www.qq.com",
-    # "https://www.paypal.com",
-    # "https://www.jd.com",
-    # "https://www.yahoo.com",
-    # "https://www.amazon.com",
-    # "https://www.twitter.com",
-    # "https://www.instagram.com",
-    # "https://www.weibo.com",
-    # "https://www.sina.com.cn",
-    # "https://www.linkedin.com",
-    # "https://www.360.cn",
-    # "https://www.reddit.com",
-    # "https://www.microsoft.com",
-    # "https://www.bing.com",
-    # "https://www.office.com",
-    # "https://www.live.com",
-    # "https://www.alipay.com",
-    # "https://www.wordpress.com",
-    # "https://www.sohu.com",
-    # "https://www.ebay.com"
+    "www.google.com",
+    "www.youtube.com",
+    "www.facebook.com",
+    "www.baidu.com",
+    "www.wikipedia.org",
 ]
 
-# this script benchmarks the time taken to resolve DNS for each site using mydig.py
-def run_mydig(site):
-    start_time = time.time()
-    subprocess.run(["python3", "mydig.py", site], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    end_time = time.time()
-    return end_time - start_time
-
-# this script benchmarks the time taken to resolve DNS for each site using local DNS resolver
-def run_local_dns(site):
-    resolver = dns.resolver.Resolver()
-    # get the resolver nameserver and set it to the local DNS server
-    global local_dns
-    if local_dns == "":
-        try:
-            local_dns = resolver.nameservers[0]
-        except IndexError:
-            print("No local DNS server found.")
-            return 0
-
-    start_time = time.time()
-    try:
-        resolver.resolve(site)
-    except (dns.resolver.NoNameservers, dns.resolver.NXDOMAIN, dns.resolver.Timeout):
-        pass
-    end_time = time.time()
-    return end_time - start_time
-
-# this script benchmarks the time taken to resolve DNS for each site using Google's public DNS
-def run_google_dns(site):
-    resolver = dns.resolver.Resolver()
-    resolver.nameservers = ['8.8.8.8', '8.8.4.4']
-    start_time = time.time()
-    try:
-        resolver.resolve(site)
-    except (dns.resolver.NoNameservers, dns.resolver.NXDOMAIN, dns.resolver.Timeout):
-        pass
-    end_time = time.time()
-    return end_time - start_time
-
-# run the benchmark for each site 10 times and calculate the average time
-def average_time(site, run_function, runs=10):
-    total_time = 0
-    for _ in range(runs):
-        total_time += run_function(site)
-    return total_time / runs
-
-# print the number of sites
-print(f"number of sites: {len(sites)}")
-
-# collect data for plotting
-site_names = [site.split("//")[1] for site in sites]
-mydig_times = [average_time(site, run_mydig) for site in sites]
-local_dns_times = [average_time(site, run_local_dns) for site in sites]
-google_dns_times = [average_time(site, run_google_dns) for site in sites]
-
-# plot the data
-plt.figure(figsize=(15, 8))
-plt.plot(site_names, mydig_times, label='mydig.py', marker='o')
-plt.plot(site_names, local_dns_times, label=f'Local DNS {local_dns}', marker='o')
-plt.plot(site_names, google_dns_times, label="Google's public DNS", marker='o')
-
-# add labels and title
-plt.xlabel('website')
-plt.ylabel('average DNS Resolution Time (seconds)')
-plt.title('DNS Resolution Time Comparison')
-plt.xticks(rotation=90)
-plt.legend()
-plt.grid(True)
-plt.tight_layout()
-
-# Show the plot
-plt.show()
+
+def percentile(samples: list, p: float) -> float:
+    """returns the p-th percentile of the samples using the nearest-rank method."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def measure(name: str, hierarchy: MockHierarchy, names: list, resolve) -> dict:
+    """resolves every name with `resolve(name)` and summarizes latency and upstream work.
+
+    @params:
+    - name : string, the label of the benchmark
+    - hierarchy : MockHierarchy
+    - names : list
+    - resolve : callable, returns True when the name resolved
+    @returns:
+    - dict
+    """
+    latencies, failures = [], 0
+    queries = hierarchy.queries
+    start_time = time.perf_counter()
+    for domain in names:
+        t = time.perf_counter()
+        if not resolve(domain):
+            failures += 1
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "benchmark": name,
+        "resolutions": len(names),
+        "failures": failures,
+        "throughput_qps": round(len(names) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "queries_per_resolution": round((hierarchy.queries - queries) / len(names), 3) if names else 0.0,
+    }
+
+
+def reset_dnssec_caches():
+    """drops every validated key and verdict so the next DNSSEC walk starts cold."""
+    src.dnssec.trust_cache = TrustCache()
+    src.dnssec.negative_cache = NegativeCache()
+    src.dnssec.verification_cache = VerificationCache()
+
+
+def bench_resolver(hierarchy: MockHierarchy, names: list, warm: bool) -> dict:
+    """benchmarks `DNSResolver.resolve`, with a fresh resolver per name unless `warm`."""
+    shared = DNSResolver(hierarchy.roots, port=hierarchy.port, infra=InfraCache())
+    if warm:
+        for domain in names:
+            shared.resolve(domain, "A")
+
+    def resolve(domain):
+        resolver = shared if warm else DNSResolver(hierarchy.roots, port=hierarchy.port, infra=InfraCache())
+        _, ok = resolver.resolve(domain, "A")
+        return ok
+
+    return measure(f"resolver/{'warm' if warm else 'cold'}", hierarchy, names, resolve)
+
+
+def bench_dnssec(hierarchy: MockHierarchy, names: list, warm: bool) -> dict:
+    """benchmarks `src.dnssec.resolve`, with cleared key caches per name unless `warm`."""
+    roots = list(hierarchy.roots.values())
+    reset_dnssec_caches()
+
+    def resolve(domain):
+        if not warm:
+            reset_dnssec_caches()
+        _, ok = src.dnssec.resolve(roots, domain, "A", 3, anchor=hierarchy.anchor, port=hierarchy.port)
+        return ok
+
+    if warm:
+        for domain in names:
+            resolve(domain)
+    return measure(f"dnssec/{'warm' if warm else 'cold'}", hierarchy, names, resolve)
+
+
+def bench_verification(count: int) -> list:
+    """measures RRSIG verifications per second inline and on thread and process pools of growing size.
+
+    every rrset is distinct, so no verdict comes from the verification cache.
+    """
+    key = ec.generate_private_key(ec.SECP256R1())
+    dnskey = dns.dnssec.make_dnskey(key.public_key(), dns.dnssec.Algorithm.ECDSAP256SHA256, flags=257)
+    origin = dns.name.from_text("example.com.")
+    dnskey_rrset = dns.rrset.from_rdata(origin, 3600, dnskey)
+    now = int(time.time())
+    signed = []
+    for i in range(count):
+        rrset = dns.rrset.from_text(f"host{i}.example.com.", 300, "IN", "A", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}")
+        sig = dns.dnssec.sign(rrset, key, origin, dnskey, inception=now - 3600, expiration=now + 86400)
+        signed.append((rrset, dns.rrset.from_rdata(rrset.name, 300, sig)))
+
+    async def verify_all():
+        await asyncio.gather(*(src.dnssec.verify(rrset, rrsig, dnskey_rrset) for rrset, rrsig in signed))
+
+    cores = os.cpu_count() or 1
+    sizes = sorted({1, 2, 4, cores, 2 * cores})
+    configurations = [("inline", 0)] + [(kind, size) for kind in ("threads", "processes") for size in sizes]
+    results = []
+    for kind, size in configurations:
+        src.dnssec.use_verification_pool(size, processes=kind == "processes")
+        if kind == "processes":
+            # spawning the workers is not what is being measured
+            warmup = [src.dnssec.verification_pool.submit(src.dnssec.check, *signed[0], dnskey_rrset) for _ in range(size)]
+            for future in warmup:
+                future.result()
+        src.dnssec.verification_cache = VerificationCache()
+        start_time = time.perf_counter()
+        run_sync(verify_all())
+        elapsed = time.perf_counter() - start_time
+        results.append({"benchmark": f"verify/{kind}", "workers": size, "cores": cores, "verifications": count, "verifications_per_second": round(count / elapsed, 2)})
+    src.dnssec.use_verification_pool(0)
+    return results
+
+
+def bench_memory(count: int) -> list:
+    """measures the bytes per cached response of AnswerCache and CompactAnswerCache, and the cost of a hit."""
+    wires = []
+    for i in range(count):
+        query = dns.message.make_query(f"host{i}.example{i % 1000}.com.", "A")
+        response = dns.message.make_response(query)
+        response.answer.append(dns.rrset.from_text(query.question[0].name, 300, "IN", "A", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"))
+        wires.append(response.to_wire())
+
+    results = []
+    for cache in (AnswerCache(), CompactAnswerCache(max_bytes=1 << 40), CompactAnswerCache(max_bytes=count * 100)):
+        # every response is parsed from the wire the way it arrives, and only what the cache keeps stays allocated
+        tracemalloc.start()
+        for wire in wires:
+            response = dns.message.from_wire(wire)
+            cache.put(response.question[0].name, response.question[0].rdtype, response)
+        del response
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        questions = [dns.message.from_wire(wire).question[0] for wire in wires[-1000:]]
+        start_time = time.perf_counter()
+        for question in questions:
+            cache.get(question.name, question.rdtype)
+        elapsed = time.perf_counter() - start_time
+
+        name = type(cache).__name__ if not isinstance(cache, CompactAnswerCache) or cache.max_bytes > count * 100 else f"{type(cache).__name__}/budget"
+        results.append({
+            "benchmark": f"memory/{name}",
+            "entries": len(cache),
+            "bytes_per_entry": round(held / len(cache)) if len(cache) else 0,
+            "footprint_bytes": cache.footprint if isinstance(cache, CompactAnswerCache) else None,
+            "evictions": getattr(cache, "evictions", 0),
+            "hit_us": round(elapsed / len(questions) * 1e6, 2),
+        })
+    return results
+
+
+def bench_hops(count: int) -> list:
+    """measures what a referral hop allocates and costs, building and parsing messages versus the wire fast path."""
+    hierarchy = MockHierarchy()
+    tlds = {zone.origin: zone for zone in hierarchy.zones if len(zone.origin) == 2}
+    hops = []
+    for domain in hierarchy.sample(count):
+        name = dns.name.from_text(domain)
+        query = dns.message.make_query(name, "A")
+        hops.append((name, hierarchy.root.respond(query).to_wire()))
+        hops.append((name, tlds[name.split(2)[1]].respond(query).to_wire()))
+
+    def message_hop(name, wire):
+        query = dns.message.make_query(name, "A").to_wire()
+        response = dns.message.from_wire(wire)
+        zones = [(rrset.name, rrset.ttl, [rr.target for rr in rrset]) for rrset in response.authority if rrset.rdtype == dns.rdatatype.NS]
+        glue = {rrset.name: [rr.address for rr in rrset] for rrset in response.additional if rrset.rdtype == dns.rdatatype.A}
+        return query, response, zones, glue
+
+    def wire_hop(name, wire):
+        return query_template(name, dns.rdatatype.A).render(1), Referral(wire)
+
+    results = []
+    for label, hop in (("message", message_hop), ("wire", wire_hop)):
+        query_template.cache_clear()
+
+        # everything a hop builds is kept alive, so the traced blocks are its allocations
+        tracemalloc.start()
+        kept = [hop(name, wire) for name, wire in hops]
+        held = tracemalloc.get_traced_memory()[0]
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+        tracemalloc.stop()
+        del kept
+
+        start_time = time.perf_counter()
+        for name, wire in hops:
+            hop(name, wire)
+        elapsed = time.perf_counter() - start_time
+
+        results.append({
+            "benchmark": f"hop/{label}",
+            "hops": len(hops),
+            "blocks_per_hop": round(blocks / len(hops), 1),
+            "bytes_per_hop": round(held / len(hops)),
+            "us_per_hop": round(elapsed / len(hops) * 1e6, 2),
+        })
+    return results
+
+
+def load_client(address: str, port: int, names: list, duration: float, sockets: int, window: int, results):
+    """keeps `window` queries outstanding on each of several UDP sockets and reports the answers received.
+
+    SO_REUSEPORT picks a worker per source port, so every socket is one flow.
+    """
+    wires = [dns.message.make_query(name, "A").to_wire() for name in names]
+    selector = selectors.DefaultSelector()
+    for _ in range(sockets):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect((address, port))
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+
+    sent = received = 0
+    for key in list(selector.get_map().values()):
+        for _ in range(window):
+            key.fileobj.send(wires[sent % len(wires)])
+            sent += 1
+
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        events = selector.select(timeout=0.2)
+        if not events:
+            # a lost datagram leaves a window short, refill every socket
+            for key in list(selector.get_map().values()):
+                key.fileobj.send(wires[sent % len(wires)])
+                sent += 1
+        for key, _ in events:
+            try:
+                key.fileobj.recv(4096)
+            except (BlockingIOError, ConnectionRefusedError):
+                continue
+            received += 1
+            key.fileobj.send(wires[sent % len(wires)])
+            sent += 1
+    results.put(received)
+
+
+def bench_workers(count: int, seed: int, duration: float = 5.0) -> list:
+    """measures the answers per second of a `WorkerPool` on loopback as workers are added.
+
+    the caches are warmed with one pass over the names first, so the load test
+    measures the serving path that runs on every core.
+    """
+    cores = os.cpu_count() or 1
+    context = multiprocessing.get_context("spawn")
+    clients = max(1, cores // 2)
+    results = []
+    with MockHierarchy() as hierarchy:
+        names = hierarchy.sample(count, seed)
+        for workers in sorted({1, 2, 4, cores}):
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+                probe.bind(("127.0.0.1", 0))
+                port = probe.getsockname()[1]
+
+            with WorkerPool(hierarchy.roots, workers, hierarchy.port).start("127.0.0.1", port):
+                queries = hierarchy.queries
+                client_results = context.Queue()
+                warmup = context.Process(target=load_client, args=("127.0.0.1", port, names, 1.0, 16, 4, client_results))
+                warmup.start()
+                warmup.join()
+                client_results.get()
+
+                upstream = hierarchy.queries
+                processes = [context.Process(target=load_client, args=("127.0.0.1", port, names, duration, 16, 8, client_results)) for _ in range(clients)]
+                for process in processes:
+                    process.start()
+                answers = sum(client_results.get() for _ in processes)
+                for process in processes:
+                    process.join()
+
+            results.append({
+                "benchmark": "server/workers",
+                "workers": workers,
+                "cores": cores,
+                "qps": round(answers / duration, 2),
+                "upstream_queries_warmup": upstream - queries,
+                "upstream_queries_load": hierarchy.queries - upstream,
+            })
+    return results
+
+
+def offline(count: int, seed: int, as_json: bool, missing: float = 0.0, delay: float = 0.0, replicas: int = 1, loss: float = 0.0):
+    """runs the in-process suite against a loopback mock hierarchy."""
+    with MockHierarchy(delay=delay, replicas=replicas, loss=loss) as hierarchy:
+        names = hierarchy.sample(count, seed, missing)
+        results = [
+            bench_resolver(hierarchy, names, warm=False),
+            bench_resolver(hierarchy, names, warm=True),
+            bench_dnssec(hierarchy, names, warm=False),
+            bench_dnssec(hierarchy, names, warm=True),
+        ]
+
+    if as_json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'benchmark':<16}{'qps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>10}{'failures':>10}")
+    for r in results:
+        print(f"{r['benchmark']:<16}{r['throughput_qps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['queries_per_resolution']:>10}{r['failures']:>10}")
+
+
+def live(runs: int = 10):
+    """compares MyDIG with the local and Google's public resolvers over the internet and plots it."""
+    import dns.resolver
+    import matplotlib.pyplot as plt
+
+    with open('configs/roots.json', 'r') as f:
+        roots = json.load(f)
+
+    def timed(resolve, site):
+        total_time = 0
+        for _ in range(runs):
+            start_time = time.time()
+            try:
+                resolve(site)
+            except (dns.resolver.NoNameservers, dns.resolver.NXDOMAIN, dns.resolver.Timeout):
+                pass
+            total_time += time.time() - start_time
+        return total_time / runs
+
+    local = dns.resolver.Resolver()
+    google = dns.resolver.Resolver()
+    google.nameservers = ['8.8.8.8', '8.8.4.4']
+
+    # a fresh resolver per lookup, so MyDIG walks from the roots like a new process would
+    mydig_times = [timed(lambda site: DNSResolver(roots).resolve(site, "A"), site) for site in sites]
+    local_dns_times = [timed(local.resolve, site) for site in sites]
+    google_dns_times = [timed(google.resolve, site) for site in sites]
+
+    plt.figure(figsize=(15, 8))
+    plt.plot(sites, mydig_times, label='mydig.py', marker='o')
+    plt.plot(sites, local_dns_times, label=f'Local DNS {local.nameservers[0]}', marker='o')
+    plt.plot(sites, google_dns_times, label="Google's public DNS", marker='o')
+    plt.xlabel('website')
+    plt.ylabel('average DNS Resolution Time (seconds)')
+    plt.title('DNS Resolution Time Comparison')
+    plt.xticks(rotation=90)
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    plt.show()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="benchmarks MyDIG against a loopback mock hierarchy")
+    parser.add_argument("--names", type=int, default=200, help="number of resolutions per benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the name sample")
+    parser.add_argument("--missing", type=float, default=0.0, help="share of names that do not exist")
+    parser.add_argument("--delay", type=float, default=0.0, help="milliseconds every mock server holds its answers back")
+    parser.add_argument("--replicas", type=int, default=1, help="number of servers of every mock zone")
+    parser.add_argument("--loss", type=float, default=0.0, help="share of queries every mock server drops")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--verify", action="store_true", help="measure RRSIG verification throughput against the worker pool size instead")
+    parser.add_argument("--signatures", type=int, default=2000, help="number of distinct signatures verified per configuration")
+    parser.add_argument("--memory", action="store_true", help="measure the memory per cached answer instead")
+    parser.add_argument("--hops", action="store_true", help="measure the allocations and time of a referral hop with and without the wire fast path instead")
+    parser.add_argument("--workers", action="store_true", help="load test the multi-process server on loopback as workers are added instead")
+    parser.add_argument("--live", action="store_true", help="compare against real resolvers over the internet instead")
+    args = parser.parse_args()
+
+    if args.live:
+        live()
+        sys.exit(0)
+
+    if args.verify:
+        results = bench_verification(args.signatures)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            print(f"{'benchmark':<20}{'workers':>10}{'verifications/s':>18}")
+            for r in results:
+                print(f"{r['benchmark']:<20}{r['workers']:>10}{r['verifications_per_second']:>18}")
+        sys.exit(0)
+
+    if args.hops:
+        results = bench_hops(args.names)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            print(f"{'benchmark':<14}{'hops':>8}{'blocks/hop':>12}{'bytes/hop':>12}{'us/hop':>10}")
+            for r in results:
+                print(f"{r['benchmark']:<14}{r['hops']:>8}{r['blocks_per_hop']:>12}{r['bytes_per_hop']:>12}{r['us_per_hop']:>10}")
+        sys.exit(0)
+
+    if args.workers:
+        results = bench_workers(args.names, args.seed)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            print(f"{'benchmark':<18}{'workers':>10}{'qps':>12}{'upstream (warm-up)':>20}{'upstream (load)':>18}")
+            for r in results:
+                print(f"{r['benchmark']:<18}{r['workers']:>10}{r['qps']:>12}{r['upstream_queries_warmup']:>20}{r['upstream_queries_load']:>18}")
+        sys.exit(0)
+
+    if args.memory:
+        results = bench_memory(args.names)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            print(f"{'benchmark':<34}{'entries':>10}{'bytes/entry':>14}{'footprint':>12}{'evictions':>12}{'hit us':>10}")
+            for r in results:
+                print(f"{r['benchmark']:<34}{r['entries']:>10}{r['bytes_per_entry']:>14}{str(r['footprint_bytes']):>12}{r['evictions']:>12}{r['hit_us']:>10}")
+        sys.exit(0)
+
+    offline(args.names, args.seed, args.json, args.missing, args.delay / 1000, args.replicas, args.loss)
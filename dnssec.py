@@ -3,7 +3,9 @@ import sys
 import time
 from datetime import datetime
 
-from src.dnssec import resolve
+from src.dnssec import resolve, trust_cache
+from src.store import CacheStore
+from src.trace import ConsoleSink, tracer
 
 
 
@@ -29,6 +31,9 @@ if __name__ == '__main__':
     # load the roots
     roots = load_roots('configs/roots.json')
 
+    # report every resolution step on the console
+    tracer.add_sink(ConsoleSink())
+
     # set execution time
     execution_time = datetime.now()
 
@@ -42,9 +47,17 @@ if __name__ == '__main__':
     else:
         retrys = 3
     
+    # start from the validated keys of previous runs, and save this run's for the next
+    store = CacheStore('dnssec_cache.db')
+    trust_cache.store = store
+
     # begin the resolution process
     start_time = time.time()
-    ans, ok = resolve(list(roots.values()), domain_name, rdtype, retrys)
+    try:
+        ans, ok = resolve(list(roots.values()), domain_name, rdtype, retrys)
+    finally:
+        store.save(trust_cache)
+        store.close()
     end_time = time.time()
 
     # check if the domain name was resolved
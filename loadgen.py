@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import random
+import time
+
+import dns.rcode
+
+from src.mock import MockHierarchy
+from src.resolver import DNSResolver
+from src.trace import tracer
+from src.utils import run_sync
+import src.dnssec
+
+
+
+class Histogram:
+    """an HDR-style latency histogram.
+
+    values are counted in log-linear buckets: every power of two of microseconds
+    is split into 2 ** (`bits` - 1) equal buckets, so any recorded latency is
+    reported within a relative error of 1 / 2 ** (`bits` - 1), from microseconds
+    to minutes, in a few kilobytes.
+    """
+    def __init__(self, bits: int = 8):
+        """@params:
+        - bits : int, the sub-bucket bits of every power of two (8 keeps the error under 0.8%)
+        """
+        self.bits = bits
+        self.counts = {}  # lowest microsecond value of a bucket -> count
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def __bucket(self, micros: int) -> int:
+        shift = max(0, micros.bit_length() - self.bits)
+        return micros >> shift << shift
+
+    def __highest(self, bucket: int) -> int:
+        """returns the highest value that falls in the same bucket."""
+        return bucket + (1 << max(0, bucket.bit_length() - self.bits)) - 1
+
+    def record(self, seconds: float):
+        """counts a latency.
+
+        @params:
+        - seconds : float
+        """
+        bucket = self.__bucket(int(seconds * 1e6))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        """returns the latency in seconds that p percent of the recorded values do not exceed.
+
+        @params:
+        - p : float, between 0 and 100
+        @returns:
+        - float
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, round(p / 100 * self.count))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.__highest(bucket) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        """returns the summary and the non-empty buckets, in milliseconds.
+
+        @returns:
+        - dict
+        """
+        return {
+            "count": self.count,
+            "min_ms": round((self.min or 0.0) * 1000, 3),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "max_ms": round((self.max or 0.0) * 1000, 3),
+            "percentiles_ms": {str(p): round(self.percentile(p) * 1000, 3) for p in (50, 90, 95, 99, 99.9, 99.99)},
+            "buckets": [[round(bucket / 1000, 3), self.counts[bucket]] for bucket in sorted(self.counts)],
+        }
+
+
+class CacheCounter:
+    """a tracer sink that counts cache lookups by cache and result."""
+    def __init__(self):
+        self.lookups = {}  # cache -> [hits, misses]
+
+    def __call__(self, event: dict):
+        if event["event"] != "cache":
+            return
+        counts = self.lookups.setdefault(event["cache"], [0, 0])
+        counts[0 if event["hit"] else 1] += 1
+
+    def ratios(self) -> dict:
+        """returns the hit ratio of every cache that was consulted."""
+        return {cache: round(hits / (hits + misses), 4) for cache, (hits, misses) in sorted(self.lookups.items()) if hits + misses}
+
+
+def zipf_workload(hierarchy: MockHierarchy, qps: float, duration: float, exponent: float = 1.1, seed: int = 0, missing: float = 0.0) -> list:
+    """returns a synthetic workload: Poisson arrivals at `qps`, names drawn from a Zipf distribution.
+
+    @params:
+    - hierarchy : MockHierarchy, whose hostnames are ranked in a shuffled order
+    - qps : float, the mean arrival rate
+    - duration : float, seconds of traffic
+    - exponent : float, the Zipf exponent, larger values concentrate traffic on fewer names
+    - seed : int
+    - missing : float, the share of queries for names that do not exist
+    @returns:
+    - list, (offset in seconds, domain, qtype) tuples in arrival order
+    """
+    rng = random.Random(seed)
+    names = list(hierarchy.hostnames)
+    rng.shuffle(names)
+    weights = list(itertools.accumulate(1 / rank ** exponent for rank in range(1, len(names) + 1)))
+
+    workload, offset = [], rng.expovariate(qps)
+    while offset < duration:
+        name = names[bisect.bisect_left(weights, rng.random() * weights[-1])]
+        if rng.random() < missing:
+            name = f"missing{rng.randrange(1 << 30)}.{name.split('.', 1)[1]}"
+        workload.append((offset, name, "A"))
+        offset += rng.expovariate(qps)
+    return workload
+
+
+def read_log(path: str, speed: float = 1.0) -> list:
+    """reads a query log of `timestamp domain [qtype]` lines, with times relative to the first query.
+
+    @params:
+    - path : string, blank lines and lines starting with # are skipped
+    - speed : float, replays the log this many times faster than it was recorded
+    @returns:
+    - list, (offset in seconds, domain, qtype) tuples in arrival order
+    """
+    entries = []
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            entries.append((float(fields[0]), fields[1], fields[2] if len(fields) > 2 else "A"))
+    entries.sort()
+    start = entries[0][0] if entries else 0.0
+    return [((timestamp - start) / speed, domain, qtype) for timestamp, domain, qtype in entries]
+
+
+async def replay(workload: list, resolve) -> dict:
+    """sends the workload open-loop: every query starts at its arrival time, whether or not earlier ones finished.
+
+    latency is measured from the scheduled arrival, so a resolver that falls
+    behind is charged for the queueing it causes.
+
+    @params:
+    - workload : list, (offset, domain, qtype) tuples
+    - resolve : coroutine function, takes (domain, qtype) and returns (response, ok)
+    @returns:
+    - dict
+    """
+    histogram = Histogram()
+    rcodes, failures = {}, 0
+    outstanding, peak, lag = 0, 0, 0.0
+    last = None
+
+    async def one(arrival: float, domain: str, qtype: str):
+        nonlocal failures, outstanding, last
+        outstanding += 1
+        try:
+            response, ok = await resolve(domain, qtype)
+        except Exception:
+            response, ok = None, False
+        finished = time.perf_counter()
+        outstanding -= 1
+        histogram.record(finished - arrival)
+        last = finished
+        if not ok:
+            failures += 1
+        rcode = dns.rcode.to_text(response.rcode()) if response is not None else "ERROR"
+        rcodes[rcode] = rcodes.get(rcode, 0) + 1
+
+    tasks = []
+    start = time.perf_counter()
+    for offset, domain, qtype in workload:
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lag = max(lag, -delay)
+        tasks.append(asyncio.ensure_future(one(start + offset, domain, qtype)))
+        peak = max(peak, outstanding + 1)
+    await asyncio.gather(*tasks)
+
+    elapsed = (last or start) - start
+    offered = workload[-1][0] if workload else 0.0
+    return {
+        "queries": len(workload),
+        "failures": failures,
+        "rcodes": rcodes,
+        "offered_qps": round(len(workload) / offered, 2) if offered else 0.0,
+        "achieved_qps": round(len(workload) / elapsed, 2) if elapsed else 0.0,
+        "max_outstanding": peak,
+        "max_dispatch_lag_ms": round(lag * 1000, 3),
+        "latency": histogram.to_dict(),
+    }
+
+
+def run(api: str, hierarchy: MockHierarchy, workload: list) -> dict:
+    """replays the workload against one resolver api with cold caches and reports what it cost.
+
+    the blocking apis run their async engines on the shared background loop,
+    which is the only way to have many of their queries in flight at once.
+
+    @params:
+    - api : string, "resolver" (DNSResolver) or "dnssec" (src.dnssec.resolve)
+    - hierarchy : MockHierarchy
+    - workload : list
+    @returns:
+    - dict
+    """
+    if api == "resolver":
+        resolver = DNSResolver(hierarchy.roots, port=hierarchy.port)
+        resolve = resolver.engine.resolve
+    else:
+        src.dnssec.trust_cache = src.dnssec.TrustCache()
+        src.dnssec.negative_cache = src.dnssec.NegativeCache()
+        src.dnssec.verification_cache = src.dnssec.VerificationCache()
+        roots = list(hierarchy.roots.values())
+
+        async def resolve(domain, qtype):
+            return await src.dnssec.aresolve(roots, domain, qtype, 3, anchor=hierarchy.anchor, port=hierarchy.port)
+
+    counter = CacheCounter()
+    tracer.add_sink(counter)
+    queries = hierarchy.queries
+    try:
+        result = run_sync(replay(workload, resolve))
+    finally:
+        tracer.remove_sink(counter)
+
+    result["api"] = api
+    result["cache_hit_ratio"] = counter.ratios()
+    result["upstream_queries"] = hierarchy.queries - queries
+    result["upstream_queries_per_query"] = round(result["upstream_queries"] / len(workload), 3) if workload else 0.0
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="replays open-loop query traffic against MyDIG backed by a loopback mock hierarchy")
+    parser.add_argument("--api", choices=("resolver", "dnssec", "both"), default="both", help="the resolver api to load")
+    parser.add_argument("--log", help="replay a query log of `timestamp domain [qtype]` lines instead of a synthetic workload")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay the log this many times faster")
+    parser.add_argument("--qps", type=float, default=200.0, help="mean arrival rate of the synthetic workload")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of synthetic traffic")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of the synthetic name popularity")
+    parser.add_argument("--missing", type=float, default=0.0, help="share of synthetic queries for names that do not exist")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic workload")
+    parser.add_argument("--zones", type=int, default=32, help="authoritative zones under every mock TLD")
+    parser.add_argument("--delay", type=float, default=0.0, help="milliseconds every mock server holds its answers back")
+    parser.add_argument("--replicas", type=int, default=1, help="number of servers of every mock zone")
+    parser.add_argument("--loss", type=float, default=0.0, help="share of queries every mock server drops")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    with MockHierarchy(zones_per_tld=args.zones, delay=args.delay / 1000, replicas=args.replicas, loss=args.loss) as hierarchy:
+        if args.log:
+            workload = read_log(args.log, args.speed)
+        else:
+            workload = zipf_workload(hierarchy, args.qps, args.duration, args.zipf, args.seed, args.missing)
+        apis = ("resolver", "dnssec") if args.api == "both" else (args.api,)
+        results = [run(api, hierarchy, workload) for api in apis]
+
+    report = json.dumps({"config": vars(args), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + "\n")
+    else:
+        print(report)
@@ -1,23 +1,26 @@
+import asyncio
 from datetime import datetime
 import json
 import sys
 import time
 
-from src.resolver import DNSResolver
-from src.tee import Tee
+import dns.rcode
 
+from src.cache import DelegationCache, answer_cache
+from src.resolver import AsyncDNSResolver, DNSResolver
+from src.store import CacheStore
+from src.tee import BufferedTee
 
 
-def main():
-    # set the program stdout to `mydig_output.txt`
-    sys.stdout = Tee("mydig_output.txt")
-    print("----------------")
-    print(' '.join(sys.argv))
+# the on-disk cache snapshot shared by consecutive runs
+CACHE_FILE = "mydig_cache.db"
 
-    # read roots from `roots.json` file
+
+def load_roots(filename: str) -> dict:
+    """loads roots from roots.json file"""
     try:
-        with open('configs/roots.json', 'r') as f:
-            roots = json.load(f)
+        with open(filename, 'r') as f:
+            return json.load(f)
     except FileNotFoundError:
         print("ERROR: roots.json file not found.")
         sys.exit(1)
@@ -25,6 +28,89 @@ def main():
         print("ERROR: failed to parse roots.json.")
         sys.exit(1)
 
+
+async def batch(roots: dict, source, concurrency: int = 256, store: CacheStore = None, cache_bytes: int = 64 << 20):
+    """resolves `<domain> <query_type>` lines from a file and streams one JSONL record per result.
+
+    every lookup shares one resolver, so its caches are warm for the lines that follow.
+
+    @params:
+    - roots : dictionary, contains ip addresses of root dns servers
+    - source : file, the input lines
+    - concurrency : int, the number of lookups in flight
+    - store : CacheStore, an optional on-disk cache snapshot to start from and update
+    - cache_bytes : int, the memory budget of the answer cache, 0 for no bound
+    """
+    resolver = AsyncDNSResolver(roots, DelegationCache(store), answer_cache(cache_bytes, store), concurrency)
+    lines = asyncio.Queue(maxsize=concurrency * 4)
+
+    async def read():
+        # read in chunks off the loop so a slow pipe does not stall resolutions
+        while True:
+            chunk = await asyncio.to_thread(source.readlines, 1 << 16)
+            if not chunk:
+                break
+            for line in chunk:
+                await lines.put(line)
+        for _ in range(concurrency):
+            await lines.put(None)
+
+    async def work():
+        while (line := await lines.get()) is not None:
+            fields = line.split()
+            if not fields:
+                continue
+            domain, qtype = fields[0], fields[1] if len(fields) > 1 else "A"
+
+            start_time = time.perf_counter()
+            try:
+                ans, ok = await resolver.resolve(domain, qtype)
+            except Exception as e:
+                ans, ok = None, False
+            latency = time.perf_counter() - start_time
+
+            record = {
+                "domain": domain,
+                "qtype": qtype,
+                "ok": ok,
+                "rcode": dns.rcode.to_text(ans.rcode()) if ans is not None else None,
+                "answer": [rr.to_text() for rrset in ans.answer for rr in rrset] if ans is not None else [],
+                "latency_ms": round(latency * 1000, 3),
+                "bytes": len(ans.to_wire()) if ans is not None else 0,
+            }
+            sys.stdout.write(json.dumps(record) + "\n")
+
+    await asyncio.gather(read(), *(work() for _ in range(concurrency)))
+    sys.stdout.flush()
+
+    if store is not None:
+        store.save(resolver.delegations, resolver.answers)
+
+
+def main():
+    # batch mode streams JSONL to a buffered stdout, so it skips the `mydig_output.txt` log
+    if len(sys.argv) > 2 and sys.argv[1] == "--batch":
+        sys.stdout = BufferedTee()
+        roots = load_roots('configs/roots.json')
+        concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 256
+        cache_bytes = int(float(sys.argv[4]) * (1 << 20)) if len(sys.argv) > 4 else 64 << 20
+        store = CacheStore(CACHE_FILE)
+        if sys.argv[2] == "-":
+            asyncio.run(batch(roots, sys.stdin, concurrency, store, cache_bytes))
+        else:
+            with open(sys.argv[2], 'r') as f:
+                asyncio.run(batch(roots, f, concurrency, store, cache_bytes))
+        store.close()
+        return
+
+    # set the program stdout to `mydig_output.txt`, written from a background thread
+    sys.stdout = BufferedTee("mydig_output.txt")
+    print("----------------")
+    print(' '.join(sys.argv))
+
+    # read roots from `roots.json` file
+    roots = load_roots('configs/roots.json')
+
     # check for command line arguments
     if len(sys.argv) < 3:
         print("not enough input arguments: mydig <domain> <query_type>")
@@ -33,8 +119,9 @@ def main():
     domain = sys.argv[1]
     qtype = sys.argv[2]
 
-    # create a resolver instance
-    resolver = DNSResolver(roots)
+    # create a resolver instance, warm-started from the previous runs' cache snapshot
+    store = CacheStore(CACHE_FILE)
+    resolver = DNSResolver(roots, DelegationCache(store), answer_cache(store=store))
     execution_time = datetime.now()
 
     # get the answer
@@ -42,6 +129,10 @@ def main():
     ans, ok = resolver.resolve(domain, qtype)
     end_time = time.time()
 
+    # keep what this run learned for the next one
+    store.save(resolver.delegations, resolver.answers)
+    store.close()
+
     # check for response status
     if not ok:
         print("ERROR, QUERY NOT FOUND")
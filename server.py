@@ -0,0 +1,68 @@
+import asyncio
+import json
+import sys
+import time
+
+from src.cache import answer_cache
+from src.resolver import AsyncDNSResolver
+from src.server import ResolverServer, WorkerPool
+
+
+
+def load_roots(filename):
+    """loads roots from roots.json file"""
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print("error: roots.json file not found.")
+        sys.exit(1)
+    except json.JSONDecodeError:
+        print("error: failed to parse roots.json.")
+        sys.exit(1)
+
+
+async def main(address: str, port: int, roots: dict, upstream_port: int, cache_bytes: int):
+    # one resolver for the whole process, so its caches survive across requests
+    server = ResolverServer(AsyncDNSResolver(roots, answers=answer_cache(cache_bytes), port=upstream_port))
+    await server.start(address, port)
+    print(f"[INFO] serving dns on {address}:{port} (udp, tcp)")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    # check for command line arguments
+    if len(sys.argv) < 3:
+        print("not enough input arguments: server <address> <port> <roots>(default=configs/roots.json) <upstream_port>(default=53) <workers>(default=1) <cache_mb>(default=64, 0 for unbounded)")
+        sys.exit(1)
+
+    address = sys.argv[1]
+    port = int(sys.argv[2])
+    roots = load_roots(sys.argv[3] if len(sys.argv) > 3 else 'configs/roots.json')
+    upstream_port = int(sys.argv[4]) if len(sys.argv) > 4 else 53
+    workers = int(sys.argv[5]) if len(sys.argv) > 5 else 1
+
+    # answers are kept compactly in wire format within the budget, evicting the least recently used, unless it is 0
+    cache_bytes = int(float(sys.argv[6]) * (1 << 20)) if len(sys.argv) > 6 else 64 << 20
+
+    # several workers share the port through SO_REUSEPORT and their caches through shared memory
+    if workers > 1:
+        pool = WorkerPool(roots, workers, upstream_port, cache_bytes=cache_bytes).start(address, port)
+        print(f"[INFO] serving dns on {address}:{port} (udp, tcp) with {workers} workers")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pool.stop()
+        sys.exit(0)
+
+    try:
+        asyncio.run(main(address, port, roots, upstream_port, cache_bytes))
+    except KeyboardInterrupt:
+        pass
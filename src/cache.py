@@ -0,0 +1,979 @@
+import base64
+import bisect
+import collections
+import copy
+import hashlib
+import struct
+import sys
+import time
+
+import dns.dnssec
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+
+
+
+class DelegationCache:
+    """a ttl-aware cache of zone cuts, their nameservers and glue addresses.
+
+    entries are kept with absolute expiry times, so a lookup never returns a
+    referral or an address after the ttl that came with it has passed. at most
+    `maxsize` zone cuts and `maxsize` nameserver addresses are kept, the least
+    recently used going first.
+    """
+    def __init__(self, store=None, maxsize: int = 1 << 18):
+        """initializes an empty delegation cache.
+
+        @params:
+        - store : CacheStore, an optional on-disk snapshot consulted on misses
+        - maxsize : int, the maximum number of zone cuts, and separately of nameserver addresses, kept
+        """
+        self.maxsize = maxsize
+        self.__zones = collections.OrderedDict()  # zone name -> (expiry, set of nameserver names), least recently used first
+        self.__glue = collections.OrderedDict()  # nameserver name -> (expiry, list of ipv4 addresses), least recently used first
+        self.__changed = None  # (table, key) of the entries added since the last `changes`, None until it is first called
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.__zones)
+
+    def __set(self, entries: collections.OrderedDict, key: dns.name.Name, entry: tuple):
+        entries[key] = entry
+        entries.move_to_end(key)
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+    def add_zone(self, zone: dns.name.Name, nameservers: list, ttl: int):
+        """stores the nameservers of a zone cut.
+
+        @params:
+        - zone : dns.name.Name, the owner name of the NS rrset
+        - nameservers : list, the nameserver names (dns.name.Name)
+        - ttl : int, the ttl of the NS rrset
+        """
+        if ttl <= 0 or not nameservers:
+            return
+        self.__set(self.__zones, zone, (time.time() + ttl, set(nameservers)))
+        if self.__changed is not None:
+            self.__changed.add(("zones", zone))
+
+    def add_glue(self, nameserver: dns.name.Name, addresses: list, ttl: int):
+        """stores the addresses of a nameserver, merging with live ones.
+
+        @params:
+        - nameserver : dns.name.Name
+        - addresses : list, ipv4 addresses as strings
+        - ttl : int, the ttl of the address rrset
+        """
+        if ttl <= 0 or not addresses:
+            return
+        expiry = time.time() + ttl
+        current = self.__glue.get(nameserver)
+        if current is not None and current[0] > time.time():
+            addresses = list(dict.fromkeys(current[1] + list(addresses)))
+            expiry = min(expiry, current[0])
+        self.__set(self.__glue, nameserver, (expiry, list(addresses)))
+        if self.__changed is not None:
+            self.__changed.add(("glue", nameserver))
+
+    def nameservers(self, zone: dns.name.Name) -> set:
+        """returns the live nameserver names of a zone, or an empty set."""
+        entry = self.__zones.get(zone)
+        if entry is None and self.store is not None:
+            entry = self.store.load("zones", zone)
+            if entry is not None:
+                self.__set(self.__zones, zone, entry)
+        if entry is None:
+            return set()
+        if entry[0] <= time.time():
+            del self.__zones[zone]
+            return set()
+        self.__zones.move_to_end(zone)
+        return entry[1]
+
+    def addresses(self, nameserver: dns.name.Name) -> list:
+        """returns the live addresses of a nameserver, or an empty list."""
+        entry = self.__glue.get(nameserver)
+        if entry is None and self.store is not None:
+            entry = self.store.load("glue", nameserver)
+            if entry is not None:
+                self.__set(self.__glue, nameserver, entry)
+        if entry is None:
+            return []
+        if entry[0] <= time.time():
+            del self.__glue[nameserver]
+            return []
+        self.__glue.move_to_end(nameserver)
+        return entry[1]
+
+    def snapshot(self) -> dict:
+        """returns every entry with its absolute expiry, keyed by store table."""
+        return {"zones": list(self.__zones.items()), "glue": list(self.__glue.items())}
+
+    def changes(self) -> dict:
+        """returns the entries added since the last call, like `snapshot`.
+
+        the first call returns every entry and starts keeping track of additions.
+        """
+        if self.__changed is None:
+            self.__changed = set()
+            return self.snapshot()
+        changed, self.__changed = self.__changed, set()
+        tables = {"zones": [], "glue": []}
+        for table, key in changed:
+            entry = (self.__zones if table == "zones" else self.__glue).get(key)
+            if entry is not None:
+                tables[table].append((key, entry))
+        return tables
+
+    def closest(self, domain: dns.name.Name) -> tuple[dns.name.Name, list]:
+        """returns the deepest cached zone cut of a domain that has reachable servers.
+
+        @params:
+        - domain : dns.name.Name
+        @returns:
+        - tuple[dns.name.Name, list], the zone cut and its server addresses, or (None, [])
+        """
+        name = domain
+        while True:
+            servers = []
+            for ns in self.nameservers(name):
+                servers.extend(self.addresses(ns))
+            if servers:
+                return name, list(dict.fromkeys(servers))
+            if name == dns.name.root:
+                return None, []
+            name = name.parent()
+
+
+def _age(response: dns.message.Message, expiry: float, shared: bool = True) -> dns.message.Message:
+    """returns a cached response with every ttl lowered by the whole seconds it spent in the cache.
+
+    the time it was stored follows from its expiry, since the cache ttl is
+    derived from the response itself.
+
+    @params:
+    - response : dns.message.Message
+    - expiry : float, the unix time the cache entry expires
+    - shared : bool, the response is held by the cache, so age a copy of it instead
+    @returns:
+    - dns.message.Message
+    """
+    elapsed = int(AnswerCache.ttl(response) - (expiry - time.time()))
+    if elapsed < 1:
+        return response
+    if shared:
+        response = copy.copy(response)
+        response.sections = [list(section) for section in response.sections]
+    for section in response.sections[1:]:
+        for i, rrset in enumerate(section):
+            rrset = rrset.copy() if shared else rrset
+            rrset.ttl = max(0, rrset.ttl - elapsed)
+            section[i] = rrset
+    return response
+
+
+class AnswerCache:
+    """a shared cache of final responses keyed by (qname, qtype, class).
+
+    positive answers live for the smallest ttl in the answer section. NXDOMAIN
+    and NODATA responses are cached for the SOA minimum of the authority section,
+    capped by the SOA ttl itself (RFC 2308 section 5). a hit is returned with
+    its ttls lowered by the time it has spent in the cache.
+    """
+    def __init__(self, store=None):
+        """initializes an empty answer cache with zeroed counters.
+
+        @params:
+        - store : CacheStore, an optional on-disk snapshot consulted on misses
+        """
+        self.__entries = {}  # (qname, qtype, class) -> (expiry, dns.message.Message)
+        self.__popularity = {}  # (qname, qtype, class) -> [hits, ttl] since the entry was stored
+        self.__changed = None  # keys stored since the last `changes`, None until it is first called
+        self.hits = 0
+        self.misses = 0
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    @staticmethod
+    def ttl(response: dns.message.Message) -> int:
+        """returns how long a response may be cached, or 0 if it is not cacheable.
+
+        @params:
+        - response : dns.message.Message
+        @returns:
+        - int, seconds
+        """
+        rcode = response.rcode()
+        if rcode == dns.rcode.NOERROR and response.answer:
+            return min(rrset.ttl for rrset in response.answer)
+
+        if rcode in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+            for rrset in response.authority:
+                if rrset.rdtype == dns.rdatatype.SOA:
+                    return min(rrset.ttl, rrset[0].minimum)
+
+        return 0
+
+    def get(self, qname: dns.name.Name, qtype: dns.rdatatype, rdclass: dns.rdataclass = dns.rdataclass.IN) -> dns.message.Message:
+        """returns a live cached response with its remaining ttls, or None on a miss.
+
+        @params:
+        - qname : dns.name.Name
+        - qtype : dns.rdatatype
+        - rdclass : dns.rdataclass
+        @returns:
+        - dns.message.Message
+        """
+        key = (qname, qtype, rdclass)
+        entry = self.__entries.get(key)
+        if entry is None and self.store is not None:
+            entry = self.store.load("answers", key)
+            if entry is not None:
+                self.__entries[key] = entry
+        if entry is not None and entry[0] > time.time():
+            self.hits += 1
+            popularity = self.__popularity.get(key)
+            if popularity is not None:
+                popularity[0] += 1
+            return _age(entry[1], entry[0])
+
+        if entry is not None:
+            del self.__entries[key]
+            self.__popularity.pop(key, None)
+        self.misses += 1
+        return None
+
+    def prefetchable(self, qname: dns.name.Name, qtype: dns.rdatatype, rdclass: dns.rdataclass, window: float, min_hits: int) -> bool:
+        """tells whether a live entry is popular and close enough to expiry to be refreshed ahead.
+
+        @params:
+        - qname : dns.name.Name
+        - qtype : dns.rdatatype
+        - rdclass : dns.rdataclass
+        - window : float, the share of the original ttl before expiry that counts as close
+        - min_hits : int, the hits since the entry was stored that make it popular
+        @returns:
+        - bool
+        """
+        key = (qname, qtype, rdclass)
+        entry, popularity = self.__entries.get(key), self.__popularity.get(key)
+        if entry is None or popularity is None or popularity[0] < min_hits:
+            return False
+        remaining = entry[0] - time.time()
+        return 0 < remaining <= popularity[1] * window
+
+    def put(self, qname: dns.name.Name, qtype: dns.rdatatype, response: dns.message.Message, rdclass: dns.rdataclass = dns.rdataclass.IN):
+        """stores a final response if it carries a usable ttl.
+
+        @params:
+        - qname : dns.name.Name
+        - qtype : dns.rdatatype
+        - response : dns.message.Message
+        - rdclass : dns.rdataclass
+        """
+        ttl = self.ttl(response)
+        if ttl > 0:
+            self.__entries[(qname, qtype, rdclass)] = (time.time() + ttl, response)
+            self.__popularity[(qname, qtype, rdclass)] = [0, ttl]
+            if self.__changed is not None:
+                self.__changed.add((qname, qtype, rdclass))
+
+    def snapshot(self) -> dict:
+        """returns every entry with its absolute expiry, keyed by store table."""
+        return {"answers": list(self.__entries.items())}
+
+    def changes(self) -> dict:
+        """returns the entries stored since the last call, like `snapshot`.
+
+        the first call returns every entry and starts keeping track of changes.
+        """
+        if self.__changed is None:
+            self.__changed = set()
+            return self.snapshot()
+        changed, self.__changed = self.__changed, set()
+        return {"answers": [(key, self.__entries[key]) for key in changed if key in self.__entries]}
+
+
+class _Record:
+    """one cached response in wire format, parsed again only when it is hit."""
+    __slots__ = ("expiry", "wire", "hits", "ttl")
+
+    def __init__(self, expiry: float, wire: bytes, ttl: int):
+        self.expiry = expiry
+        self.wire = wire
+        self.hits = 0  # since the entry was stored
+        self.ttl = ttl
+
+
+class CompactAnswerCache:
+    """an AnswerCache that keeps responses as wire-format bytes within a hard memory budget.
+
+    a parsed dns.message.Message costs a couple of kilobytes in CPython, while
+    the same response on the wire is usually under a hundred bytes. entries are
+    `__slots__` records keyed by the wire form of the question, a response is
+    parsed again on every hit, and the least recently used entries are evicted
+    once the cache would grow beyond `max_bytes`.
+    """
+    def __init__(self, max_bytes: int = 64 << 20, store=None):
+        """initializes an empty cache with zeroed counters.
+
+        @params:
+        - max_bytes : int, the memory budget of keys, records and their index
+        - store : CacheStore, an optional on-disk snapshot consulted on misses
+        """
+        self.max_bytes = max_bytes
+        self.__entries = collections.OrderedDict()  # question wire key -> _Record, least recently used first
+        self.__bytes = 0  # held by the keys and records, without the table that indexes them
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__changed = None  # (qname, qtype, class) stored since the last `changes`, None until it is first called
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    ttl = staticmethod(AnswerCache.ttl)
+
+    @staticmethod
+    def __key(qname: dns.name.Name, qtype: dns.rdatatype, rdclass: dns.rdataclass) -> bytes:
+        return qname.canonicalize().to_wire() + struct.pack("!HH", qtype, rdclass)
+
+    @staticmethod
+    def __size(key: bytes, record: _Record) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(record) + sys.getsizeof(record.wire) + sys.getsizeof(record.expiry)
+
+    @property
+    def footprint(self) -> int:
+        """returns the bytes held by the keys, the records and the table that indexes them."""
+        return self.__bytes + sys.getsizeof(self.__entries)
+
+    def __remove(self, key: bytes):
+        self.__bytes -= self.__size(key, self.__entries.pop(key))
+
+    def __insert(self, key: bytes, record: _Record):
+        if key in self.__entries:
+            self.__remove(key)
+        self.__entries[key] = record
+        self.__bytes += self.__size(key, record)
+
+        # the table only grows, so a resize may cost more entries than the new one alone
+        while self.__entries and self.footprint > self.max_bytes:
+            self.__remove(next(iter(self.__entries)))
+            self.evictions += 1
+
+    def get(self, qname: dns.name.Name, qtype: dns.rdatatype, rdclass: dns.rdataclass = dns.rdataclass.IN) -> dns.message.Message:
+        """returns a live cached response, parsed from its wire form with its remaining ttls, or None on a miss.
+
+        @params:
+        - qname : dns.name.Name
+        - qtype : dns.rdatatype
+        - rdclass : dns.rdataclass
+        @returns:
+        - dns.message.Message
+        """
+        key = self.__key(qname, qtype, rdclass)
+        record = self.__entries.get(key)
+        if record is None and self.store is not None:
+            entry = self.store.load("answers", (qname, qtype, rdclass))
+            if entry is not None:
+                record = _Record(entry[0], entry[1].to_wire(), self.ttl(entry[1]))
+                self.__insert(key, record)
+        if record is not None and record.expiry > time.time():
+            self.hits += 1
+            record.hits += 1
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+            return _age(dns.message.from_wire(record.wire), record.expiry, shared=False)
+
+        if record is not None and key in self.__entries:
+            self.__remove(key)
+        self.misses += 1
+        return None
+
+    def prefetchable(self, qname: dns.name.Name, qtype: dns.rdatatype, rdclass: dns.rdataclass, window: float, min_hits: int) -> bool:
+        """tells whether a live entry is popular and close enough to expiry to be refreshed ahead.
+
+        @params:
+        - qname : dns.name.Name
+        - qtype : dns.rdatatype
+        - rdclass : dns.rdataclass
+        - window : float, the share of the original ttl before expiry that counts as close
+        - min_hits : int, the hits since the entry was stored that make it popular
+        @returns:
+        - bool
+        """
+        record = self.__entries.get(self.__key(qname, qtype, rdclass))
+        if record is None or record.hits < min_hits:
+            return False
+        remaining = record.expiry - time.time()
+        return 0 < remaining <= record.ttl * window
+
+    def put(self, qname: dns.name.Name, qtype: dns.rdatatype, response: dns.message.Message, rdclass: dns.rdataclass = dns.rdataclass.IN):
+        """stores a final response in wire format if it carries a usable ttl.
+
+        @params:
+        - qname : dns.name.Name
+        - qtype : dns.rdatatype
+        - response : dns.message.Message
+        - rdclass : dns.rdataclass
+        """
+        ttl = self.ttl(response)
+        if ttl > 0:
+            self.__insert(self.__key(qname, qtype, rdclass), _Record(time.time() + ttl, response.to_wire(), ttl))
+            if self.__changed is not None:
+                self.__changed.add((qname, qtype, rdclass))
+
+    def snapshot(self) -> dict:
+        """returns every entry with its absolute expiry, keyed by store table."""
+        answers = []
+        for record in self.__entries.values():
+            response = dns.message.from_wire(record.wire)
+            question = response.question[0]
+            answers.append(((question.name, question.rdtype, question.rdclass), (record.expiry, response)))
+        return {"answers": answers}
+
+    def changes(self) -> dict:
+        """returns the entries stored since the last call, like `snapshot` but with responses in wire format.
+
+        the first call returns every entry and starts keeping track of changes.
+        """
+        if self.__changed is None:
+            self.__changed = set()
+            return self.snapshot()
+        changed, self.__changed = self.__changed, set()
+        answers = []
+        for key in changed:
+            record = self.__entries.get(self.__key(*key))
+            if record is not None:
+                answers.append((key, (record.expiry, record.wire)))
+        return {"answers": answers}
+
+
+def answer_cache(max_bytes: int = 64 << 20, store=None):
+    """returns the answer cache for a memory budget.
+
+    @params:
+    - max_bytes : int, the budget of a CompactAnswerCache, 0 for an unbounded AnswerCache
+    - store : CacheStore, an optional on-disk snapshot consulted on misses
+    @returns:
+    - AnswerCache or CompactAnswerCache
+    """
+    if max_bytes > 0:
+        return CompactAnswerCache(max_bytes, store)
+    return AnswerCache(store)
+
+
+class TrustCache:
+    """a cache of DNSKEY and DS rrsets that already passed DNSSEC validation.
+
+    an entry expires at the earlier of its ttl and the expiration of the RRSIG
+    that validated it, so a key is never trusted beyond its signature.
+    """
+    def __init__(self, store=None):
+        """initializes an empty trust cache.
+
+        @params:
+        - store : CacheStore, an optional on-disk snapshot consulted on misses
+        """
+        self.__dnskeys = {}  # zone name -> (expiry, DNSKEY rrset)
+        self.__ds = {}  # zone name -> (expiry, DS rrset)
+        self.store = store
+
+    @staticmethod
+    def expiry(rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset) -> float:
+        """returns the absolute time until which a validated rrset may be trusted.
+
+        @params:
+        - rrset : dns.rrset.RRset
+        - rrsig : dns.rrset.RRset, the signatures that covered the rrset
+        @returns:
+        - float, a unix timestamp
+        """
+        expiry = time.time() + rrset.ttl
+        if rrsig is not None:
+            expiry = min([expiry] + [sig.expiration for sig in rrsig])
+        return expiry
+
+    def __lookup(self, table: str, entries: dict, zone: dns.name.Name) -> dns.rrset.RRset:
+        entry = entries.get(zone)
+        if entry is None and self.store is not None:
+            entry = self.store.load(table, zone)
+            if entry is not None:
+                entries[zone] = entry
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del entries[zone]
+            return None
+        return entry[1]
+
+    def dnskey(self, zone: dns.name.Name) -> dns.rrset.RRset:
+        """returns the validated DNSKEY rrset of a zone, or None."""
+        return self.__lookup("dnskeys", self.__dnskeys, zone)
+
+    def ds(self, zone: dns.name.Name) -> dns.rrset.RRset:
+        """returns the validated DS rrset of a zone, or None."""
+        return self.__lookup("ds", self.__ds, zone)
+
+    def add_dnskey(self, rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset):
+        """stores a validated DNSKEY rrset under its owner name."""
+        self.__dnskeys[rrset.name] = (self.expiry(rrset, rrsig), rrset)
+
+    def add_ds(self, rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset):
+        """stores a validated DS rrset under its owner name."""
+        self.__ds[rrset.name] = (self.expiry(rrset, rrsig), rrset)
+
+    def snapshot(self) -> dict:
+        """returns every entry with its absolute expiry, keyed by store table."""
+        return {"dnskeys": list(self.__dnskeys.items()), "ds": list(self.__ds.items())}
+
+
+class NegativeCache:
+    """a cache of validated NSEC and NSEC3 ranges, for aggressive negative answers (RFC 8198).
+
+    a denial proven once covers every other name that falls in the same range,
+    so NXDOMAIN and NODATA for those names are synthesized without asking the
+    zone again. a range expires at the earliest of its ttl, the zone's SOA
+    minimum and the expiration of the RRSIG that validated it.
+    """
+    def __init__(self):
+        """initializes an empty negative cache."""
+        self.__soa = {}  # zone name -> (expiry, SOA rrset, RRSIG rrset)
+        self.__nsec = {}  # zone name -> (sorted owner names, {owner: (expiry, rrset, rrsig, types, next owner)})
+        self.__nsec3 = {}  # zone name -> (sorted owner hashes, {hash: (expiry, rrset, rrsig, types, next hash)})
+        self.__params = {}  # zone name -> (algorithm, iterations, salt) of its NSEC3 chain
+
+    def __len__(self) -> int:
+        return sum(len(entries) for _, entries in self.__nsec.values()) + sum(len(entries) for _, entries in self.__nsec3.values())
+
+    @staticmethod
+    def types(rdata) -> frozenset:
+        """returns the rdata types listed in the type bitmap of an NSEC or NSEC3 record.
+
+        @params:
+        - rdata : dns.rdtypes.ANY.NSEC.NSEC or dns.rdtypes.ANY.NSEC3.NSEC3
+        @returns:
+        - frozenset
+        """
+        types = set()
+        for window, bitmap in rdata.windows:
+            for i, octet in enumerate(bitmap):
+                for bit in range(8):
+                    if octet & (0x80 >> bit):
+                        types.add(window * 256 + i * 8 + bit)
+        return frozenset(types)
+
+    def add_soa(self, rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset):
+        """stores the validated SOA rrset of a zone, which bounds its negative ttl."""
+        self.__soa[rrset.name] = (TrustCache.expiry(rrset, rrsig), rrset, rrsig)
+
+    def add(self, zone: dns.name.Name, rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset):
+        """stores a validated NSEC or NSEC3 rrset of a zone.
+
+        @params:
+        - zone : dns.name.Name, the zone that signed the rrset
+        - rrset : dns.rrset.RRset
+        - rrsig : dns.rrset.RRset, the signatures that covered the rrset
+        """
+        expiry = TrustCache.expiry(rrset, rrsig)
+        soa = self.__soa.get(zone)
+        if soa is not None:
+            expiry = min(expiry, time.time() + min(soa[1].ttl, soa[1][0].minimum))
+
+        rdata = rrset[0]
+        if rrset.rdtype == dns.rdatatype.NSEC3:
+            key = rrset.name.labels[0].decode().upper()
+            next_key = base64.b32hexencode(rdata.next).decode()
+            chains = self.__nsec3
+            self.__params[zone] = (rdata.algorithm, rdata.iterations, rdata.salt)
+        else:
+            key, next_key, chains = rrset.name, rdata.next, self.__nsec
+
+        keys, entries = chains.setdefault(zone, ([], {}))
+        if key not in entries:
+            bisect.insort(keys, key)
+        entries[key] = (expiry, rrset, rrsig, self.types(rdata), next_key)
+
+    def __find(self, chains: dict, zone: dns.name.Name, key) -> tuple:
+        """returns (owner, entry) of the live record that matches or covers a key, or None."""
+        if zone not in chains:
+            return None
+        keys, entries = chains[zone]
+        if not keys:
+            return None
+
+        # the record with the greatest owner not after the key, wrapping to the last one
+        owner = keys[bisect.bisect_right(keys, key) - 1]
+        expiry, _, _, _, next_key = entry = entries[owner]
+        if expiry <= time.time():
+            keys.remove(owner)
+            del entries[owner]
+            return None
+        if owner == key:
+            return owner, entry
+
+        # the last record of a chain points back to the first one
+        if owner < key < next_key or (next_key <= owner and (key > owner or key < next_key)):
+            return owner, entry
+        return None
+
+    @staticmethod
+    def __nodata(types: frozenset, qtype: dns.rdatatype) -> bool:
+        """returns whether a matching record's bitmap proves that qtype does not exist."""
+        if qtype in types or dns.rdatatype.CNAME in types:
+            return False
+        # at a delegation the parent only speaks for the DS rrset
+        return qtype == dns.rdatatype.DS or dns.rdatatype.SOA in types or dns.rdatatype.NS not in types
+
+    @staticmethod
+    def __cut(types: frozenset) -> bool:
+        """returns whether names below the owner of a record are outside the zone's authority."""
+        return dns.rdatatype.DNAME in types or (dns.rdatatype.NS in types and dns.rdatatype.SOA not in types)
+
+    @staticmethod
+    def __proof(*entries) -> list:
+        rrsets = []
+        for entry in entries:
+            if entry[1] not in rrsets:
+                rrsets.extend((entry[1], entry[2]))
+        return rrsets
+
+    def __prove_nsec(self, zone: dns.name.Name, qname: dns.name.Name, qtype: dns.rdatatype) -> tuple:
+        found = self.__find(self.__nsec, zone, qname)
+        if found is None:
+            return None
+        owner, entry = found
+        types, next_name = entry[3], entry[4]
+
+        if owner == qname:
+            return (dns.rcode.NOERROR, self.__proof(entry)) if self.__nodata(types, qtype) else None
+        if qname.is_subdomain(owner) and self.__cut(types):
+            return None
+
+        # a covered name whose successor lies below it is an empty non-terminal
+        if next_name.is_subdomain(qname):
+            return dns.rcode.NOERROR, self.__proof(entry)
+
+        # the wildcard at the closest encloser must not exist either
+        common = max(qname.fullcompare(owner)[2], qname.fullcompare(next_name)[2])
+        wildcard = dns.name.Name((b"*",) + qname.split(common)[1].labels)
+        found = self.__find(self.__nsec, zone, wildcard)
+        if found is None or found[0] == wildcard:
+            return None
+        return dns.rcode.NXDOMAIN, self.__proof(entry, found[1])
+
+    def __prove_nsec3(self, zone: dns.name.Name, qname: dns.name.Name, qtype: dns.rdatatype) -> tuple:
+        if zone not in self.__nsec3:
+            return None
+        algorithm, iterations, salt = self.__params[zone]
+
+        def find(name, match):
+            key = dns.dnssec.nsec3_hash(name, salt, iterations, algorithm)
+            found = self.__find(self.__nsec3, zone, key)
+            if found is None or (found[0] == key) != match:
+                return None
+            return found[1]
+
+        entry = find(qname, True)
+        if entry is not None:
+            return (dns.rcode.NOERROR, self.__proof(entry)) if self.__nodata(entry[3], qtype) else None
+        if qname == zone:
+            return None
+
+        # closest encloser proof: the encloser exists, the next closer name and the wildcard do not
+        encloser, closer = qname.parent(), qname
+        while encloser.is_subdomain(zone):
+            ce = find(encloser, True)
+            if ce is not None:
+                break
+            encloser, closer = encloser.parent(), encloser
+        else:
+            return None
+        if self.__cut(ce[3]):
+            return None
+
+        nc = find(closer, False)
+        wildcard = find(dns.name.Name((b"*",) + encloser.labels), False)
+        # an opt-out range may hide unsigned delegations, so it proves nothing
+        if nc is None or wildcard is None or nc[1][0].flags & 1:
+            return None
+        return dns.rcode.NXDOMAIN, self.__proof(ce, nc, wildcard)
+
+    def prove(self, qname: dns.name.Name, qtype: dns.rdatatype) -> tuple:
+        """returns a cached denial of existence for a query, or None.
+
+        @params:
+        - qname : dns.name.Name
+        - qtype : dns.rdatatype
+        @returns:
+        - tuple, (rcode, rrsets) where rrsets are the SOA, NSEC or NSEC3 records and their RRSIGs
+        """
+        # the deepest zone with a live SOA is the one that speaks for the name
+        zone = qname
+        while True:
+            soa = self.__soa.get(zone)
+            if soa is not None and soa[0] > time.time():
+                break
+            if zone == dns.name.root:
+                return None
+            zone = zone.parent()
+
+        proof = self.__prove_nsec(zone, qname, qtype) or self.__prove_nsec3(zone, qname, qtype)
+        if proof is None:
+            return None
+        return proof[0], [soa[1], soa[2]] + proof[1]
+
+
+class VerificationCache:
+    """a bounded lru cache of RRSIG verification verdicts.
+
+    a verdict is keyed by a digest of the canonical rrset, the RRSIG rdata and
+    the DNSKEY rdata it was checked against (key tags included), and is kept no
+    longer than the signatures it covers. a failed verification is only kept
+    for `failure_ttl` seconds, since a signature that is rejected because of
+    clock skew around its inception may verify a moment later.
+    """
+    def __init__(self, maxsize: int = 4096, failure_ttl: float = 5.0):
+        """initializes an empty verification cache.
+
+        @params:
+        - maxsize : int, the maximum number of verdicts kept
+        - failure_ttl : float, the seconds a failed verification is remembered
+        """
+        self.maxsize = maxsize
+        self.failure_ttl = failure_ttl
+        self.__entries = collections.OrderedDict()  # digest -> (expiry, verdict)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        """returns the share of lookups served from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def digest(rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset, dnskey: dns.rrset.RRset) -> bytes:
+        """returns the cache key of a verification.
+
+        @params:
+        - rrset : dns.rrset.RRset, the signed rrset
+        - rrsig : dns.rrset.RRset, its signatures
+        - dnskey : dns.rrset.RRset, the keys it is verified with
+        @returns:
+        - bytes
+        """
+        h = hashlib.sha256()
+        h.update(rrset.name.canonicalize().to_wire())
+        h.update(rrset.rdtype.to_bytes(2, "big") + rrset.rdclass.to_bytes(2, "big"))
+        for rdata in sorted(rd.to_digestable(rrset.name) for rd in rrset):
+            h.update(len(rdata).to_bytes(2, "big") + rdata)
+        for sig in sorted(rd.to_digestable() for rd in rrsig):
+            h.update(sig)
+        h.update(dnskey.name.canonicalize().to_wire())
+        for key in sorted(dnskey, key=dns.dnssec.key_id):
+            h.update(dns.dnssec.key_id(key).to_bytes(2, "big") + key.to_digestable())
+        return h.digest()
+
+    def get(self, digest: bytes) -> bool:
+        """returns a stored verdict, or None on a miss or after the signatures expired."""
+        entry = self.__entries.get(digest)
+        if entry is not None and entry[0] > time.time():
+            self.__entries.move_to_end(digest)
+            self.hits += 1
+            return entry[1]
+
+        if entry is not None:
+            del self.__entries[digest]
+        self.misses += 1
+        return None
+
+    def put(self, digest: bytes, verdict: bool, rrsig: dns.rrset.RRset):
+        """stores a verdict until the earliest expiration among the signatures, a failure for at most `failure_ttl`."""
+        expiry = min(sig.expiration for sig in rrsig)
+        if not verdict:
+            expiry = min(expiry, time.time() + self.failure_ttl)
+        self.__entries[digest] = (expiry, verdict)
+        self.__entries.move_to_end(digest)
+        while len(self.__entries) > self.maxsize:
+            self.__entries.popitem(last=False)
+
+
+class InfraCache:
+    """per-server round-trip statistics used to pick servers and size timeouts.
+
+    the smoothed rtt and its variance follow RFC 6298. a timeout doubles the
+    server's retransmission timeout, so a dead server sinks to the back of every
+    nameserver set until its entry expires and it is probed again. the last
+    `samples` round trips of each server are kept as well, to tell how long an
+    answer may take before the query is worth hedging to another server.
+
+    every server is offered the EDNS UDP payload size `max_payload` (the 1232
+    bytes of DNS flag day 2020). two timeouts in a row drop it to `min_payload`,
+    since a path that loses large fragmented answers looks the same as a server
+    that does not answer. after `probe_after` answers in a row at the lower size
+    the server is offered `max_payload` again, so a transient loss does not pin
+    a busy server to small datagrams and TCP fallback.
+
+    at most `maxsize` servers are kept, the least recently updated going first.
+    """
+    def __init__(self, unknown_rtt: float = 0.376, min_timeout: float = 0.05, max_timeout: float = 2.0, ttl: int = 900, samples: int = 32, min_hedge: float = 0.01, max_payload: int = 1232, min_payload: int = 512, probe_after: int = 64, maxsize: int = 1 << 16):
+        """initializes an empty infrastructure cache.
+
+        @params:
+        - unknown_rtt : float, seconds assumed for a server that was never measured
+        - min_timeout : float, the lower bound of a derived timeout in seconds
+        - max_timeout : float, the upper bound of a derived timeout in seconds
+        - ttl : int, seconds a server's statistics are kept after its last update
+        - samples : int, the recent round trips kept per server
+        - min_hedge : float, the lower bound of a hedge delay in seconds
+        - max_payload : int, the EDNS UDP payload size offered to a server that has not timed out
+        - min_payload : int, the payload size offered after repeated timeouts
+        - probe_after : int, the answers in a row after which a lowered payload size is raised again
+        - maxsize : int, the maximum number of servers kept
+        """
+        self.unknown_rtt = unknown_rtt
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.ttl = ttl
+        self.samples = samples
+        self.min_hedge = min_hedge
+        self.max_payload = max_payload
+        self.min_payload = min_payload
+        self.probe_after = probe_after
+        self.maxsize = maxsize
+        self.__servers = collections.OrderedDict()  # least recently updated first, ip -> [expiry, srtt, rttvar, rto, recent rtts, payload, timeouts in a row, answers in a row at a lowered payload]
+
+    def __entry(self, ip: str) -> list:
+        entry = self.__servers.get(ip)
+        if entry is not None and entry[0] <= time.time():
+            del self.__servers[ip]
+            return None
+        return entry
+
+    def __len__(self) -> int:
+        return len(self.__servers)
+
+    def __update(self, ip: str, entry: list):
+        self.__servers[ip] = entry
+        self.__servers.move_to_end(ip)
+        while len(self.__servers) > self.maxsize:
+            self.__servers.popitem(last=False)
+
+    def srtt(self, ip: str) -> float:
+        """returns the smoothed rtt of a server, or `unknown_rtt` if it was never measured."""
+        entry = self.__entry(ip)
+        return entry[1] if entry is not None else self.unknown_rtt
+
+    def timeout(self, ip: str) -> float:
+        """returns the timeout to use for the next query to a server, derived as srtt + 4 * rttvar.
+
+        @params:
+        - ip : string
+        @returns:
+        - float, seconds
+        """
+        entry = self.__entry(ip)
+        if entry is None:
+            return self.max_timeout
+        return entry[3]
+
+    def payload(self, ip: str) -> int:
+        """returns the EDNS UDP payload size to offer a server.
+
+        @params:
+        - ip : string
+        @returns:
+        - int, bytes
+        """
+        entry = self.__entry(ip)
+        return entry[5] if entry is not None else self.max_payload
+
+    def hedge_delay(self, ip: str, percentile: float = 0.95) -> float:
+        """returns how long to wait for a server before the query is also sent to the next one.
+
+        this is the given percentile of the server's recent round trips, or
+        srtt + 2 * rttvar while there are too few of them, bounded by `min_hedge`
+        and the server's timeout. a server that was never measured is given `unknown_rtt`.
+
+        @params:
+        - ip : string
+        - percentile : float, between 0 and 1
+        @returns:
+        - float, seconds
+        """
+        entry = self.__entry(ip)
+        if entry is None:
+            return min(self.unknown_rtt, self.max_timeout)
+        recent = entry[4]
+        if len(recent) < 4:
+            delay = entry[1] + 2 * entry[2]
+        else:
+            ordered = sorted(recent)
+            delay = ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+        return min(max(delay, self.min_hedge), entry[3])
+
+    def order(self, ips: list) -> list:
+        """returns the servers sorted from the most to the least preferred.
+
+        @params:
+        - ips : list, ip addresses as strings
+        @returns:
+        - list
+        """
+        return sorted(ips, key=self.srtt)
+
+    def record(self, ip: str, rtt: float):
+        """updates the statistics of a server with a measured round trip.
+
+        @params:
+        - ip : string
+        - rtt : float, seconds
+        """
+        entry = self.__entry(ip)
+        if entry is None:
+            srtt, rttvar = rtt, rtt / 2
+            recent = collections.deque(maxlen=self.samples)
+            payload, answers = self.max_payload, 0
+        else:
+            rttvar = 0.75 * entry[2] + 0.25 * abs(entry[1] - rtt)
+            srtt = 0.875 * entry[1] + 0.125 * rtt
+            recent = entry[4]
+            payload, answers = entry[5], (entry[7] + 1 if entry[5] < self.max_payload else 0)
+
+            # probe the larger size again once the server has been answering for a while
+            if answers >= self.probe_after:
+                payload, answers = self.max_payload, 0
+        recent.append(rtt)
+        rto = min(max(srtt + 4 * rttvar, self.min_timeout), self.max_timeout)
+        self.__update(ip, [time.time() + self.ttl, srtt, rttvar, rto, recent, payload, 0, answers])
+
+    def timed_out(self, ip: str):
+        """backs off a server that did not answer in time.
+
+        @params:
+        - ip : string
+        """
+        entry = self.__entry(ip)
+        if entry is None:
+            self.__update(ip, [time.time() + self.ttl, self.max_timeout, self.max_timeout / 2, self.max_timeout, collections.deque(maxlen=self.samples), self.max_payload, 1, 0])
+            return
+        self.__servers.move_to_end(ip)
+        entry[0] = time.time() + self.ttl
+        entry[1] = max(entry[1] * 2, entry[3])
+        entry[3] = min(entry[3] * 2, self.max_timeout)
+        entry[6] += 1
+        entry[7] = 0
+        if entry[6] >= 2:
+            entry[5] = self.min_payload
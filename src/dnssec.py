@@ -1,9 +1,107 @@
+import asyncio
+import concurrent.futures
+import inspect
+import multiprocessing
+import os
+import time
+
 import dns.message
+import dns.name
+import dns.rcode
 import dns.rdatatype
 import dns.dnssec
 import dns.rrset
 
-from .utils import get_rrset, get_dnskey, query
+from .cache import NegativeCache, TrustCache, VerificationCache
+from .trace import tracer
+from .utils import get_rrset, get_dnskey, aquery, hedged, infra_cache, run_sync
+
+
+
+# validated DNSKEY and DS rrsets, shared by every resolution in this process
+trust_cache = TrustCache()
+
+# validated NSEC and NSEC3 ranges, so names inside them are denied without a walk
+negative_cache = NegativeCache()
+
+# RRSIG verification verdicts, so each distinct signature is checked once
+verification_cache = VerificationCache()
+
+# the executor RRSIG verifications run on, None verifies on the event loop's thread
+verification_pool = None
+
+
+def use_verification_pool(workers: int = None, processes: bool = False):
+    """sends RRSIG verifications to a pool of worker threads or processes.
+
+    the independent verifications of a response then run concurrently, and
+    concurrent resolutions no longer queue behind each other's cryptography.
+
+    @params:
+    - workers : int, the pool size, defaults to the number of cores, 0 verifies inline again
+    - processes : bool, use worker processes, which are not bound by the GIL but pickle every rrset;
+      they are spawned, so the calling script needs an `if __name__ == '__main__'` guard
+    """
+    global verification_pool
+    if verification_pool is not None:
+        verification_pool.shutdown(wait=False)
+        verification_pool = None
+    if workers == 0:
+        return
+
+    workers = workers or os.cpu_count() or 1
+    if processes:
+        # spawned workers do not inherit the background event loop thread
+        verification_pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    else:
+        verification_pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="dnssec-verify")
+
+
+def check(rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset, dnskey: dns.rrset.RRset) -> bool:
+    """verifies the RRSig of an RRSet with a DNSKEY RRSet, without memoization.
+
+    this is what the pool workers run, so it only touches its arguments.
+
+    @params:
+    - rrset : dns.rrset.RRset
+    - rrsig : dns.rrset.RRset
+    - dnskey : dns.rrset.RRset
+    @returns:
+    - bool
+    """
+    try:
+        dns.dnssec.validate(rrset=rrset, rrsigset=rrsig, keys={dnskey.name: dnskey})
+    except dns.dnssec.ValidationFailure:
+        return False
+    return True
+
+
+async def verify(rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset, dnskey: dns.rrset.RRset):
+    """verifies the RRSig of an RRSet with a DNSKEY RRSet on `verification_pool`, memoizing the verdict.
+
+    @params:
+    - rrset : dns.rrset.RRset
+    - rrsig : dns.rrset.RRset
+    - dnskey : dns.rrset.RRset
+    @raises:
+    - dns.dnssec.ValidationFailure
+    """
+    if rrset is None or rrsig is None or dnskey is None:
+        raise dns.dnssec.ValidationFailure("missing rrset, RRSIG or DNSKEY")
+
+    digest = verification_cache.digest(rrset, rrsig, dnskey)
+    verdict = verification_cache.get(digest)
+    if tracer.enabled:
+        tracer.emit("cache", cache="verification", hit=verdict is not None)
+    if verdict is None:
+        if verification_pool is None:
+            verdict = check(rrset, rrsig, dnskey)
+        else:
+            verdict = await asyncio.get_running_loop().run_in_executor(verification_pool, check, rrset, rrsig, dnskey)
+        verification_cache.put(digest, verdict, rrsig)
+
+    if not verdict:
+        raise dns.dnssec.ValidationFailure("RRSIG verification failed")
 
 
 
@@ -27,7 +125,8 @@ def zone_validation(rrset: dns.rrset.RRset, ksk: dns.rrset.RRset) -> bool:
         # generating the DS record from the PubKSK of the child
         hash = dns.dnssec.make_ds(name=zone, key=ksk, algorithm=method)
     except dns.dnssec.ValidationFailure as e:
-        print(e)
+        if tracer.enabled:
+            tracer.log("ERROR", str(e))
         return False
     
     # comparing the DS record of the parent zone with the PubKSK of the child zone
@@ -37,7 +136,7 @@ def zone_validation(rrset: dns.rrset.RRset, ksk: dns.rrset.RRset) -> bool:
         return False
 
 
-def dnskey_validation(rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset) -> bool:
+async def dnskey_validation(rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset) -> bool:
     """validates the DNSKEY RRSet by verifying the RRSig with the PubZSK.
     
     @params:
@@ -48,15 +147,16 @@ def dnskey_validation(rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset) -> bool:
     """
     try:
         # validating the DNSKEY RRSet by verifying the RRSig with the PubZSK
-        dns.dnssec.validate(rrset=rrset, rrsigset=rrsig, keys={rrset.name: rrset})
+        await verify(rrset, rrsig, rrset)
     except dns.dnssec.ValidationFailure as e:
-        print(e)
+        if tracer.enabled:
+            tracer.log("ERROR", str(e))
         return False
 
     return True
 
 
-def ds_validation(rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset, dnskey: dns.rrset.RRset) -> bool:
+async def ds_validation(rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset, dnskey: dns.rrset.RRset) -> bool:
     """validates the DS RRSet by verifying the RRSig with the DNSKEY RRSet.
     
     @params:
@@ -68,21 +168,122 @@ def ds_validation(rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset, dnskey: dns.rr
     """
     try:
         # validating the DS RRSet by verifying the RRSig with the DNSKEY RRSet
-        dns.dnssec.validate(rrset = rrset, rrsigset = rrsig, keys = {dnskey.name: dnskey})
+        await verify(rrset, rrsig, dnskey)
     except dns.dnssec.ValidationFailure as e:
-        print(e)
+        if tracer.enabled:
+            tracer.log("ERROR", str(e))
         return False
 
     return True
 
 
-def dnssec_validation(response: dns.rrset.RRset, dnskey: dns.rrset.RRset, ds_rrset: dns.rrset.RRset) -> tuple[bool, dns.rrset.RRset]:
+async def nsec_validation(rrset: dns.rrset.RRset, rrsig: dns.rrset.RRset, dnskey: dns.rrset.RRset) -> bool:
+    """validates an SOA, NSEC or NSEC3 RRSet of a negative response by verifying the RRSig with the DNSKEY RRSet.
+
+    @params:
+    - rrset : dns.rrset.RRset
+    - rrsig : dns.rrset.RRset
+    - dnskey : dns.rrset.RRset
+    @returns:
+    - bool
+    """
+    try:
+        await verify(rrset, rrsig, dnskey)
+    except dns.dnssec.ValidationFailure as e:
+        if tracer.enabled:
+            tracer.log("ERROR", str(e))
+        return False
+
+    return True
+
+
+async def timed_step(step: str, zone: dns.name.Name, validation, *args) -> bool:
+    """runs a validation step, emitting its duration and verdict when tracing is enabled.
+
+    @params:
+    - step : string, the step name (zone, dnskey, ds, soa, nsec)
+    - zone : dns.name.Name, the zone being validated
+    - validation : callable, one of the `*_validation` functions, which may be a coroutine function
+    - args : the arguments of the validation
+    @returns:
+    - bool
+    """
+    start_time = time.perf_counter()
+    ok = validation(*args)
+    if inspect.isawaitable(ok):
+        ok = await ok
+    if tracer.enabled:
+        tracer.emit("validation", step=step, zone=zone.to_text(), duration=time.perf_counter() - start_time, ok=ok)
+    return ok
+
+
+def log(level: str, message: str):
+    """reports resolution progress through the tracer."""
+    if tracer.enabled:
+        tracer.log(level, message)
+
+
+def candidate_keys(dnskey: dns.message.Message, zone: dns.name.Name) -> dns.rrset.RRset:
+    """returns the cached DNSKEY RRSet of a zone, or the fetched one before it is validated.
+
+    signatures made with these keys are verified while `zone_keys` validates
+    them, and only count once it succeeded.
+    """
+    keys = trust_cache.dnskey(zone)
+    if keys is None and dnskey is not None:
+        keys, _ = get_dnskey(dnskey.answer)
+    return keys
+
+
+async def zone_keys(dnskey: dns.message.Message, ds_rrset: dns.rrset.RRset, zone: dns.name.Name) -> dns.rrset.RRset:
+    """returns the validated DNSKEY RRSet of a zone, from `trust_cache` or by validating the fetched one against the parent DS.
+
+    @params:
+    - dnskey : dns.message.Message, the DNSKEY response, may be None when the zone's DNSKEY RRSet is cached
+    - ds_rrset : dns.rrset.RRset
+    - zone : dns.name.Name
+    @returns:
+    - dns.rrset.RRset, or None when validation failed
+    """
+    dnskey_rrset = trust_cache.dnskey(zone)
+    if tracer.enabled:
+        tracer.emit("cache", cache="dnskey", hit=dnskey_rrset is not None)
+    if dnskey_rrset is not None:
+        return dnskey_rrset
+
+    if dnskey is None:
+        log("ERROR", "DNSSEC validation failed (missing DNSKEY)")
+        return None
+
+    # get the DNSKEY RRSet and the KSK from the answer section
+    dnskey_rrsig = get_rrset(dnskey.answer, dns.rdatatype.RRSIG)
+    dnskey_rrset, ksk = get_dnskey(dnskey.answer)
+
+    # validate the zone
+    if not await timed_step("zone", zone, zone_validation, ds_rrset, ksk):
+        log("ERROR", "DNSSEC validation failed (zone validation)")
+        return None
+
+    # validate the DNSKEY RRSet
+    if not await timed_step("dnskey", zone, dnskey_validation, dnskey_rrset, dnskey_rrsig):
+        log("ERROR", "DNSSEC validation failed (DNSKEY validation)")
+        return None
+
+    trust_cache.add_dnskey(dnskey_rrset, dnskey_rrsig)
+    return dnskey_rrset
+
+
+async def dnssec_validation(response: dns.rrset.RRset, dnskey: dns.rrset.RRset, ds_rrset: dns.rrset.RRset, zone: dns.name.Name = dns.name.root) -> tuple[bool, dns.rrset.RRset]:
     """validates the DNSSEC response.
-    
+
+    the DNSKEY RRSet of the zone and the DS RRSet of the response are taken from
+    `trust_cache` when they were already validated, skipping their verification.
+
     @params:
     - response : dns.rrset.RRset
-    - dnskey : dns.rrset.RRset
+    - dnskey : dns.rrset.RRset, may be None when the zone's DNSKEY RRSet is cached
     - ds_rrset : dns.rrset.RRset
+    - zone : dns.name.Name, the zone that signed the response
     @returns:
     - tuple[bool, dns.rrset.RRset]
     """
@@ -93,9 +294,6 @@ def dnssec_validation(response: dns.rrset.RRset, dnskey: dns.rrset.RRset, ds_rrs
             has_a_record = True
             break
 
-    # get the DNSKEY RRSet and the KSK from the answer section
-    dnskey_rrsig = get_rrset(dnskey.answer, dns.rdatatype.RRSIG)
-    dnskey_rrset, ksk = get_dnskey(dnskey.answer)
     rr_section, rrset_type = (response.answer, dns.rdatatype.A) if has_a_record else (response.authority, dns.rdatatype.DS)
 
     # get the DS RRSet and the RRSig from the answer section
@@ -104,31 +302,170 @@ def dnssec_validation(response: dns.rrset.RRset, dnskey: dns.rrset.RRset, ds_rrs
 
     # validate the zone
     if rrset is None:
-        print("DNSSEC not supported")
+        log("ERROR", "DNSSEC not supported")
         return False, rrset
-    
-    # validate the zone
-    if not zone_validation(ds_rrset, ksk):
-        print("DNSSEC validation failed (zone validation)")
-        return False, rrset
-    
-    # validate the DNSKEY RRSet
-    if not dnskey_validation(dnskey_rrset, dnskey_rrsig):
-        print("DNSSEC validation failed (DNSKEY validation)")
+
+    # a DS RRSet identical to an already validated one needs no new verification
+    cached = False
+    if rrset_type == dns.rdatatype.DS:
+        cached = trust_cache.ds(rrset.name) == rrset
+        if tracer.enabled:
+            tracer.emit("cache", cache="ds", hit=cached)
+
+    # use the cached DNSKEY RRSet, or validate the fetched one against the parent DS,
+    # while the RRSet of the response is verified with the same keys
+    steps = [zone_keys(dnskey, ds_rrset, zone)]
+    if not cached:
+        steps.append(timed_step("ds", zone, ds_validation, rrset, rrsig, candidate_keys(dnskey, zone)))
+    dnskey_rrset, *verdicts = await asyncio.gather(*steps)
+    if dnskey_rrset is None:
         return False, rrset
-    
+
+    if cached:
+        log("INFO", "DNSSEC validation successful (cached)")
+        return True, rrset
+
     # validate the DS RRSet
-    if not ds_validation(rrset, rrsig, dnskey_rrset):
-        print("DNSSEC validation failed (DS validation)")
+    if not verdicts[0]:
+        log("ERROR", "DNSSEC validation failed (DS validation)")
         return False, rrset
-    
-    print("DNSSEC validation successful")
-    
+
+    if rrset_type == dns.rdatatype.DS:
+        trust_cache.add_ds(rrset, rrsig)
+
+    log("INFO", "DNSSEC validation successful")
+
     return True, rrset
 
 
-def resolve(roots: list, domain: str, qtype: dns.rdatatype, retrys: int, CNAME: bool = False, RAR: bool = False) -> tuple[dns.message.Message, bool]:
-    """resolves the domain name iteratively.
+def is_negative(response: dns.message.Message) -> bool:
+    """returns whether a response is an NXDOMAIN or NODATA answer from the zone itself."""
+    if response.rcode() == dns.rcode.NXDOMAIN:
+        return True
+    return response.rcode() == dns.rcode.NOERROR and not response.answer and get_rrset(response.authority, dns.rdatatype.SOA) is not None
+
+
+async def negative_validation(response: dns.message.Message, dnskey: dns.message.Message, ds_rrset: dns.rrset.RRset, zone: dns.name.Name) -> bool:
+    """validates the SOA and NSEC/NSEC3 RRSets of a negative response and caches their ranges in `negative_cache`.
+
+    @params:
+    - response : dns.message.Message
+    - dnskey : dns.message.Message, may be None when the zone's DNSKEY RRSet is cached
+    - ds_rrset : dns.rrset.RRset
+    - zone : dns.name.Name, the zone that signed the response
+    @returns:
+    - bool, True when every record validated and together they deny the question
+    """
+    soa = get_rrset(response.authority, dns.rdatatype.SOA)
+    if soa is None:
+        log("ERROR", "DNSSEC validation failed (missing SOA)")
+        return False
+    nsecs = [rrset for rrset in response.authority if rrset.rdtype in (dns.rdatatype.NSEC, dns.rdatatype.NSEC3) and rrset.name.is_subdomain(zone)]
+
+    # pair every RRSet of the authority section with the RRSig that covers it
+    sigs = {(rrset.name, rrset.covers): rrset for rrset in response.authority if rrset.rdtype == dns.rdatatype.RRSIG}
+
+    # the zone's keys, the SOA and every NSEC RRSet are verified concurrently
+    keys = candidate_keys(dnskey, zone)
+    dnskey_rrset, soa_ok, *nsecs_ok = await asyncio.gather(
+        zone_keys(dnskey, ds_rrset, zone),
+        timed_step("soa", zone, nsec_validation, soa, sigs.get((soa.name, soa.rdtype)), keys),
+        *(timed_step("nsec", zone, nsec_validation, rrset, sigs.get((rrset.name, rrset.rdtype)), keys) for rrset in nsecs),
+    )
+    if dnskey_rrset is None:
+        return False
+    if not soa_ok:
+        log("ERROR", "DNSSEC validation failed (SOA validation)")
+        return False
+    if not all(nsecs_ok):
+        log("ERROR", "DNSSEC validation failed (NSEC validation)")
+        return False
+
+    negative_cache.add_soa(soa, sigs[(soa.name, soa.rdtype)])
+    for rrset in nsecs:
+        negative_cache.add(zone, rrset, sigs[(rrset.name, rrset.rdtype)])
+
+    question = response.question[0]
+    if negative_cache.prove(question.name, question.rdtype) is None:
+        log("ERROR", "DNSSEC validation failed (no proof of nonexistence)")
+        return False
+
+    log("INFO", "DNSSEC validation successful (denial of existence)")
+    return True
+
+
+def synthesize(domain: str, qtype: dns.rdatatype) -> dns.message.Message:
+    """answers NXDOMAIN or NODATA from validated NSEC/NSEC3 ranges, without upstream queries (RFC 8198).
+
+    @params:
+    - domain : string
+    - qtype : dns.rdatatype
+    @returns:
+    - dns.message.Message, or None when no cached range proves the answer
+    """
+    query = dns.message.make_query(dns.name.from_text(domain), qtype, want_dnssec=True)
+    proof = negative_cache.prove(query.question[0].name, query.question[0].rdtype)
+    if tracer.enabled:
+        tracer.emit("cache", cache="negative", hit=proof is not None)
+    if proof is None:
+        return None
+
+    rcode, rrsets = proof
+    response = dns.message.make_response(query)
+    response.set_rcode(rcode)
+    response.authority.extend(rrsets)
+    return response
+
+
+async def hop_queries(zone: dns.name.Name, domain: str, qtype: dns.rdatatype, ip: str, port: int = 53) -> tuple[dns.message.Message, dns.message.Message]:
+    """sends the data query and, unless the zone's keys are cached, its DNSKEY query to one server concurrently.
+
+    if either query fails the other one is abandoned, so the walk moves on to the
+    next server after a single timeout.
+
+    @params:
+    - zone : dns.name.Name, the zone the server is authoritative for
+    - domain : string
+    - qtype : dns.rdatatype
+    - ip : string
+    - port : int
+    @returns:
+    - tuple[dns.message.Message, dns.message.Message], the DNSKEY response (None when cached) and the data response
+    """
+    data = asyncio.ensure_future(aquery(domain, qtype, ip, True, port))
+    if trust_cache.dnskey(zone):
+        return None, await data
+
+    dnskey = asyncio.ensure_future(aquery(zone.to_text(), dns.rdatatype.DNSKEY, ip, True, port))
+    try:
+        dnskey_response, data_response = await asyncio.gather(dnskey, data)
+    except BaseException:
+        dnskey.cancel()
+        data.cancel()
+        raise
+    return dnskey_response, data_response
+
+
+def resolve(roots: list, domain: str, qtype: dns.rdatatype, retrys: int, CNAME: bool = False, RAR: bool = False, anchor: str = None, port: int = 53) -> tuple[dns.message.Message, bool]:
+    """resolves the domain name iteratively, blocking until `aresolve` returns.
+
+    @params:
+    - roots : list
+    - domain : string
+    - qtype : dns.rdatatype
+    - retrys : int
+    - CNAME : bool
+    - RAR : bool
+    - anchor : string, the root DS in text format, defaults to the IANA root KSK
+    - port : int
+    @returns:
+    - tuple[dns.message.Message, bool]
+    """
+    return run_sync(aresolve(roots, domain, qtype, retrys, CNAME, RAR, anchor, port))
+
+
+async def aresolve(roots: list, domain: str, qtype: dns.rdatatype, retrys: int, CNAME: bool = False, RAR: bool = False, anchor: str = None, port: int = 53) -> tuple[dns.message.Message, bool]:
+    """resolves the domain name iteratively without blocking the event loop.
     
     @params:
     - roots : list
@@ -137,27 +474,48 @@ def resolve(roots: list, domain: str, qtype: dns.rdatatype, retrys: int, CNAME:
     - retrys : int
     - CNAME : bool
     - RAR : bool
+    - anchor : string, the root DS in text format, defaults to the IANA root KSK
+    - port : int
     @returns:
     - tuple[dns.message.Message, bool]
     """
-    # iterate over the root servers
-    for ip in roots:
+    # names inside an already proven NSEC/NSEC3 range are denied without any query
+    synthesized = synthesize(domain, qtype)
+    if synthesized is not None:
+        log("INFO", f"{domain} denied from cached NSEC records")
+        return synthesized, True
+
+    # the root KSK is checked against the configured anchor, or the built-in one
+    root_anchor = None if anchor is None else dns.rrset.from_text(dns.name.root, 0, 'IN', 'DS', anchor)
+
+    # iterate over the root servers, fastest measured first, hedging to the next ones when one is late
+    servers = infra_cache.order(roots)
+    while servers:
         dns_response = None
 
-        # query the root server
+        # query the root server, fetching its DNSKEY only when it is not cached
         try:
-            root_dnskey_response = query('.', dns.rdatatype.DNSKEY, ip, True)
-            root_dns_response = query(domain, qtype, ip, True)
+            (root_dnskey_response, root_dns_response), ip = await hedged(lambda server: hop_queries(dns.name.root, domain, qtype, server, port), servers)
+            servers.remove(ip)
         except Exception as e:
-            print(e)
+            if tracer.enabled:
+                tracer.log("ERROR", f"root {servers[0]}: {e!r}")
+            servers.pop(0)
             continue
 
         # reset the DNS response
         dns_response = root_dns_response
 
+        # a denial from the root is final once its NSEC records prove it
+        if is_negative(root_dns_response):
+            if await negative_validation(root_dns_response, root_dnskey_response, root_anchor, dns.name.root):
+                return root_dns_response, True
+            continue
+
         # validate the DNSSEC response
-        print(f"[INFO] validating root {ip} DNSSEC for {domain}")
-        root_validated, root_ds_rrset = dnssec_validation(root_dns_response, root_dnskey_response, None)
+        if tracer.enabled:
+            tracer.log("INFO", f"validating root {ip} DNSSEC for {domain}")
+        root_validated, root_ds_rrset = await dnssec_validation(root_dns_response, root_dnskey_response, root_anchor)
         if not root_validated:
             continue
 
@@ -173,40 +531,52 @@ def resolve(roots: list, domain: str, qtype: dns.rdatatype, retrys: int, CNAME:
             # check if the threshold is reached
             threshold += 1
             if threshold > retrys:
-                print("[ERROR] Retry threshold reached, could not resolve domain name.")
+                log("ERROR", "Retry threshold reached, could not resolve domain name.")
                 return dns_response, False
 
-            # iterate over the additional section
+            # iterate over the additional section, fastest measured server first, hedging to the next ones when one is late
             if dns_response.additional:
-                for rrset in dns_response.additional:
-                    if rrset[0].rdtype == dns.rdatatype.A:
-                        # get the IP address of the next authoritative name server
-                        next_ip = rrset[0].address
-                        try:
-                            # query the next authoritative name server
-                            ns_dnskey_response = query(parent_ds_rrset.name.to_text(), dns.rdatatype.DNSKEY, next_ip, True)
-                            ns_dns_response = query(domain, qtype, next_ip, True)
-
-                            # validate the DNSSEC response
-                            print(f"[INFO] validating {next_ip} DNSSEC for {domain}")
-                            ns_validated, ns_ds_rrset = dnssec_validation(ns_dns_response, ns_dnskey_response, parent_ds_rrset)
-                            if not ns_validated:
-                                continue
-
-                            # update the parent DS RRSet
-                            parent_ds_rrset = ns_ds_rrset
-                            dns_response = ns_dns_response
-
-                            # check if the response has a CNAME record
-                            if CNAME and ns_dns_response.answer and ns_dns_response.answer[0].rdtype == dns.rdatatype.CNAME:
-                                return ns_dns_response, True
-                            elif RAR and ns_dns_response.answer and ns_dns_response.answer[0].rdtype == dns.rdatatype.A:
+                additional = [rrset[0].address for rrset in dns_response.additional if rrset[0].rdtype == dns.rdatatype.A]
+                next_ips = infra_cache.order(list(dict.fromkeys(additional)))
+                while next_ips:
+                    # query the next authoritative name servers, fetching their DNSKEY only when it is not cached
+                    zone = parent_ds_rrset.name
+                    try:
+                        (ns_dnskey_response, ns_dns_response), next_ip = await hedged(lambda server: hop_queries(zone, domain, qtype, server, port), next_ips)
+                    except Exception as e:
+                        if tracer.enabled:
+                            tracer.log("ERROR", f"{next_ips[0]}: {e!r}")
+                        next_ips.pop(0)
+                        continue
+                    next_ips.remove(next_ip)
+
+                    try:
+                        # validate the DNSSEC response
+                        if tracer.enabled:
+                            tracer.log("INFO", f"validating {next_ip} DNSSEC for {domain}")
+                        if is_negative(ns_dns_response):
+                            if await negative_validation(ns_dns_response, ns_dnskey_response, parent_ds_rrset, zone):
                                 return ns_dns_response, True
-                            
-                            break
-                        except Exception as e:
-                            print(e)
-            
+                            continue
+                        ns_validated, ns_ds_rrset = await dnssec_validation(ns_dns_response, ns_dnskey_response, parent_ds_rrset, zone)
+                        if not ns_validated:
+                            continue
+
+                        # update the parent DS RRSet
+                        parent_ds_rrset = ns_ds_rrset
+                        dns_response = ns_dns_response
+
+                        # check if the response has a CNAME record
+                        if CNAME and ns_dns_response.answer and ns_dns_response.answer[0].rdtype == dns.rdatatype.CNAME:
+                            return ns_dns_response, True
+                        elif RAR and ns_dns_response.answer and ns_dns_response.answer[0].rdtype == dns.rdatatype.A:
+                            return ns_dns_response, True
+
+                        break
+                    except Exception as e:
+                        if tracer.enabled:
+                            tracer.log("ERROR", f"{next_ip}: {e!r}")
+
             # check if the response has an authority section with a SOA record
             if dns_response.authority and dns_response.authority[0].rdtype == dns.rdatatype.SOA:
                 break
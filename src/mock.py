@@ -0,0 +1,422 @@
+import asyncio
+import bisect
+import random
+import struct
+import threading
+import time
+
+import dns.dnssec
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdata
+import dns.rdatatype
+import dns.rrset
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+
+
+class MockZone:
+    """a signed authoritative zone served by one or more loopback addresses.
+
+    every rrset is signed once when the zone is built, so answering a query
+    costs no cryptography. the NSEC or NSEC3 chain that proves negative
+    answers is signed on the first negative answer after the zone changes.
+    """
+    def __init__(self, origin: str, ip: str, algorithm: dns.dnssec.Algorithm = dns.dnssec.Algorithm.ECDSAP256SHA256, ttl: int = 3600, nsec3: bool = False, replicas: list = ()):
+        """initializes a zone with its SOA, apex NS and in-zone nameserver addresses.
+
+        @params:
+        - origin : string, the zone apex (e.g., "com.")
+        - ip : string, the loopback address serving the zone
+        - algorithm : dns.dnssec.Algorithm, the signing algorithm
+        - ttl : int, the ttl of the zone's infrastructure records
+        - nsec3 : bool, deny existence with hashed NSEC3 records instead of NSEC
+        - replicas : list, further loopback addresses serving the zone, each under its own nameserver name
+        """
+        self.origin = dns.name.from_text(origin)
+        self.ip = ip
+        self.ips = [ip, *replicas]
+        self.ttl = ttl
+        self.nsec3 = nsec3
+        self.children = {}  # child zone name -> MockZone
+        self.glue = {}  # nameserver name -> A rrset
+        self.queries = 0
+
+        self.__rrsets = {}  # (name, rdtype) -> rrset
+        self.__sigs = {}  # (name, rdtype) -> RRSIG rrset
+        self.__names = set()
+        self.__chain = None  # (sorted keys, {key: (rrset, RRSIG rrset)}, existing names), built on demand
+
+        # a single key acts as both KSK and ZSK
+        if algorithm == dns.dnssec.Algorithm.RSASHA256:
+            self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        else:
+            self.key = ec.generate_private_key(ec.SECP256R1())
+        self.dnskey = dns.dnssec.make_dnskey(self.key.public_key(), algorithm, flags=257)
+
+        # ns, ns2, ns3, ... one nameserver name per address
+        parent = self.origin if self.origin != dns.name.root else dns.name.from_text("root-servers.net.")
+        self.nameservers = [dns.name.from_text(f"ns{i + 1 if i else ''}", parent) for i in range(len(self.ips))]
+        nameserver = self.nameserver = self.nameservers[0]
+        hostmaster = dns.name.from_text("hostmaster", self.origin)
+        self.add(dns.rrset.from_text(self.origin, ttl, "IN", "SOA", f"{nameserver} {hostmaster} 1 3600 600 86400 60"))
+        self.add(dns.rrset.from_text(self.origin, ttl, "IN", "NS", *(ns.to_text() for ns in self.nameservers)))
+        self.add(dns.rrset.from_rdata(self.origin, ttl, self.dnskey))
+        if nsec3:
+            self.add(dns.rrset.from_text(self.origin, ttl, "IN", "NSEC3PARAM", "1 0 0 -"))
+        for ns, address in zip(self.nameservers, self.ips):
+            if ns.is_subdomain(self.origin):
+                self.add(dns.rrset.from_text(ns, ttl, "IN", "A", address))
+
+    def ds(self) -> dns.rrset.RRset:
+        """returns the DS rrset the parent publishes for this zone."""
+        return dns.rrset.from_rdata(self.origin, self.ttl, dns.dnssec.make_ds(self.origin, self.dnskey, "SHA256"))
+
+    def __sign(self, rrset: dns.rrset.RRset) -> dns.rrset.RRset:
+        now = int(time.time())
+        sig = dns.dnssec.sign(rrset, self.key, self.origin, self.dnskey, inception=now - 3600, expiration=now + 30 * 86400)
+        return dns.rrset.from_rdata(rrset.name, rrset.ttl, sig)
+
+    def add(self, rrset: dns.rrset.RRset):
+        """adds and signs an authoritative rrset."""
+        self.__rrsets[(rrset.name, rrset.rdtype)] = rrset
+        self.__sigs[(rrset.name, rrset.rdtype)] = self.__sign(rrset)
+        self.__names.add(rrset.name)
+        self.__chain = None
+
+    def delegate(self, child: "MockZone"):
+        """delegates a child zone with signed DS records and glue."""
+        self.children[child.origin] = child
+        self.add(child.ds())
+        self.__rrsets[(child.origin, dns.rdatatype.NS)] = dns.rrset.from_text(child.origin, self.ttl, "IN", "NS", *(ns.to_text() for ns in child.nameservers))
+        self.__names.add(child.origin)
+        self.__chain = None
+        for ns, address in zip(child.nameservers, child.ips):
+            self.glue[ns] = dns.rrset.from_text(ns, self.ttl, "IN", "A", address)
+
+    def __signed(self, section: list, key: tuple, dnssec: bool):
+        section.append(self.__rrsets[key])
+        if dnssec and key in self.__sigs:
+            section.append(self.__sigs[key])
+
+    def __hash(self, name: dns.name.Name) -> str:
+        return dns.dnssec.nsec3_hash(name, None, 0, dns.dnssec.NSEC3Hash.SHA1)
+
+    def __build_chain(self) -> tuple:
+        """signs the NSEC or NSEC3 chain over every name the zone is authoritative for."""
+        # names below a zone cut are occluded, while empty non-terminals exist without records
+        names = {name for name in self.__names if not any(name != child and name.is_subdomain(child) for child in self.children)}
+        for name in list(names):
+            while name != self.origin:
+                name = name.parent()
+                names.add(name)
+
+        types = {name: set() for name in names}
+        for name, rdtype in self.__rrsets:
+            if name in types:
+                types[name].add(rdtype)
+                if (name, rdtype) in self.__sigs:
+                    types[name].add(dns.rdatatype.RRSIG)
+
+        soa = self.__rrsets[(self.origin, dns.rdatatype.SOA)]
+        ttl = min(soa.ttl, soa[0].minimum)
+        records = {}
+        if self.nsec3:
+            hashes = {self.__hash(name): name for name in names}
+            keys = sorted(hashes)
+            for i, key in enumerate(keys):
+                bitmap = " ".join(sorted(dns.rdatatype.to_text(t) for t in types[hashes[key]]))
+                rdata = dns.rdata.from_text("IN", "NSEC3", f"1 0 0 - {keys[(i + 1) % len(keys)]} {bitmap}")
+                rrset = dns.rrset.from_rdata(dns.name.from_text(key, self.origin), ttl, rdata)
+                records[key] = (rrset, self.__sign(rrset))
+        else:
+            keys = sorted(name for name in names if types[name])
+            for i, name in enumerate(keys):
+                bitmap = " ".join(sorted(dns.rdatatype.to_text(t) for t in types[name] | {dns.rdatatype.NSEC}))
+                rdata = dns.rdata.from_text("IN", "NSEC", f"{keys[(i + 1) % len(keys)]} {bitmap}")
+                rrset = dns.rrset.from_rdata(name, ttl, rdata)
+                records[name] = (rrset, self.__sign(rrset))
+
+        self.__chain = (keys, records, names)
+        return self.__chain
+
+    def __denial(self, name: dns.name.Name) -> list:
+        """returns the NSEC or NSEC3 records, with their RRSIGs, that deny a name or its type."""
+        keys, records, names = self.__chain or self.__build_chain()
+
+        def find(key):
+            # the record with the greatest owner not after the key, which matches or covers it
+            return records[keys[bisect.bisect_right(keys, key) - 1]]
+
+        if name in names:
+            proof = [find(self.__hash(name) if self.nsec3 else name)]
+        else:
+            encloser, closer = name.parent(), name
+            while encloser not in names:
+                encloser, closer = encloser.parent(), encloser
+            wildcard = dns.name.Name((b"*",) + encloser.labels)
+            if self.nsec3:
+                proof = [find(self.__hash(encloser)), find(self.__hash(closer)), find(self.__hash(wildcard))]
+            else:
+                proof = [find(name), find(wildcard)]
+
+        section = []
+        for rrset, sig in proof:
+            if rrset not in section:
+                section.extend((rrset, sig))
+        return section
+
+    def respond(self, query: dns.message.Message) -> dns.message.Message:
+        """answers a query the way an authoritative server for the zone would.
+
+        @params:
+        - query : dns.message.Message
+        @returns:
+        - dns.message.Message
+        """
+        self.queries += 1
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        name, rdtype = question.name, question.rdtype
+        dnssec = bool(query.ednsflags & dns.flags.DO)
+
+        if not name.is_subdomain(self.origin):
+            response.set_rcode(dns.rcode.REFUSED)
+            return response
+
+        # refer queries below a zone cut, except DS at the cut which the parent answers
+        for child in self.children:
+            if name.is_subdomain(child) and not (name == child and rdtype == dns.rdatatype.DS):
+                response.authority.append(self.__rrsets[(child, dns.rdatatype.NS)])
+                if dnssec:
+                    self.__signed(response.authority, (child, dns.rdatatype.DS), True)
+                for nameserver in self.children[child].nameservers:
+                    if nameserver in self.glue:
+                        response.additional.append(self.glue[nameserver])
+                return response
+
+        response.flags |= dns.flags.AA
+        if (name, rdtype) in self.__rrsets:
+            self.__signed(response.answer, (name, rdtype), dnssec)
+        elif (name, dns.rdatatype.CNAME) in self.__rrsets:
+            self.__signed(response.answer, (name, dns.rdatatype.CNAME), dnssec)
+        else:
+            _, _, names = self.__chain or self.__build_chain()
+            if name not in names:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            self.__signed(response.authority, (self.origin, dns.rdatatype.SOA), dnssec)
+            if dnssec:
+                response.authority.extend(self.__denial(name))
+        return response
+
+
+def _datagram(zone: MockZone, query: dns.message.Message) -> bytes:
+    """returns the zone's answer to a query, truncated to the payload size the query offers."""
+    response = zone.respond(query)
+    max_size = max(512, query.payload) if query.edns >= 0 else 512
+    try:
+        return response.to_wire(max_size=max_size)
+    except dns.exception.TooBig:
+        response.answer, response.authority, response.additional = [], [], []
+        response.flags |= dns.flags.TC
+        return response.to_wire(max_size=max_size)
+
+
+class _ZoneProtocol(asyncio.DatagramProtocol):
+    """answers every datagram from a zone's prebuilt responses, after an optional one-way delay.
+
+    answers that do not fit the query's payload size are truncated, and a
+    `loss` share of the queries is dropped unanswered, the way a lossy path would.
+    """
+    def __init__(self, zone: MockZone, delay: float = 0.0, loss: float = 0.0):
+        self.zone = zone
+        self.delay = delay
+        self.loss = loss
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            query = dns.message.from_wire(data)
+        except Exception:
+            return
+        if self.loss and random.random() < self.loss:
+            self.zone.queries += 1
+            return
+        wire = _datagram(self.zone, query)
+        if self.delay:
+            asyncio.get_running_loop().call_later(self.delay, self.transport.sendto, wire, addr)
+        else:
+            self.transport.sendto(wire, addr)
+
+
+async def _serve_tcp(zone: MockZone, delay: float, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """answers length-prefixed queries on a TCP connection, each as soon as it is ready, until the client closes it."""
+    async def reply(query):
+        if delay:
+            await asyncio.sleep(delay)
+        wire = zone.respond(query).to_wire(max_size=65535)
+        writer.write(struct.pack("!H", len(wire)) + wire)
+
+    tasks = set()
+    try:
+        while True:
+            size = struct.unpack("!H", await reader.readexactly(2))[0]
+            try:
+                query = dns.message.from_wire(await reader.readexactly(size))
+            except dns.exception.DNSException:
+                continue
+            task = asyncio.ensure_future(reply(query))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        writer.close()
+
+
+class MockHierarchy:
+    """a synthetic, signed root -> TLD -> authoritative hierarchy served on loopback.
+
+    each zone listens on its own 127.0.x.y address and all zones share one port,
+    so the resolvers walk it exactly like the real tree, without network access.
+    every address answers over UDP and TCP.
+    """
+    def __init__(self, tlds: list = ("com", "edu", "org", "net"), zones_per_tld: int = 8, hosts: list = ("www", "mail", "api"), algorithm: dns.dnssec.Algorithm = dns.dnssec.Algorithm.ECDSAP256SHA256, port: int = 0, nsec3: bool = False, delay: float = 0.0, replicas: int = 1, loss: float = 0.0):
+        """builds and signs the hierarchy.
+
+        @params:
+        - tlds : list, the top level domains under the root
+        - zones_per_tld : int, the number of authoritative zones under each TLD
+        - hosts : list, the host labels with an A record in every authoritative zone
+        - algorithm : dns.dnssec.Algorithm, the signing algorithm of every zone
+        - port : int, the shared port, 0 picks a free one
+        - nsec3 : bool, deny existence with NSEC3 instead of NSEC in every zone
+        - delay : float, seconds every answer is held back, to stand in for network latency
+        - replicas : int, the number of addresses serving every zone
+        - loss : float, the share of queries every server drops
+        """
+        self.port = port
+        self.delay = delay
+        self.loss = loss
+        self.__addresses = (f"127.0.{n // 250}.{n % 250 + 2}" for n in range(1 << 14))
+        extra = lambda: [next(self.__addresses) for _ in range(replicas - 1)]
+        self.root = MockZone(".", next(self.__addresses), algorithm, nsec3=nsec3, replicas=extra())
+        self.zones = [self.root]
+        self.hostnames = []
+
+        for tld in tlds:
+            tld_zone = MockZone(f"{tld}.", next(self.__addresses), algorithm, nsec3=nsec3, replicas=extra())
+            self.zones.append(tld_zone)
+            for i in range(zones_per_tld):
+                zone = MockZone(f"example{i}.{tld}.", next(self.__addresses), algorithm, nsec3=nsec3, replicas=extra())
+                for j, host in enumerate(hosts):
+                    hostname = f"{host}.example{i}.{tld}."
+                    zone.add(dns.rrset.from_text(hostname, 300, "IN", "A", f"10.{i % 256}.{j % 256}.1"))
+                    self.hostnames.append(hostname)
+                tld_zone.delegate(zone)
+                self.zones.append(zone)
+            self.root.delegate(tld_zone)
+
+        self.connections = 0  # TCP connections accepted by every zone
+        self.__loop = None
+        self.__thread = None
+        self.__transports = []
+        self.__connections = {}  # task serving a TCP connection -> its writer
+
+    @property
+    def roots(self) -> dict:
+        """returns the root servers in the same shape as configs/roots.json."""
+        return {ns.to_text(omit_final_dot=True): ip for ns, ip in zip(self.root.nameservers, self.root.ips)}
+
+    @property
+    def anchor(self) -> str:
+        """returns the root trust anchor in the same format as configs/ksk.json."""
+        return self.root.ds()[0].to_text()
+
+    @property
+    def queries(self) -> int:
+        """returns the number of queries received by every zone so far, answered or dropped."""
+        return sum(zone.queries for zone in self.zones)
+
+    def sample(self, count: int, seed: int = 0, missing: float = 0.0) -> list:
+        """returns a reproducible list of hostnames to resolve.
+
+        @params:
+        - count : int
+        - seed : int
+        - missing : float, the share of names that do not exist
+        @returns:
+        - list
+        """
+        rng = random.Random(seed)
+        names = []
+        for _ in range(count):
+            name = rng.choice(self.hostnames)
+            if rng.random() < missing:
+                name = f"missing{rng.randrange(1 << 30)}.{name.split('.', 1)[1]}"
+            names.append(name)
+        return names
+
+    async def __bind(self):
+        loop = asyncio.get_running_loop()
+        for zone in self.zones:
+            for ip in zone.ips:
+                transport, _ = await loop.create_datagram_endpoint(lambda zone=zone: _ZoneProtocol(zone, self.delay, self.loss), local_addr=(ip, self.port))
+                self.__transports.append(transport)
+                if self.port == 0:
+                    self.port = transport.get_extra_info("sockname")[1]
+                self.__transports.append(await asyncio.start_server(lambda reader, writer, zone=zone: self.__accept(zone, reader, writer), ip, self.port))
+
+    async def __accept(self, zone: MockZone, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        task = asyncio.current_task()
+        self.__connections[task] = writer
+        try:
+            await _serve_tcp(zone, self.delay, reader, writer)
+        finally:
+            self.__connections.pop(task, None)
+
+    async def __close(self):
+        for transport in self.__transports:
+            transport.close()
+        # closing a connection ends its reads, so every task finishes on its own
+        for writer in self.__connections.values():
+            writer.close()
+        await asyncio.gather(*self.__connections, return_exceptions=True)
+
+    def start(self) -> "MockHierarchy":
+        """starts serving every zone on a background thread.
+
+        @returns:
+        - MockHierarchy, self
+        """
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(target=self.__loop.run_forever, name="mock-dns", daemon=True)
+        self.__thread.start()
+        asyncio.run_coroutine_threadsafe(self.__bind(), self.__loop).result()
+        return self
+
+    def stop(self):
+        """stops serving and closes every socket."""
+        if self.__loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.__close(), self.__loop).result()
+        self.__transports = []
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop.close()
+        self.__loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
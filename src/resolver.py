@@ -1,70 +1,363 @@
+import asyncio
+import time
+
 import dns.message
-import dns.query
+import dns.name
 import dns.rcode
+import dns.rdatatype
+import dns.rrset
 
-from .utils import qtype_map, is_valid_ipv4
+from .cache import AnswerCache, DelegationCache, InfraCache
+from .trace import tracer
+from .utils import exchange_wire, hedged, infra_cache, qtype_map, is_valid_ipv4, run_sync
+from .wire import Referral
 
 
 
-class DNSResolver:
-    """a major class that accepts parameters for `dig` and returns an object for dns resolve."""
-    def __init__(self, roots: dict):
+class _TokenBucket:
+    """a token bucket that bounds how often background work may start."""
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = burst
+        self.__last = time.monotonic()
+
+    def take(self) -> bool:
+        """takes a token if one is available."""
+        now = time.monotonic()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__last) * self.rate)
+        self.__last = now
+        if self.__tokens < 1:
+            return False
+        self.__tokens -= 1
+        return True
+
+
+class _Budget:
+    """the work one client query may cause, shared with the sub-resolutions it starts."""
+    def __init__(self, max_queries: int, timeout: float):
+        self.queries = max_queries
+        self.deadline = time.monotonic() + timeout
+        self.resolving = set()  # (qname, qtype) of the resolutions in progress
+
+    def remaining(self) -> float:
+        """returns the seconds left before the deadline."""
+        return self.deadline - time.monotonic()
+
+    def spend(self) -> str:
+        """takes one upstream query, returning the exhausted limit instead when there is none left."""
+        if self.remaining() <= 0:
+            return "deadline"
+        if self.queries <= 0:
+            return "queries"
+        self.queries -= 1
+        return None
+
+
+class AsyncDNSResolver:
+    """an iterative resolver that runs many resolutions concurrently on one event loop.
+
+    an instance must only be used from the event loop it is first awaited on.
+
+    every client query is bounded: it may send at most `max_queries` upstream
+    queries, including those of the glueless sub-resolutions it starts, nest
+    those at most `max_depth` deep, and must finish within `timeout` seconds.
+    referrals must lead strictly closer to the name, and a sub-resolution of a
+    name that is already being resolved is a loop. any of these ends the
+    resolution with a SERVFAIL response.
+
+    a server that is late to answer does not hold the walk up for its whole
+    timeout: the query is hedged to the next servers of the same zone, and
+    every hedge is paid from the same budget.
+    """
+    def __init__(self, roots: dict, delegations: DelegationCache = None, answers: AnswerCache = None, concurrency: int = 256, port: int = 53, infra: InfraCache = None, prefetch_window: float = 0.1, prefetch_hits: int = 3, prefetch_rate: float = 10.0, max_queries: int = 64, max_depth: int = 4, timeout: float = 10.0):
         """initializes the dns resolver with root servers.
-        
+
         @params:
         - roots : dictionary, contains ip addresses of root dns servers
+        - delegations : DelegationCache, an optional zone-cut cache to share between resolvers
+        - answers : AnswerCache, an optional answer cache to share between resolvers
+        - concurrency : int, the maximum number of upstream queries in flight
+        - port : int, the port upstream servers listen on
+        - infra : InfraCache, server rtt statistics, defaults to the process-wide one
+        - prefetch_window : float, the share of a ttl before expiry in which popular answers are refreshed, 0 disables prefetching
+        - prefetch_hits : int, the hits that make a cached answer popular
+        - prefetch_rate : float, the maximum number of refreshes started per second
+        - max_queries : int, the upstream queries one client query may cause
+        - max_depth : int, how deeply glueless nameserver lookups may nest
+        - timeout : float, the seconds one client query may take
         """
-        self.__stack = [ip for ip in roots.values()]  # create a stack with roots' ips as initial values
+        self.__roots = [ip for ip in roots.values()]
+        self.delegations = delegations if delegations is not None else DelegationCache()
+        self.answers = answers if answers is not None else AnswerCache()
+        self.__semaphore = asyncio.Semaphore(concurrency)
+        self.__port = port
+        self.infra = infra if infra is not None else infra_cache
+        self.prefetch_window = prefetch_window
+        self.prefetch_hits = prefetch_hits
+        self.__refresh_budget = _TokenBucket(prefetch_rate, max(1.0, prefetch_rate))
+        self.__refreshing = {}  # (qname, qtype, class) -> refresh task
+        self.max_queries = max_queries
+        self.max_depth = max_depth
+        self.timeout = timeout
 
-    def resolve(self, domain: str, qtype: str) -> tuple[dns.message.Message, bool]:
+    def __ranked(self, ips: list) -> list:
+        """returns servers in stack order, the most preferred last so it is popped first."""
+        return list(reversed(self.infra.order(list(dict.fromkeys(ips)))))
+
+    async def __exchange(self, question: dns.rrset.RRset, ip: str) -> bytes:
+        """sends a question to a server once a concurrency slot is free and returns the response in wire format."""
+        async with self.__semaphore:
+            return await exchange_wire(question.name, question.rdtype, ip, self.__port, self.infra, rdclass=question.rdclass)
+
+    @staticmethod
+    def __in_bailiwick(referral: Referral, zone: dns.name.Name, child: dns.name.Name) -> tuple[tuple, dict]:
+        """returns the nameservers of `child` and the glue a server authoritative for `zone` may vouch for.
+
+        NS records of any other zone, and addresses of names that are not
+        nameservers of `child` or lie outside `zone`, are dropped, so a server
+        cannot plant delegations or addresses for zones it does not serve.
+        """
+        nameservers, ttl = [], None
+        for owner, owner_ttl, names in referral.zones:
+            if owner == child:
+                nameservers.extend(names)
+                ttl = owner_ttl if ttl is None else min(ttl, owner_ttl)
+        glue = {name: referral.glue[name] for name in nameservers if name in referral.glue and name.is_subdomain(zone)}
+        return (nameservers, ttl), glue
+
+    def __remember(self, child: dns.name.Name, delegation: tuple, glue: dict):
+        """stores an in-bailiwick NS referral and its glue in the delegation cache."""
+        nameservers, ttl = delegation
+        self.delegations.add_zone(child, nameservers, ttl)
+
+        for name, (ttl, addresses) in glue.items():
+            self.delegations.add_glue(name, addresses, ttl)
+
+    async def __first_address(self, nameservers: list, budget: _Budget, depth: int) -> str:
+        """resolves glueless nameservers concurrently and returns the first address found.
+
+        the remaining lookups are cancelled as soon as one address arrives.
+
+        @params:
+        - nameservers : list, nameserver names (dns.name.Name)
+        - budget : _Budget, the limits of the client query the lookups work for
+        - depth : int, the nesting of the lookups
+        @returns:
+        - string, an ipv4 address, or None if no nameserver resolved
+        """
+        tasks = [asyncio.ensure_future(self.__resolve(ns.to_text(), "A", budget, depth)) for ns in dict.fromkeys(nameservers)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                ans, ok = await next_done
+                if not ok:
+                    continue
+                for rrset in ans.answer:
+                    if rrset.rdtype == dns.rdatatype.A:
+                        self.delegations.add_glue(rrset.name, [rr.address for rr in rrset], rrset.ttl)
+                        return rrset[0].address
+        finally:
+            for task in tasks:
+                task.cancel()
+        return None
+
+    async def resolve(self, domain: str, qtype: str) -> tuple[dns.message.Message, bool]:
         """resolves the input domain and query type.
-        
+
         @params:
         - domain : string, the domain to resolve
         - qtype : string, the query type (e.g., A, NS, MX)
         @returns:
         - tuple[dns.message.Message, bool], the dns response and a boolean indicating success
         """
+        return await self.__resolve(domain, qtype, _Budget(self.max_queries, self.timeout), 0)
+
+    async def __resolve(self, domain: str, qtype: str, budget: _Budget, depth: int) -> tuple[dns.message.Message, bool]:
+        """resolves a name from the cache, or by walking within the budget of its client query."""
         query = dns.message.make_query(domain, qtype_map(qtype))  # create dns query
-        
+        question = query.question[0]
+
+        # answer from the cache when a live positive or negative response exists
+        cached = self.answers.get(question.name, question.rdtype, question.rdclass)
+        if tracer.enabled:
+            tracer.emit("cache", cache="answer", hit=cached is not None)
+        if cached is not None:
+            if self.prefetch_window > 0 and self.answers.prefetchable(question.name, question.rdtype, question.rdclass, self.prefetch_window, self.prefetch_hits):
+                self.__prefetch(query)
+            return cached, True
+
+        return await self.__walk(query, budget, depth)
+
+    def __prefetch(self, query: dns.message.Message):
+        """refreshes a popular cached answer in the background, within the refresh budget."""
+        question = query.question[0]
+        key = (question.name, question.rdtype, question.rdclass)
+        if key in self.__refreshing or not self.__refresh_budget.take():
+            return
+
+        task = asyncio.ensure_future(self.__walk(query, _Budget(self.max_queries, self.timeout), 0))
+        self.__refreshing[key] = task
+        task.add_done_callback(lambda _: self.__refreshing.pop(key, None))
+        if tracer.enabled:
+            tracer.emit("prefetch", qname=question.name.to_text(), qtype=dns.rdatatype.to_text(question.rdtype))
+
+    def __fail(self, query: dns.message.Message, reason: str) -> tuple[dns.message.Message, bool]:
+        """returns the SERVFAIL response of a resolution that hit a limit or ran out of servers."""
+        if tracer.enabled:
+            tracer.emit("limit", qname=query.question[0].name.to_text(), reason=reason)
+        response = dns.message.make_response(query)
+        response.set_rcode(dns.rcode.SERVFAIL)
+        return response, False
+
+    async def __walk(self, query: dns.message.Message, budget: _Budget, depth: int) -> tuple[dns.message.Message, bool]:
+        """walks from the deepest known zone cut down to an answer and caches it, within the limits of its client query.
+
+        @params:
+        - query : dns.message.Message
+        - budget : _Budget, the limits of the client query
+        - depth : int, the nesting of this resolution under the client query
+        @returns:
+        - tuple[dns.message.Message, bool], the dns response and a boolean indicating success
+        """
+        question = query.question[0]
+        key = (question.name, question.rdtype)
+        if depth > self.max_depth:
+            return self.__fail(query, "depth")
+        if key in budget.resolving:
+            return self.__fail(query, "loop")
+
+        budget.resolving.add(key)
+        try:
+            return await self.__iterate(query, budget, depth)
+        finally:
+            budget.resolving.discard(key)
+
+    async def __iterate(self, query: dns.message.Message, budget: _Budget, depth: int) -> tuple[dns.message.Message, bool]:
+        """runs the walk as a loop over a stack of (zone, server) states.
+
+        a server is only followed into zones strictly below its own zone and
+        above the name, so no delegation can lead the walk in circles.
+        """
+        question = query.question[0]
+
+        # create a stack with roots' ips at the bottom and the deepest cached zone cut on top,
+        # each ordered so the server with the lowest smoothed rtt is popped first
+        zone, servers = self.delegations.closest(question.name)
+        if tracer.enabled:
+            tracer.emit("cache", cache="delegation", hit=zone is not None)
+        stack = [(dns.name.root, ip) for ip in self.__ranked(self.__roots)]
+        stack += [(zone, ip) for ip in self.__ranked(servers)]
+
         # start from the top of stack, send query until getting an answer
-        while self.__stack:
+        while stack:
             # get the top ip address, check for ipv4 only
-            ip = self.__stack.pop()
+            zone, ip = stack.pop()
             if not is_valid_ipv4(ip):
                 continue
 
-            # send dns request and check response emptiness
+            # every upstream query is paid from the budget of the client query
+            limit = budget.spend()
+            if limit is not None:
+                return self.__fail(query, limit)
+
+            # the other servers of the same zone, next in line, take the query when this one is late
+            peers = [ip]
+            for peer_zone, peer in reversed(stack):
+                if peer_zone != zone:
+                    break
+                if is_valid_ipv4(peer) and peer not in peers:
+                    peers.append(peer)
+
+            # send dns request, reading only what a referral needs from the response
+            tried = []
             try:
-                response = dns.query.udp(query, ip, timeout=2.0)
-                if response is None:
-                    continue
-                elif response.rcode() != dns.rcode.NOERROR:
+                wire, server = await asyncio.wait_for(
+                    hedged(lambda server: self.__exchange(question, server), peers, self.infra, lambda: budget.spend() is None, tried),
+                    budget.remaining(),
+                )
+                tried.append(server)
+                referral = Referral(wire)
+
+                # an error, an answer, or a NODATA with the zone's SOA is final and parsed in full
+                if referral.rcode != dns.rcode.NOERROR or referral.answers or referral.soa:
+                    response = dns.message.from_wire(wire)
+                    self.answers.put(question.name, question.rdtype, response, question.rdclass)
                     return response, True
-                elif not response.answer and not response.authority:
-                    continue
             except Exception as e:
                 continue
+            finally:
+                # neither the server that answered nor those that failed within the hedge are asked again
+                for peer in tried:
+                    if peer != ip and (zone, peer) in stack:
+                        stack.remove((zone, peer))
+
+            # a referral must move strictly below the server's zone, towards the name
+            if not referral.zones:
+                continue
+            child = referral.zones[0][0]
+            if child == zone or not child.is_subdomain(zone) or not question.name.is_subdomain(child):
+                if tracer.enabled:
+                    tracer.emit("limit", qname=question.name.to_text(), reason="referral")
+                continue
+
+            # cache the part of the referral the server is authoritative for before following it
+            delegation, accepted = self.__in_bailiwick(referral, zone, child)
+            self.__remember(child, delegation, accepted)
+
+            # add all authority servers that came with glue in additionals
+            glue, glueless = [], []
+            for ns in delegation[0]:
+                if ns in accepted:
+                    glue.extend(accepted[ns][1])
+                else:
+                    glueless.append(ns)
+
+            stack.extend((child, ip) for ip in self.__ranked(glue))
+
+            # if none had glue, resolve their addresses in isolated sub-resolutions
+            if glueless and not glue:
+                ip = await self.__first_address(glueless, budget, depth + 1)
+                if ip is not None:
+                    stack.append((child, ip))
+
+        return self.__fail(query, "servers")
+
 
-            # check the response for answer
-            if response.answer:
-                return response, True
-            
-            # add all authority servers
-            for authority in response.authority:
-                name = authority[0].to_text()
-                found = False
-
-                # first check in additionals
-                for addi in response.additional:
-                    if addi.name.to_text() == name:
-                        self.__stack.append(addi[0].to_text())
-                        found = True
-                
-                # if not found, then create a new resolver to find it
-                if not found:
-                    ans, ok = self.resolve(name, "A")
-                    if ok:
-                        self.__stack.append(ans.answer[0][0].to_text())
-                        
-        return None, False
+class DNSResolver:
+    """a major class that accepts parameters for `dig` and returns an object for dns resolve.
+
+    this is a blocking wrapper that runs an `AsyncDNSResolver` on the shared background loop.
+    """
+    def __init__(self, roots: dict, delegations: DelegationCache = None, answers: AnswerCache = None, **options):
+        """initializes the dns resolver with root servers.
+
+        @params:
+        - roots : dictionary, contains ip addresses of root dns servers
+        - delegations : DelegationCache, an optional zone-cut cache to share between resolvers
+        - answers : AnswerCache, an optional answer cache to share between resolvers
+        - options : further keyword options of `AsyncDNSResolver` (concurrency, port, infra, prefetch_*)
+        """
+        self.engine = AsyncDNSResolver(roots, delegations, answers, **options)
+
+    @property
+    def delegations(self) -> DelegationCache:
+        return self.engine.delegations
+
+    @property
+    def answers(self) -> AnswerCache:
+        return self.engine.answers
+
+    @property
+    def infra(self) -> InfraCache:
+        return self.engine.infra
+
+    def resolve(self, domain: str, qtype: str) -> tuple[dns.message.Message, bool]:
+        """resolves the input domain and query type.
+
+        @params:
+        - domain : string, the domain to resolve
+        - qtype : string, the query type (e.g., A, NS, MX)
+        @returns:
+        - tuple[dns.message.Message, bool], the dns response and a boolean indicating success
+        """
+        return run_sync(self.engine.resolve(domain, qtype))
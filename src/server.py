@@ -0,0 +1,254 @@
+import asyncio
+import multiprocessing
+import os
+import struct
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.opcode
+import dns.rcode
+import dns.rdatatype
+
+from .cache import DelegationCache, answer_cache
+from .resolver import AsyncDNSResolver
+from .store import SharedStore
+
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    """hands every datagram to the server and sends the answer back to its source."""
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.server.spawn(self.__reply(data, addr))
+
+    async def __reply(self, data, addr):
+        wire = await self.server.handle(data, udp=True)
+        if wire is not None and not self.transport.is_closing():
+            self.transport.sendto(wire, addr)
+
+
+class ResolverServer:
+    """a caching recursive dns server that answers clients over UDP and TCP.
+
+    the server keeps one `AsyncDNSResolver`, so its caches live as long as the process.
+    """
+    def __init__(self, resolver: AsyncDNSResolver):
+        """initializes the server.
+
+        @params:
+        - resolver : AsyncDNSResolver, the resolver that answers client queries
+        """
+        self.resolver = resolver
+        self.__servers = []
+        self.__tasks = set()
+        self.__writers = set()
+
+    def spawn(self, coro):
+        """runs a coroutine in the background, keeping a reference until it finishes."""
+        task = asyncio.ensure_future(coro)
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def handle(self, wire: bytes, udp: bool = False) -> bytes:
+        """answers a single dns query in wire format.
+
+        @params:
+        - wire : bytes, the client query
+        - udp : bool, whether the answer must fit a UDP payload
+        @returns:
+        - bytes, the wire format answer, or None if the message could not be parsed or is itself a response
+        """
+        try:
+            query = dns.message.from_wire(wire)
+        except Exception:
+            return None
+
+        # never answer a response, which could start a loop between two servers
+        if query.flags & dns.flags.QR:
+            return None
+
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.RA
+
+        # only standard queries with exactly one question are supported
+        if query.opcode() != dns.opcode.QUERY or len(query.question) != 1:
+            response.set_rcode(dns.rcode.NOTIMP if query.opcode() != dns.opcode.QUERY else dns.rcode.FORMERR)
+            return response.to_wire()
+
+        question = query.question[0]
+        try:
+            ans, ok = await self.resolver.resolve(question.name.to_text(), dns.rdatatype.to_text(question.rdtype))
+        except Exception:
+            ans, ok = None, False
+
+        if not ok or ans is None:
+            response.set_rcode(dns.rcode.SERVFAIL)
+        else:
+            response.set_rcode(ans.rcode())
+            response.answer = list(ans.answer)
+            response.authority = list(ans.authority)
+            response.additional = [rrset for rrset in ans.additional if rrset.rdtype != dns.rdatatype.OPT]
+
+        # over TCP the answer is only bounded by the length prefix, whatever payload size the query offered
+        if not udp:
+            return response.to_wire(max_size=65535)
+
+        # truncate answers that do not fit the client's UDP payload size
+        max_size = max(512, query.payload) if query.edns >= 0 else 512
+        try:
+            return response.to_wire(max_size=max_size)
+        except dns.exception.TooBig:
+            response.answer, response.authority, response.additional = [], [], []
+            response.flags |= dns.flags.TC
+            return response.to_wire(max_size=max_size)
+
+    async def __serve_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """answers length-prefixed queries on a TCP connection until the client closes it."""
+        lock = asyncio.Lock()
+
+        async def reply(data):
+            wire = await self.handle(data)
+            if wire is None:
+                return
+            async with lock:
+                writer.write(struct.pack("!H", len(wire)) + wire)
+                await writer.drain()
+
+        self.__writers.add(writer)
+        try:
+            while True:
+                size = struct.unpack("!H", await reader.readexactly(2))[0]
+                self.spawn(reply(await reader.readexactly(size)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.__writers.discard(writer)
+            writer.close()
+
+    async def start(self, address: str, port: int, reuse_port: bool = False):
+        """starts listening for UDP and TCP queries.
+
+        @params:
+        - address : string, the address to bind
+        - port : int, the port to bind
+        - reuse_port : bool, set SO_REUSEPORT so several processes share the port
+        """
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(lambda: _UDPProtocol(self), local_addr=(address, port), reuse_port=reuse_port)
+        self.__servers.append(transport)
+        self.__servers.append(await asyncio.start_server(self.__serve_tcp, address, port, reuse_port=reuse_port))
+
+    def close(self):
+        """stops listening, closes client connections and cancels the queries being answered."""
+        for server in self.__servers:
+            server.close()
+        for writer in list(self.__writers):
+            writer.close()
+        for task in list(self.__tasks):
+            task.cancel()
+        self.__servers = []
+
+
+async def _serve_worker(address: str, port: int, roots: dict, upstream_port: int, segment: str, lock, interval: float, cache_bytes: int, ready):
+    store = SharedStore(segment, lock)
+    resolver = AsyncDNSResolver(roots, delegations=DelegationCache(store), answers=answer_cache(cache_bytes, store), port=upstream_port)
+    server = ResolverServer(resolver)
+    await server.start(address, port, reuse_port=True)
+    ready.release()
+
+    # publish what this worker resolved, so the other workers' misses find it. only the
+    # entries added since the last pass are taken on the loop, and they are encoded off it
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            changes = [resolver.delegations.changes(), resolver.answers.changes()]
+            await loop.run_in_executor(None, store.publish, changes)
+    finally:
+        server.close()
+        store.close()
+
+
+def serve_worker(*args):
+    """runs one worker process of a `WorkerPool` until it is terminated."""
+    try:
+        asyncio.run(_serve_worker(*args))
+    except KeyboardInterrupt:
+        pass
+
+
+class WorkerPool:
+    """runs one `ResolverServer` process per core on the same address and port.
+
+    the kernel spreads clients over the workers through SO_REUSEPORT. every
+    worker keeps its own caches in front of a `SharedStore` segment that all of
+    them publish to, so a zone cut or an answer one worker resolved is found by
+    the others instead of being resolved again on every core.
+    """
+    def __init__(self, roots: dict, workers: int = None, upstream_port: int = 53, slots: int = 1 << 16, interval: float = 0.2, cache_bytes: int = 64 << 20):
+        """initializes the pool.
+
+        @params:
+        - roots : dictionary, contains ip addresses of root dns servers
+        - workers : int, the number of processes, defaults to the number of cores
+        - upstream_port : int, the port upstream servers listen on
+        - slots : int, the entries the shared segment holds
+        - interval : float, seconds between two publications of a worker's caches
+        - cache_bytes : int, the memory budget of each worker's answer cache, 0 for no bound
+        """
+        self.roots = roots
+        self.workers = workers or os.cpu_count() or 1
+        self.upstream_port = upstream_port
+        self.slots = slots
+        self.interval = interval
+        self.cache_bytes = cache_bytes
+        self.store = None
+        self.__processes = []
+
+    def start(self, address: str, port: int) -> "WorkerPool":
+        """starts the workers and waits until every one of them listens.
+
+        @params:
+        - address : string, the address to bind
+        - port : int, the port to bind, which must not be 0 since every worker binds it
+        @returns:
+        - WorkerPool, self
+        """
+        # spawned workers start clean, without the parent's threads and event loops
+        context = multiprocessing.get_context("spawn")
+        lock = context.Lock()
+        self.store = SharedStore(lock=lock, slots=self.slots)
+        ready = context.Semaphore(0)
+        for i in range(self.workers):
+            process = context.Process(target=serve_worker, args=(address, port, self.roots, self.upstream_port, self.store.name, lock, self.interval, self.cache_bytes, ready), name=f"mydig-worker-{i}", daemon=True)
+            process.start()
+            self.__processes.append(process)
+        for _ in range(self.workers):
+            if not ready.acquire(timeout=30):
+                self.stop()
+                raise RuntimeError(f"a worker could not start serving on {address}:{port}")
+        return self
+
+    def stop(self):
+        """terminates the workers and removes the shared segment."""
+        for process in self.__processes:
+            process.terminate()
+        for process in self.__processes:
+            process.join()
+        self.__processes = []
+        if self.store is not None:
+            self.store.close(unlink=True)
+            self.store = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
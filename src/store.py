@@ -0,0 +1,250 @@
+import hashlib
+import sqlite3
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import dns.message
+import dns.name
+
+
+
+def _key(table: str, key) -> str:
+    """returns the text form of a cache key."""
+    if table == "answers":
+        qname, qtype, rdclass = key
+        return f"{qname.to_text()} {int(qtype)} {int(rdclass)}"
+    return key.to_text()
+
+
+def _encode(table: str, value) -> bytes:
+    """returns the bytes stored for a cache value."""
+    if table in ("zones", "glue"):
+        return " ".join(str(item) for item in value).encode()
+    if table == "answers":
+        # a compact answer cache already holds the wire form
+        return value if isinstance(value, bytes) else value.to_wire()
+
+    # rrsets travel as the answer section of an otherwise empty message
+    message = dns.message.Message()
+    message.answer.append(value)
+    return message.to_wire()
+
+
+def _decode(table: str, value: bytes):
+    """returns the cache value stored as bytes."""
+    if table == "zones":
+        return {dns.name.from_text(name) for name in value.decode().split()}
+    if table == "glue":
+        return value.decode().split()
+    if table == "answers":
+        return dns.message.from_wire(value)
+    return dns.message.from_wire(value).answer[0]
+
+
+class CacheStore:
+    """an on-disk SQLite snapshot of resolver caches for warm starts.
+
+    entries are saved with their absolute expiry times, so whatever a later
+    process reads back is still ttl-correct. nothing is parsed up front: the
+    caches ask the store for a key on their first miss, and only the set of
+    stored keys is read when the first lookup happens.
+    """
+    TABLES = ("zones", "glue", "answers", "dnskeys", "ds")
+
+    def __init__(self, path: str):
+        """opens or creates the store.
+
+        @params:
+        - path : string, the SQLite database file
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__keys = None  # (table, key) pairs of live rows, read on first use
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.execute("CREATE TABLE IF NOT EXISTS entries (kind TEXT, key TEXT, expiry REAL, value BLOB, PRIMARY KEY (kind, key)) WITHOUT ROWID")
+
+    def load(self, table: str, key) -> tuple:
+        """returns a stored entry as (expiry, value), or None if it is missing or expired.
+
+        @params:
+        - table : string, one of `TABLES`
+        - key : the cache key (a dns.name.Name, or (qname, qtype, class) for answers)
+        @returns:
+        - tuple
+        """
+        skey = _key(table, key)
+        with self.__lock:
+            if self.__keys is None:
+                rows = self.__db.execute("SELECT kind, key FROM entries WHERE expiry > ?", (time.time(),))
+                self.__keys = set(rows)
+            if (table, skey) not in self.__keys:
+                return None
+            row = self.__db.execute("SELECT expiry, value FROM entries WHERE kind = ? AND key = ?", (table, skey)).fetchone()
+
+        if row is None or row[0] <= time.time():
+            return None
+        return row[0], _decode(table, row[1])
+
+    def save(self, *caches):
+        """writes every live entry of the caches and drops expired rows.
+
+        @params:
+        - caches : DelegationCache, AnswerCache or TrustCache instances
+        """
+        now = time.time()
+        rows = []
+        for cache in caches:
+            for table, entries in cache.snapshot().items():
+                for key, (expiry, value) in entries:
+                    if expiry > now:
+                        rows.append((table, _key(table, key), expiry, _encode(table, value)))
+
+        with self.__lock:
+            with self.__db:
+                self.__db.execute("DELETE FROM entries WHERE expiry <= ?", (now,))
+                self.__db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", rows)
+            if self.__keys is not None:
+                self.__keys.update((table, key) for table, key, _, _ in rows)
+
+    def close(self):
+        """closes the database."""
+        with self.__lock:
+            self.__db.close()
+
+
+class SharedStore:
+    """a fixed-size cache segment in shared memory, read and written by every worker process.
+
+    it offers the same `load` and `save` as `CacheStore`, so the caches of one
+    worker find the entries other workers already resolved on their misses.
+    `save` only publishes what the caches gained since the last call.
+    the segment is a 4-way set-associative table of fixed-size slots. readers
+    never lock: every slot carries a sequence number that is odd while it is
+    being written, and a read that sees it change is treated as a miss.
+    writers serialize on a lock shared by the processes. when a set is full,
+    the entry that expires first is replaced.
+    """
+    MAGIC = b"MDIG"
+    HEADER = struct.Struct("!4sII")  # magic, slots, slot size
+    SLOT = struct.Struct("!IdQHH")  # sequence, expiry, key hash, key length, value length
+    WAYS = 4
+
+    def __init__(self, name: str = None, lock=None, slots: int = 1 << 16, slot_size: int = 512):
+        """creates a segment, or attaches to an existing one by name.
+
+        @params:
+        - name : string, the segment to attach to, None creates a new one
+        - lock : multiprocessing.Lock, shared by every process that writes, None for a single writer
+        - slots : int, the number of entries a new segment holds
+        - slot_size : int, the bytes of each slot, which bounds the size of an entry
+        """
+        self.lock = lock if lock is not None else threading.Lock()
+        if name is None:
+            slots = max(self.WAYS, slots - slots % self.WAYS)
+            self.__memory = shared_memory.SharedMemory(create=True, size=self.HEADER.size + slots * slot_size)
+            self.HEADER.pack_into(self.__memory.buf, 0, self.MAGIC, slots, slot_size)
+        else:
+            self.__memory = shared_memory.SharedMemory(name=name)
+            magic, slots, slot_size = self.HEADER.unpack_from(self.__memory.buf, 0)
+            if magic != self.MAGIC:
+                raise ValueError(f"{name} is not a cache segment")
+        self.name = self.__memory.name
+        self.slots = slots
+        self.slot_size = slot_size
+
+    @staticmethod
+    def __hash(key: bytes) -> int:
+        # stable across processes, unlike hash()
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big") or 1
+
+    def __offsets(self, hashed: int) -> range:
+        first = self.HEADER.size + (hashed % (self.slots // self.WAYS)) * self.WAYS * self.slot_size
+        return range(first, first + self.WAYS * self.slot_size, self.slot_size)
+
+    def __read(self, key: bytes) -> tuple:
+        buf = self.__memory.buf
+        hashed = self.__hash(key)
+        for offset in self.__offsets(hashed):
+            sequence, expiry, slot_hash, key_size, value_size = self.SLOT.unpack_from(buf, offset)
+            if sequence & 1 or slot_hash != hashed:
+                continue
+            start = offset + self.SLOT.size
+            if bytes(buf[start:start + key_size]) != key:
+                continue
+            value = bytes(buf[start + key_size:start + key_size + value_size])
+            if self.SLOT.unpack_from(buf, offset)[0] != sequence:
+                return None
+            return expiry, value
+        return None
+
+    def __write(self, key: bytes, value: bytes, expiry: float) -> bool:
+        if self.SLOT.size + len(key) + len(value) > self.slot_size:
+            return False
+
+        buf = self.__memory.buf
+        hashed = self.__hash(key)
+        with self.lock:
+            # the slot of the same key, else a free or expired one, else the one that expires first
+            victim = None
+            for offset in self.__offsets(hashed):
+                sequence, slot_expiry, slot_hash, key_size, _ = self.SLOT.unpack_from(buf, offset)
+                start = offset + self.SLOT.size
+                if slot_hash == hashed and bytes(buf[start:start + key_size]) == key:
+                    victim = (offset, sequence)
+                    break
+                if victim is None or slot_expiry < victim[2]:
+                    victim = (offset, sequence, slot_expiry)
+            offset, sequence = victim[0], victim[1]
+
+            self.SLOT.pack_into(buf, offset, sequence + 1, 0.0, 0, 0, 0)
+            start = offset + self.SLOT.size
+            buf[start:start + len(key)] = key
+            buf[start + len(key):start + len(key) + len(value)] = value
+            self.SLOT.pack_into(buf, offset, sequence + 2, expiry, hashed, len(key), len(value))
+        return True
+
+    def load(self, table: str, key) -> tuple:
+        """returns a shared entry as (expiry, value), or None if it is missing or expired.
+
+        @params:
+        - table : string, one of `CacheStore.TABLES`
+        - key : the cache key (a dns.name.Name, or (qname, qtype, class) for answers)
+        @returns:
+        - tuple
+        """
+        entry = self.__read(f"{table} {_key(table, key)}".encode())
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[0], _decode(table, entry[1])
+
+    def save(self, *caches):
+        """publishes the entries the caches gained since their last publication.
+
+        @params:
+        - caches : DelegationCache, AnswerCache or CompactAnswerCache instances
+        """
+        self.publish([cache.changes() for cache in caches])
+
+    def publish(self, changes: list):
+        """writes entries taken from the caches' `changes` to the segment.
+
+        this only touches the segment, so it may run on another thread than
+        the one that owns the caches, while they keep serving lookups.
+
+        @params:
+        - changes : list, the dictionaries returned by `changes`
+        """
+        now = time.time()
+        for tables in changes:
+            for table, entries in tables.items():
+                for key, (expiry, value) in entries:
+                    if expiry > now:
+                        self.__write(f"{table} {_key(table, key)}".encode(), _encode(table, value), expiry)
+
+    def close(self, unlink: bool = False):
+        """detaches from the segment, removing it when `unlink` is set by its creator."""
+        self.__memory.close()
+        if unlink:
+            self.__memory.unlink()
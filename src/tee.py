@@ -1,31 +1,129 @@
+import atexit
+import json
+import struct
 import sys
+import threading
+import time
 
 
 
-class Tee:
-    """a tee-like behavior class to redirect stdout to a file.
-    
-    this code is adapted from stackoverflow.
+class BufferedTee:
+    """a buffered tee that writes to the terminal and a log file from a background thread.
+
+    `write` only appends to an in-memory buffer. a writer thread drains it when it
+    holds `max_bytes` or every `interval` seconds, and everything left is flushed
+    on `close`, which also runs at interpreter exit.
+
+    the log file can hold plain text, one JSON object per line (`jsonl`), or
+    length-prefixed `binary` records of (unix time, utf-8 line).
     """
-    def __init__(self, file_path):
-        """initializes the tee object.
-        
+    FORMATS = ("text", "jsonl", "binary")
+
+    def __init__(self, file_path: str = None, max_bytes: int = 1 << 16, interval: float = 0.5, format: str = "text"):
+        """initializes the tee and starts its writer thread.
+
         @params:
-        - file_path : string, path to the log file
+        - file_path : string, path to the log file, None to only buffer the terminal
+        - max_bytes : int, buffered size that triggers a flush
+        - interval : float, seconds between time-based flushes
+        - format : string, one of `text`, `jsonl` or `binary`
         """
+        if format not in self.FORMATS:
+            raise ValueError(f"unknown format {format!r}, expected one of {self.FORMATS}")
+
         self.terminal = sys.stdout
-        self.log = open(file_path, "a", encoding="utf-8")  # specify encoding
+        self.format = format
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.log = None
+        if file_path is not None:
+            self.log = open(file_path, "ab") if format == "binary" else open(file_path, "a", encoding="utf-8")
+
+        self.__chunks = []  # (time, message) not yet written
+        self.__size = 0
+        self.__partial = ""  # an unterminated line waiting for its newline
+        self.__closed = False
+        self.__io_lock = threading.Lock()
+        self.__wakeup = threading.Condition()
+        self.__thread = threading.Thread(target=self.__run, name="tee-writer", daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
 
     def write(self, message):
-        """writes the message to both the terminal and the log file."""
-        self.terminal.write(message)
-        self.log.write(message)
+        """buffers the message for both the terminal and the log file."""
+        if self.__closed:
+            with self.__io_lock:
+                self.__write([(time.time(), message)])
+            return len(message)
+
+        with self.__wakeup:
+            self.__chunks.append((time.time(), message))
+            self.__size += len(message)
+            if self.__size >= self.max_bytes:
+                self.__wakeup.notify()
+        return len(message)
 
     def flush(self):
-        """flushes both the terminal and the log file."""
-        self.terminal.flush()
-        self.log.flush()
+        """writes everything buffered so far, blocking until it is done."""
+        with self.__io_lock:
+            self.__drain()
+            self.terminal.flush()
+            if self.log is not None:
+                self.log.flush()
+
+    def close(self):
+        """stops the writer thread, flushes what is left and closes the log file."""
+        if self.__closed:
+            return
+        with self.__wakeup:
+            self.__closed = True
+            self.__wakeup.notify()
+        self.__thread.join()
+        self.flush()
+        with self.__io_lock:
+            if self.log is not None:
+                if self.format != "text" and self.__partial:
+                    partial, self.__partial = self.__partial, ""
+                    self.__records([(time.time(), partial)], final=True)
+                self.log.close()
+                self.log = None
+
+    def __run(self):
+        while True:
+            with self.__wakeup:
+                if not self.__closed and self.__size < self.max_bytes:
+                    self.__wakeup.wait(self.interval)
+                closed = self.__closed
+            with self.__io_lock:
+                self.__drain()
+            if closed:
+                return
+
+    def __drain(self):
+        """takes the buffered chunks and writes them; the caller holds the io lock."""
+        with self.__wakeup:
+            chunks, self.__chunks, self.__size = self.__chunks, [], 0
+        self.__write(chunks)
+
+    def __write(self, chunks: list):
+        if not chunks:
+            return
+        self.terminal.write("".join(message for _, message in chunks))
+        if self.log is None:
+            return
+        if self.format == "text":
+            self.log.write("".join(message for _, message in chunks))
+        else:
+            self.__records(chunks)
 
-    def __del__(self):
-        """ensures the log file is properly closed when the object is destroyed."""
-        self.log.close()
+    def __records(self, chunks: list, final: bool = False):
+        """writes complete lines of the chunks as jsonl or binary records."""
+        for timestamp, message in chunks:
+            lines = (self.__partial + message).split("\n")
+            self.__partial = "" if final else lines.pop()
+            for line in lines:
+                if self.format == "jsonl":
+                    self.log.write(json.dumps({"time": timestamp, "line": line}) + "\n")
+                else:
+                    data = line.encode("utf-8")
+                    self.log.write(struct.pack("!dI", timestamp, len(data)) + data)
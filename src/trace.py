@@ -0,0 +1,186 @@
+import bisect
+import json
+import sys
+import threading
+import time
+
+
+
+class Tracer:
+    """dispatches per-hop resolution events to pluggable sinks.
+
+    call sites check `enabled` before building an event, so with no sinks
+    attached tracing costs a single attribute lookup.
+
+    events are dictionaries with an `event` kind, a `time` and kind-specific fields:
+    - query : server, qname, qtype, rtt, size, rcode (or error), transport
+    - validation : step, zone, duration, ok
+    - cache : cache, hit
+    - prefetch : qname, qtype
+    - hedge : server, delay (None when a failed server triggered it)
+    - limit : qname, reason (queries, deadline, depth, loop, referral, servers)
+    - log : level, message
+    """
+    def __init__(self):
+        """initializes a tracer with no sinks."""
+        self.enabled = False
+        self.__sinks = []
+
+    def add_sink(self, sink):
+        """attaches a sink, a callable that receives every event.
+
+        @params:
+        - sink : callable
+        """
+        self.__sinks.append(sink)
+        self.enabled = True
+
+    def remove_sink(self, sink):
+        """detaches a sink, disabling tracing when none are left.
+
+        @params:
+        - sink : callable
+        """
+        self.__sinks.remove(sink)
+        self.enabled = bool(self.__sinks)
+
+    def emit(self, event: str, **fields):
+        """sends an event to every sink.
+
+        @params:
+        - event : string, the event kind
+        - fields : the event fields
+        """
+        fields["event"] = event
+        fields["time"] = time.time()
+        for sink in self.__sinks:
+            sink(fields)
+
+    def log(self, level: str, message: str):
+        """emits a human-readable progress message."""
+        self.emit("log", level=level, message=message)
+
+
+class ConsoleSink:
+    """prints log events, the way the command-line tools report progress."""
+    def __init__(self, stream=None):
+        """@params:
+        - stream : file, defaults to the current sys.stdout
+        """
+        self.stream = stream
+
+    def __call__(self, event: dict):
+        if event["event"] != "log":
+            return
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write(f"[{event['level']}] {event['message']}\n")
+
+
+class JSONLSink:
+    """writes every event as one JSON line."""
+    def __init__(self, stream):
+        """@params:
+        - stream : file, an open text file
+        """
+        self.stream = stream
+
+    def __call__(self, event: dict):
+        self.stream.write(json.dumps(event, default=str) + "\n")
+
+
+class _Histogram:
+    """a cumulative histogram with fixed upper bounds."""
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsSink:
+    """aggregates events into counters and histograms and renders them in prometheus text format."""
+    RTT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0)
+    SIZE_BUCKETS = (128, 256, 512, 1024, 1232, 1500, 4096, 65535)
+    VALIDATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+
+    def __init__(self):
+        """initializes empty metrics."""
+        self.__lock = threading.Lock()
+        self.__counters = {}  # (name, labels) -> value
+        self.__histograms = {}  # (name, labels) -> _Histogram
+
+    def __count(self, name: str, labels: tuple):
+        self.__counters[(name, labels)] = self.__counters.get((name, labels), 0) + 1
+
+    def __observe(self, name: str, labels: tuple, buckets: tuple, value: float):
+        histogram = self.__histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.__histograms[(name, labels)] = _Histogram(buckets)
+        histogram.observe(value)
+
+    def __call__(self, event: dict):
+        kind = event["event"]
+        with self.__lock:
+            if kind == "query":
+                labels = (("qtype", event["qtype"]), ("rcode", event.get("rcode") or "TIMEOUT"))
+                self.__count("mydig_upstream_queries_total", labels)
+                if event.get("rtt") is not None:
+                    self.__observe("mydig_upstream_rtt_seconds", (), self.RTT_BUCKETS, event["rtt"])
+                if event.get("size") is not None:
+                    self.__observe("mydig_response_size_bytes", (), self.SIZE_BUCKETS, event["size"])
+            elif kind == "validation":
+                labels = (("step", event["step"]), ("result", "ok" if event["ok"] else "failed"))
+                self.__count("mydig_validations_total", labels)
+                self.__observe("mydig_validation_seconds", (("step", event["step"]),), self.VALIDATION_BUCKETS, event["duration"])
+            elif kind == "cache":
+                self.__count("mydig_cache_lookups_total", (("cache", event["cache"]), ("result", "hit" if event["hit"] else "miss")))
+            elif kind == "prefetch":
+                self.__count("mydig_prefetches_total", ())
+            elif kind == "hedge":
+                self.__count("mydig_hedges_total", ())
+            elif kind == "limit":
+                self.__count("mydig_resolution_limits_total", (("reason", event["reason"]),))
+
+    @staticmethod
+    def __labels(labels: tuple, extra: tuple = ()) -> str:
+        pairs = labels + extra
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def snapshot(self) -> str:
+        """returns every metric in prometheus text exposition format.
+
+        @returns:
+        - string
+        """
+        lines = []
+        with self.__lock:
+            for name in sorted({name for name, _ in self.__counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (n, labels), value in sorted(self.__counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{self.__labels(labels)} {value}")
+
+            for name in sorted({name for name, _ in self.__histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), histogram in sorted(self.__histograms.items(), key=lambda item: item[0]):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{self.__labels(labels, (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{self.__labels(labels, (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{self.__labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{self.__labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+# the process-wide tracer used by the resolvers
+tracer = Tracer()
@@ -0,0 +1,161 @@
+import asyncio
+import struct
+import weakref
+
+import dns.entropy
+import dns.exception
+
+
+
+class _Connection:
+    """one persistent TCP connection to a server that pipelines queries (RFC 7766).
+
+    every query on the connection is given a message id no other outstanding
+    query uses, and answers are matched to their queries by that id, in
+    whatever order the server sends them.
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, idle_timeout: float):
+        self.closed = False
+        self.idle_timeout = idle_timeout
+        self.__reader = reader
+        self.__writer = writer
+        self.__pending = {}  # message id -> future of the answer wire
+        self.__idle = None
+        self.__task = asyncio.ensure_future(self.__read())
+        self.__arm()
+
+    def __arm(self):
+        """closes the connection once it has been idle for `idle_timeout` seconds."""
+        self.__idle = asyncio.get_running_loop().call_later(self.idle_timeout, self.close)
+
+    async def __read(self):
+        try:
+            while True:
+                size = struct.unpack("!H", await self.__reader.readexactly(2))[0]
+                wire = await self.__reader.readexactly(size)
+                future = self.__pending.get(struct.unpack("!H", wire[:2])[0])
+                if future is not None and not future.done():
+                    future.set_result(wire)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            self.close()
+
+    async def query(self, wire: bytes, timeout: float) -> bytes:
+        """sends a query in wire format and returns the answer in wire format, carrying the id it was sent with.
+
+        @params:
+        - wire : bytes
+        - timeout : float, seconds
+        @returns:
+        - bytes
+        """
+        if self.closed:
+            raise ConnectionResetError("connection closed")
+        qid = dns.entropy.random_16()
+        while qid in self.__pending:
+            qid = dns.entropy.random_16()
+        future = asyncio.get_running_loop().create_future()
+        self.__pending[qid] = future
+        if self.__idle is not None:
+            self.__idle.cancel()
+            self.__idle = None
+        try:
+            self.__writer.write(struct.pack("!HH", len(wire), qid) + wire[2:])
+            await asyncio.wait_for(self.__writer.drain(), timeout)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise dns.exception.Timeout(timeout=timeout)
+        finally:
+            del self.__pending[qid]
+            if not self.__pending and not self.closed:
+                self.__arm()
+
+    def close(self):
+        """closes the connection, failing the queries still waiting on it."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.__idle is not None:
+            self.__idle.cancel()
+        self.__task.cancel()
+        self.__writer.close()
+        for future in self.__pending.values():
+            if not future.done():
+                future.set_exception(ConnectionResetError("connection closed"))
+
+
+class TCPPool:
+    """persistent TCP connections to upstream servers, one per server and event loop.
+
+    concurrent queries to a server are pipelined on its connection instead of
+    each paying a handshake. a connection is closed after `idle_timeout` seconds
+    without queries, and one the server closed is replaced on the next query.
+    """
+    def __init__(self, idle_timeout: float = 10.0):
+        """initializes an empty pool.
+
+        @params:
+        - idle_timeout : float, seconds an unused connection is kept open
+        """
+        self.idle_timeout = idle_timeout
+        self.connects = 0
+        self.__loops = weakref.WeakKeyDictionary()  # event loop -> {(server, port): task opening the _Connection}
+
+    async def __open(self, ns: str, port: int, timeout: float) -> _Connection:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(ns, port), timeout)
+        except asyncio.TimeoutError:
+            raise dns.exception.Timeout(timeout=timeout)
+        self.connects += 1
+        return _Connection(reader, writer, self.idle_timeout)
+
+    async def __connection(self, ns: str, port: int, timeout: float) -> tuple[_Connection, bool]:
+        """returns the live connection to a server, opening one if needed, and whether it is new."""
+        loop = asyncio.get_running_loop()
+        connections = self.__loops.get(loop)
+        if connections is None:
+            connections = self.__loops[loop] = {}
+
+        task = connections.get((ns, port))
+        stale = task is not None and task.done() and (task.cancelled() or task.exception() is not None or task.result().closed)
+        if task is None or stale:
+            task = connections[(ns, port)] = loop.create_task(self.__open(ns, port, timeout))
+        fresh = not task.done()
+        return await asyncio.shield(task), fresh
+
+    async def query(self, wire: bytes, ns: str, port: int = 53, timeout: float = 2.0) -> bytes:
+        """sends a query in wire format over the pooled connection to a server and returns the response in wire format.
+
+        the response carries the message id of the query. a query that fails
+        because the server closed a reused connection is retried once on a new
+        connection.
+
+        @params:
+        - wire : bytes
+        - ns : string
+        - port : int
+        - timeout : float, seconds to connect and, separately, to wait for the answer
+        @returns:
+        - bytes
+        """
+        while True:
+            connection, fresh = await self.__connection(ns, port, timeout)
+            try:
+                answer = await connection.query(wire, timeout)
+                break
+            except ConnectionError:
+                connection.close()
+                if fresh:
+                    raise
+
+        # restore the id the query was made with
+        return wire[:2] + answer[2:]
+
+    def close(self):
+        """closes every connection of the running event loop."""
+        for task in self.__loops.pop(asyncio.get_running_loop(), {}).values():
+            if task.done() and not task.cancelled() and task.exception() is None:
+                task.result().close()
+            else:
+                task.cancel()
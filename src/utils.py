@@ -1,8 +1,43 @@
+import asyncio
+import dns.entropy
+import dns.exception
 import dns.message
+import dns.name
 import dns.query
+import dns.rcode
+import dns.rdataclass
 import dns.rdatatype
 import dns.rrset
 import ipaddress
+import struct
+import threading
+import time
+import weakref
+
+from .cache import InfraCache
+from .trace import tracer
+from .transport import TCPPool
+from .wire import QueryTemplate, query_template, truncated
+
+
+
+# round-trip statistics of every upstream server this process talked to
+infra_cache = InfraCache()
+
+# persistent TCP connections to upstream servers, for answers that do not fit a datagram
+tcp_pool = TCPPool()
+
+# the event loop that runs coroutines for the synchronous apis
+_loop = None
+_loop_lock = threading.Lock()
+
+# outstanding upstream queries of each event loop, keyed by (server, port, qname, qtype, class, DO bit)
+_inflight = weakref.WeakKeyDictionary()
+
+# the most hedged queries the process may have outstanding at once, 0 disables hedging
+max_hedges = 32
+_hedges = 0
+_hedges_lock = threading.Lock()
 
 
 
@@ -19,9 +54,17 @@ def qtype_map(input: str) -> dns.rdatatype:
         "MX": dns.rdatatype.MX,
         "A": dns.rdatatype.A
     }
-    
+    if input in qtype_map_dict:
+        return qtype_map_dict[input]
+
+    # accept any other known type mnemonic (e.g., "AAAA", "TXT")
+    try:
+        return dns.rdatatype.from_text(input)
+    except (dns.rdatatype.UnknownRdatatype, ValueError):
+        pass
+
     # default to dns.rdatatype.A if input is not recognized
-    return qtype_map_dict.get(input, dns.rdatatype.A)
+    return dns.rdatatype.A
 
 
 def is_valid_ipv4(ip_str: str) -> bool:
@@ -69,9 +112,43 @@ def get_dnskey(answer: dns.rrset) -> tuple[dns.rrset.RRset, dns.rrset.RRset]:
     return None, None
 
 
+class _ReplyProtocol(asyncio.DatagramProtocol):
+    """waits on a connected datagram socket for the response to one query."""
+    def __init__(self, template: QueryTemplate, qid: int):
+        self.template = template
+        self.qid = qid
+        self.reply = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        # anything but the response to the query is ignored, like a spoofing attempt would be
+        if not self.reply.done() and self.template.matches(data, self.qid):
+            self.reply.set_result(data)
+
+    def error_received(self, exc):
+        if not self.reply.done():
+            self.reply.set_exception(exc)
+
+
+async def _udp(template: QueryTemplate, ns: str, port: int, timeout: float) -> bytes:
+    """sends a query rendered from its template over UDP and returns the response in wire format."""
+    qid = dns.entropy.random_16()
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(lambda: _ReplyProtocol(template, qid), remote_addr=(ns, port))
+    try:
+        transport.sendto(template.render(qid))
+        return await asyncio.wait_for(protocol.reply, timeout)
+    except asyncio.TimeoutError:
+        raise dns.exception.Timeout(timeout=timeout)
+    finally:
+        transport.close()
+
+
 def query(domain: str, qtype: dns.rdatatype, ns: str, dnssec: bool = False) -> dns.message.Message:
-    """queries the specified domain and returns the response.
-    
+    """queries the specified domain and returns the response, retrying over TCP when it is truncated.
+
+    this is a blocking wrapper that runs `aquery` on the shared background loop,
+    so truncated answers go through the pooled TCP connections as well.
+
     @params:
     - domain : string
     - qtype : dns.rdatatype
@@ -80,5 +157,221 @@ def query(domain: str, qtype: dns.rdatatype, ns: str, dnssec: bool = False) -> d
     @returns:
     - dns.message.Message
     """
-    query = dns.message.make_query(dns.name.from_text(domain), qtype, want_dnssec=dnssec)
-    return dns.query.udp(query, ns, timeout=2)
+    return run_sync(aquery(domain, qtype, ns, dnssec))
+
+
+def trace_query(qname: dns.name.Name, qtype: dns.rdatatype, ns: str, rtt: float = None, wire: bytes = None, error: Exception = None, transport: str = "udp"):
+    """emits a `query` event for an upstream exchange.
+
+    @params:
+    - qname : dns.name.Name
+    - qtype : dns.rdatatype
+    - ns : string
+    - rtt : float, seconds, None if the query failed or went over TCP
+    - wire : bytes, the response in wire format, None if the query failed
+    - error : Exception, the reason the query failed
+    - transport : string, "udp" or "tcp"
+    """
+    tracer.emit(
+        "query",
+        server=ns,
+        qname=qname.to_text(),
+        qtype=dns.rdatatype.to_text(qtype),
+        rtt=rtt,
+        size=len(wire) if wire is not None else None,
+        rcode=dns.rcode.to_text(dns.rcode.from_flags(struct.unpack_from("!H", wire, 2)[0], 0)) if wire is not None else None,
+        error=type(error).__name__ if error is not None else None,
+        transport=transport,
+    )
+
+
+async def aquery(domain: str, qtype: dns.rdatatype, ns: str, dnssec: bool = False, port: int = 53) -> dns.message.Message:
+    """queries the specified domain without blocking the event loop and returns the response.
+
+    @params:
+    - domain : string
+    - qtype : dns.rdatatype
+    - ns : string
+    - dnssec : bool
+    - port : int
+    @returns:
+    - dns.message.Message
+    """
+    return dns.message.from_wire(await exchange_wire(dns.name.from_text(domain), dns.rdatatype.RdataType.make(qtype), ns, port, dnssec=dnssec))
+
+
+async def exchange_wire(qname: dns.name.Name, rdtype: dns.rdatatype, ns: str, port: int = 53, infra: InfraCache = None, dnssec: bool = False, rdclass: dns.rdataclass.RdataClass = dns.rdataclass.IN) -> bytes:
+    """sends a query over UDP with a timeout derived from the server's measured rtt and returns the response in wire format.
+
+    the query is rendered from a reusable template that offers the server's EDNS
+    payload size, and a truncated answer is asked again over the pooled TCP
+    connection to the server. the UDP round trip is recorded in the infrastructure
+    cache, and a timeout backs the server off. identical queries to the same server
+    that are still in flight are coalesced: later callers wait for the outstanding
+    one and share its response (or its error).
+
+    @params:
+    - qname : dns.name.Name
+    - rdtype : dns.rdatatype
+    - ns : string
+    - port : int
+    - infra : InfraCache, defaults to the process-wide `infra_cache`
+    - dnssec : bool, set the DO bit
+    - rdclass : dns.rdataclass
+    @returns:
+    - bytes
+    """
+    key = (ns, port, qname, rdtype, rdclass, dnssec)
+    loop = asyncio.get_running_loop()
+    pending = _inflight.get(loop)
+    if pending is None:
+        pending = _inflight[loop] = {}
+
+    task = pending.get(key)
+    if tracer.enabled:
+        tracer.emit("cache", cache="inflight", hit=task is not None)
+    if task is None:
+        task = pending[key] = loop.create_task(_send(key, infra if infra is not None else infra_cache))
+        task.add_done_callback(lambda task: _settle(pending, key, task))
+
+    # a caller that gives up does not cancel the query the others are waiting on
+    return await asyncio.shield(task)
+
+
+def _settle(pending: dict, key: tuple, task: asyncio.Task):
+    """forgets a finished in-flight query, retrieving its error in case every caller gave up."""
+    if pending.get(key) is task:
+        del pending[key]
+    if not task.cancelled():
+        task.exception()
+
+
+async def _send(key: tuple, infra: InfraCache) -> bytes:
+    """sends one query and records its round trip, once per in-flight key of `exchange_wire`."""
+    ns, port, qname, rdtype, rdclass, dnssec = key
+    template = query_template(qname, rdtype, rdclass, dnssec, infra.payload(ns))
+    start_time = time.perf_counter()
+    try:
+        wire = await _udp(template, ns, port, infra.timeout(ns))
+    except (dns.exception.Timeout, OSError) as e:
+        infra.timed_out(ns)
+        if tracer.enabled:
+            trace_query(qname, rdtype, ns, error=e)
+        raise
+    rtt = time.perf_counter() - start_time
+    infra.record(ns, rtt)
+    if tracer.enabled:
+        trace_query(qname, rdtype, ns, rtt, wire)
+    if not truncated(wire):
+        return wire
+
+    qid = dns.entropy.random_16()
+    try:
+        wire = await tcp_pool.query(template.render(qid), ns, port, timeout=infra.max_timeout)
+        if not template.matches(wire, qid):
+            raise dns.query.BadResponse
+    except (dns.exception.Timeout, OSError) as e:
+        if tracer.enabled:
+            trace_query(qname, rdtype, ns, error=e, transport="tcp")
+        raise
+    if tracer.enabled:
+        trace_query(qname, rdtype, ns, wire=wire, transport="tcp")
+    return wire
+
+
+def _take_hedge() -> bool:
+    """takes one of the process-wide hedge slots if one is free."""
+    global _hedges
+    with _hedges_lock:
+        if _hedges >= max_hedges:
+            return False
+        _hedges += 1
+        return True
+
+
+def _release_hedge(_):
+    global _hedges
+    with _hedges_lock:
+        _hedges -= 1
+
+
+async def hedged(send, servers: list, infra: InfraCache = None, admit=None, failed: list = None) -> tuple:
+    """sends a query to the first server and, while nobody answers, also to the following ones.
+
+    once the latest server has been waited on for its hedge delay (a percentile of
+    its recent round trips), or as soon as one of the servers fails, the query goes
+    to the next server in parallel, and the first answer wins. at most `max_hedges`
+    hedged queries are outstanding in the process; without a free slot the query
+    keeps waiting on the servers it was sent to.
+
+    @params:
+    - send : callable, takes a server and returns an awaitable response
+    - servers : list, ip addresses as strings, in order of preference
+    - infra : InfraCache, defaults to the process-wide `infra_cache`
+    - admit : callable, asked before every hedge, returning False stops hedging
+    - failed : list, collects the servers whose query failed
+    @returns:
+    - tuple, the first response and the server that sent it
+    @raises:
+    - the error of the last server, once every server the query went to failed
+    """
+    infra = infra if infra is not None else infra_cache
+    tasks = {asyncio.ensure_future(send(servers[0])): servers[0]}
+    following = 1
+    try:
+        while True:
+            delay = infra.hedge_delay(servers[following - 1]) if following < len(servers) else None
+            done, _ = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                server = tasks.pop(task)
+                if task.exception() is None:
+                    return task.result(), server
+                if failed is not None:
+                    failed.append(server)
+                if not tasks:
+                    raise task.exception()
+
+            # the latest server is late, or a server failed while others are still pending
+            if following >= len(servers) or not _take_hedge():
+                continue
+            if admit is not None and not admit():
+                _release_hedge(None)
+                following = len(servers)
+                continue
+            task = asyncio.ensure_future(send(servers[following]))
+            task.add_done_callback(_release_hedge)
+            tasks[task] = servers[following]
+            if tracer.enabled:
+                tracer.emit("hedge", server=servers[following], delay=None if done else delay)
+            following += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def background_loop() -> asyncio.AbstractEventLoop:
+    """returns a process-wide event loop running on a daemon thread, starting it on first use.
+
+    @returns:
+    - asyncio.AbstractEventLoop
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="dns-loop", daemon=True).start()
+    return _loop
+
+
+def run_sync(coro):
+    """runs a coroutine on the background loop and blocks until it returns.
+
+    the loop outlives the call, so caches and background tasks created by the
+    coroutine stay usable by the next call. must not be called from the loop itself.
+
+    @params:
+    - coro : coroutine
+    @returns:
+    - the coroutine's result
+    """
+    return asyncio.run_coroutine_threadsafe(coro, background_loop()).result()
@@ -0,0 +1,149 @@
+import functools
+import socket
+import struct
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+
+
+
+_HEADER = struct.Struct("!HHHHHH")  # id, flags, question, answer, authority and additional counts
+_RR = struct.Struct("!HHIH")  # type, class, ttl, rdata length
+_ID = struct.Struct("!H")
+
+
+class QueryTemplate:
+    """the wire form of a query, rendered once and reused with a new message id for every send."""
+    __slots__ = ("wire", "name_end")
+
+    def __init__(self, wire: bytes, name_end: int):
+        self.wire = wire
+        self.name_end = name_end
+
+    def render(self, qid: int) -> bytes:
+        """returns the query with its message id set to `qid`."""
+        return _ID.pack(qid) + self.wire[2:]
+
+    def matches(self, response: bytes, qid: int) -> bool:
+        """tells whether a datagram is the response to this query sent with id `qid`.
+
+        the id, the QR flag and the question must match, the name compared without regard to case.
+
+        @params:
+        - response : bytes
+        - qid : int
+        @returns:
+        - bool
+        """
+        end = self.name_end + 4
+        if len(response) < end or _ID.unpack_from(response)[0] != qid or not _ID.unpack_from(response, 2)[0] & dns.flags.QR:
+            return False
+        if response[4:6] != b"\x00\x01" or response[self.name_end:end] != self.wire[self.name_end:end]:
+            return False
+        return response[12:self.name_end].lower() == self.wire[12:self.name_end].lower()
+
+
+@functools.lru_cache(maxsize=4096)
+def query_template(qname: dns.name.Name, rdtype: int, rdclass: int = dns.rdataclass.IN, dnssec: bool = False, payload: int = 1232) -> QueryTemplate:
+    """returns the reusable template of a query, rendering it on first use.
+
+    @params:
+    - qname : dns.name.Name
+    - rdtype : int
+    - rdclass : int
+    - dnssec : bool, set the DO bit
+    - payload : int, the EDNS UDP payload size offered
+    @returns:
+    - QueryTemplate
+    """
+    query = dns.message.make_query(qname, rdtype, rdclass, use_edns=0, want_dnssec=dnssec, payload=payload)
+    query.id = 0
+    return QueryTemplate(query.to_wire(), 12 + len(qname.to_wire()))
+
+
+def truncated(wire: bytes) -> bool:
+    """tells whether a response has the TC flag set."""
+    return bool(_ID.unpack_from(wire, 2)[0] & dns.flags.TC)
+
+
+def _skip_name(wire: bytes, offset: int) -> int:
+    """returns the offset just after the (possibly compressed) name at `offset`."""
+    while True:
+        length = wire[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0:
+            return offset + 2
+        offset += length + 1
+
+
+class Referral:
+    """what an iterative resolver needs from a response, read straight from its wire form.
+
+    only the header, the NS records of the authority section and the A records
+    of the additional section are decoded. a response that turns out to be an
+    answer, a denial or an error still has to be parsed in full.
+    """
+    __slots__ = ("rcode", "answers", "soa", "truncated", "zones", "glue")
+
+    def __init__(self, wire: bytes):
+        """decodes a response.
+
+        @params:
+        - wire : bytes
+        @raises:
+        - dns.exception.FormError, if the response is malformed
+        """
+        self.zones = []  # (zone, ttl, [nameserver names]) in the order they appear
+        self.glue = {}  # nameserver name -> (ttl, [ipv4 addresses])
+        self.soa = False
+        try:
+            self.__parse(wire)
+        except (IndexError, struct.error, dns.exception.DNSException):
+            raise dns.exception.FormError("malformed response")
+
+    def __parse(self, wire: bytes):
+        _, flags, questions, answers, authorities, additionals = _HEADER.unpack_from(wire)
+        self.rcode = dns.rcode.from_flags(flags, 0)
+        self.truncated = bool(flags & dns.flags.TC)
+        self.answers = answers
+
+        offset = 12
+        for _ in range(questions):
+            offset = _skip_name(wire, offset) + 4
+        for _ in range(answers):
+            offset = _skip_name(wire, offset)
+            offset += _RR.size + _RR.unpack_from(wire, offset)[3]
+
+        zones = {}
+        for _ in range(authorities):
+            owner = offset
+            offset = _skip_name(wire, offset)
+            rdtype, rdclass, ttl, length = _RR.unpack_from(wire, offset)
+            offset += _RR.size
+            if rdtype == dns.rdatatype.SOA:
+                self.soa = True
+            elif rdtype == dns.rdatatype.NS and rdclass == dns.rdataclass.IN:
+                zone = dns.name.from_wire(wire, owner)[0]
+                if zone not in zones:
+                    zones[zone] = (zone, ttl, [])
+                    self.zones.append(zones[zone])
+                zones[zone][2].append(dns.name.from_wire(wire, offset)[0])
+            offset += length
+
+        for _ in range(additionals):
+            owner = offset
+            offset = _skip_name(wire, offset)
+            rdtype, rdclass, ttl, length = _RR.unpack_from(wire, offset)
+            offset += _RR.size
+            if rdtype == dns.rdatatype.A and rdclass == dns.rdataclass.IN and length == 4:
+                name = dns.name.from_wire(wire, owner)[0]
+                if name not in self.glue:
+                    self.glue[name] = (ttl, [])
+                self.glue[name][1].append(socket.inet_ntoa(wire[offset:offset + 4]))
+            offset += length
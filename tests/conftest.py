@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import `src` from the repository root, like the command-line tools do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
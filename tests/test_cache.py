@@ -0,0 +1,208 @@
+import time
+
+import dns.dnssec
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdata
+import dns.rdatatype
+import dns.rrset
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from src.cache import AnswerCache, CompactAnswerCache, DelegationCache, InfraCache, NegativeCache, VerificationCache, answer_cache
+
+
+ZONE = dns.name.from_text("example.")
+KEY = ec.generate_private_key(ec.SECP256R1())
+DNSKEY = dns.dnssec.make_dnskey(KEY.public_key(), dns.dnssec.Algorithm.ECDSAP256SHA256, flags=257)
+
+# owner -> types of two small zones; c.example. is an empty non-terminal and sub.example. an unsigned delegation
+NSEC_ZONE = {"@": "SOA NS DNSKEY RRSIG", "a": "A RRSIG", "b.c": "A RRSIG", "sub": "NS", "*.w": "A RRSIG", "z": "A TXT RRSIG"}
+NSEC3_ZONE = {"@": "SOA NS DNSKEY NSEC3PARAM RRSIG", "a": "A RRSIG", "c": "", "b.c": "A RRSIG", "sub": "NS"}
+
+
+def rrsig(expiration: float) -> dns.rrset.RRset:
+    return dns.rrset.from_text("example.", 300, "IN", "RRSIG", f"A 13 1 300 {int(expiration)} {int(time.time()) - 60} 1 example. AAAA")
+
+
+def test_verification_failure_is_kept_briefly():
+    cache = VerificationCache(failure_ttl=0.05)
+    signatures = rrsig(time.time() + 30 * 86400)
+    cache.put(b"good", True, signatures)
+    cache.put(b"bad", False, signatures)
+    assert cache.get(b"good") is True and cache.get(b"bad") is False
+
+    time.sleep(0.1)
+    assert cache.get(b"good") is True
+    assert cache.get(b"bad") is None
+
+
+def test_answers_age_while_cached(monkeypatch):
+    query = dns.message.make_query("www.example.", "A")
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text("www.example.", 300, "IN", "A", "192.0.2.80"))
+    response.authority.append(dns.rrset.from_text("example.", 3600, "IN", "NS", "ns.example."))
+
+    now = time.time()
+    for cache in (AnswerCache(), CompactAnswerCache()):
+        monkeypatch.setattr(time, "time", lambda: now)
+        cache.put(query.question[0].name, dns.rdatatype.A, response)
+        monkeypatch.setattr(time, "time", lambda: now + 2.5)
+        aged = cache.get(query.question[0].name, dns.rdatatype.A)
+        assert aged.answer[0].ttl == 298 and aged.authority[0].ttl == 3598
+    assert response.answer[0].ttl == 300 and response.authority[0].ttl == 3600
+
+
+def test_delegations_are_bounded():
+    cache = DelegationCache(maxsize=2)
+    for i in range(3):
+        cache.add_zone(dns.name.from_text(f"example{i}.com."), [dns.name.from_text(f"ns.example{i}.com.")], 3600)
+        cache.add_glue(dns.name.from_text(f"ns.example{i}.com."), [f"192.0.2.{i}"], 3600)
+        if i == 1:
+            # a lookup makes the first zone recently used, so the second is evicted
+            assert cache.closest(dns.name.from_text("www.example0.com."))[1] == ["192.0.2.0"]
+
+    assert len(cache) == 2
+    assert cache.closest(dns.name.from_text("www.example0.com."))[1] == ["192.0.2.0"]
+    assert cache.closest(dns.name.from_text("www.example1.com.")) == (None, [])
+    assert cache.closest(dns.name.from_text("www.example2.com."))[1] == ["192.0.2.2"]
+
+
+def test_answer_cache_budget():
+    assert isinstance(answer_cache(0), AnswerCache)
+    assert answer_cache().max_bytes == 64 << 20
+    cache = answer_cache(64 << 10)
+    assert isinstance(cache, CompactAnswerCache) and cache.max_bytes == 64 << 10
+
+
+def test_lowered_payload_is_probed_again():
+    infra = InfraCache(probe_after=3)
+    infra.record("192.0.2.1", 0.01)
+    infra.timed_out("192.0.2.1")
+    infra.timed_out("192.0.2.1")
+    assert infra.payload("192.0.2.1") == infra.min_payload
+
+    for _ in range(2):
+        infra.record("192.0.2.1", 0.01)
+    assert infra.payload("192.0.2.1") == infra.min_payload
+
+    # a timeout restarts the count
+    infra.timed_out("192.0.2.1")
+    for _ in range(2):
+        infra.record("192.0.2.1", 0.01)
+    assert infra.payload("192.0.2.1") == infra.min_payload
+    infra.record("192.0.2.1", 0.01)
+    assert infra.payload("192.0.2.1") == infra.max_payload
+
+
+def test_servers_are_bounded():
+    infra = InfraCache(maxsize=2)
+    infra.record("192.0.2.1", 0.01)
+    infra.record("192.0.2.2", 0.02)
+    infra.timed_out("192.0.2.1")
+    infra.record("192.0.2.3", 0.03)
+
+    # the least recently updated server was dropped
+    assert len(infra) == 2
+    assert infra.srtt("192.0.2.2") == infra.unknown_rtt
+    assert infra.srtt("192.0.2.3") == 0.03
+
+
+def signed(rrset: dns.rrset.RRset, lifetime: int = 86400) -> tuple:
+    now = int(time.time())
+    sig = dns.dnssec.sign(rrset, KEY, ZONE, DNSKEY, inception=now - 3600, expiration=now + lifetime)
+    return rrset, dns.rrset.from_rdata(rrset.name, rrset.ttl, sig)
+
+
+def hashed(name) -> str:
+    """returns the owner of the NSEC3 record of a name in example."""
+    return f"{dns.dnssec.nsec3_hash(name, None, 0, dns.dnssec.NSEC3Hash.SHA1)}.example."
+
+
+def chain(names: dict, nsec3: bool = False, opt_out: bool = False, lifetime: int = 86400, minimum: int = 600) -> NegativeCache:
+    """returns a negative cache holding the signed SOA of example. and a signed NSEC or NSEC3 chain over `names`."""
+    cache = NegativeCache()
+    cache.add_soa(*signed(dns.rrset.from_text(ZONE, 3600, "IN", "SOA", f"ns.example. hostmaster.example. 1 3600 600 86400 {minimum}")))
+    owners = {dns.name.from_text(name, ZONE): types for name, types in names.items()}
+    if nsec3:
+        hashes = {hashed(name).split(".")[0]: types for name, types in owners.items()}
+        keys = sorted(hashes)
+        for i, key in enumerate(keys):
+            rdata = dns.rdata.from_text("IN", "NSEC3", f"1 {int(opt_out)} 0 - {keys[(i + 1) % len(keys)]} {hashes[key]}")
+            cache.add(ZONE, *signed(dns.rrset.from_rdata(dns.name.from_text(key, ZONE), 300, rdata), lifetime))
+    else:
+        keys = sorted(owners)
+        for i, owner in enumerate(keys):
+            rdata = dns.rdata.from_text("IN", "NSEC", f"{keys[(i + 1) % len(keys)]} {owners[owner]} NSEC")
+            cache.add(ZONE, *signed(dns.rrset.from_rdata(owner, 300, rdata), lifetime))
+    return cache
+
+
+def prove(cache: NegativeCache, name: str, qtype: str = "A") -> tuple:
+    """returns the rcode of a cached denial and the owners of its NSEC or NSEC3 records, or None."""
+    proof = cache.prove(dns.name.from_text(name), dns.rdatatype.from_text(qtype))
+    if proof is None:
+        return None
+    rcode, rrsets = proof
+    assert rrsets[0].rdtype == dns.rdatatype.SOA and all(sig.rdtype == dns.rdatatype.RRSIG for sig in rrsets[1::2])
+    return rcode, {rrset.name.to_text() for rrset in rrsets[2::2]}
+
+
+def test_nsec_range_proves_nxdomain():
+    cache = chain(NSEC_ZONE)
+    # b.example. lies between a.example. and b.c.example., and *.example. between example. and a.example.
+    assert prove(cache, "b.example.") == (dns.rcode.NXDOMAIN, {"a.example.", "example."})
+    assert prove(cache, "a.example.", "TXT") == (dns.rcode.NOERROR, {"a.example."})
+    assert prove(cache, "a.example.") is None
+    # the empty non-terminal c.example. exists without records
+    assert prove(cache, "c.example.") == (dns.rcode.NOERROR, {"a.example."})
+
+
+def test_nsec_does_not_deny_what_a_wildcard_or_a_cut_may_hold():
+    cache = chain(NSEC_ZONE)
+    # *.w.example. exists, so x.w.example. may be synthesized from it
+    assert prove(cache, "x.w.example.") is None
+    # names below a delegation and its other types belong to the child
+    assert prove(cache, "x.sub.example.") is None
+    assert prove(cache, "sub.example.") is None
+    assert prove(cache, "sub.example.", "DS") == (dns.rcode.NOERROR, {"sub.example."})
+    # names outside the zone are not covered by its chain
+    assert prove(cache, "b.example.org.") is None
+
+
+def test_nsec3_closest_encloser_proves_nxdomain():
+    cache = chain(NSEC3_ZONE, nsec3=True)
+    rcode, owners = prove(cache, "nope.example.")
+    assert rcode == dns.rcode.NXDOMAIN
+    assert hashed("example.") in owners
+    assert prove(cache, "a.example.", "TXT") == (dns.rcode.NOERROR, {hashed("a.example.")})
+    assert prove(cache, "c.example.")[0] == dns.rcode.NOERROR
+    assert prove(cache, "sub.example.", "DS")[0] == dns.rcode.NOERROR
+
+    # a name under an existing wildcard may be synthesized from it
+    assert prove(chain(dict(NSEC3_ZONE, **{"*": "A RRSIG"}), nsec3=True), "nope.example.") is None
+
+
+def test_nsec3_opt_out_and_cuts_never_prove_nxdomain():
+    cache = chain(NSEC3_ZONE, nsec3=True)
+    assert prove(cache, "x.sub.example.") is None
+    assert prove(cache, "sub.example.") is None
+
+    # an opt-out range may hide unsigned delegations
+    cache = chain(NSEC3_ZONE, nsec3=True, opt_out=True)
+    assert prove(cache, "nope.example.") is None
+    assert prove(cache, "a.example.", "TXT")[0] == dns.rcode.NOERROR
+
+
+def test_denials_expire(monkeypatch):
+    now = time.time()
+    caches = [chain(NSEC_ZONE), chain(NSEC_ZONE, lifetime=100), chain(NSEC_ZONE, minimum=60)]
+    for cache in caches:
+        assert prove(cache, "b.example.")[0] == dns.rcode.NXDOMAIN
+
+    # the NSEC ttl, the signature expiration and the SOA minimum each bound a range
+    for cache, alive, expired in zip(caches, (250, 50, 50), (350, 150, 90)):
+        monkeypatch.setattr(time, "time", lambda: now + alive)
+        assert prove(cache, "b.example.")[0] == dns.rcode.NXDOMAIN
+        monkeypatch.setattr(time, "time", lambda: now + expired)
+        assert prove(cache, "b.example.") is None
@@ -0,0 +1,184 @@
+import asyncio
+import time
+
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rrset
+
+import src.resolver
+from src.cache import InfraCache
+from src.resolver import DNSResolver
+from src.trace import tracer
+
+
+
+ROOT, COM, EXAMPLE, NET = "192.0.2.1", "192.0.2.2", "192.0.2.3", "192.0.2.4"
+
+
+def referral(question: str, zone: str, nameservers: dict, extra_ns: dict = None) -> dns.message.Message:
+    """builds a referral to `zone` with glue, plus NS rrsets of other zones in the authority section."""
+    response = dns.message.make_response(dns.message.make_query(question, "A"))
+    response.authority.append(dns.rrset.from_text_list(zone, 3600, "IN", "NS", list(nameservers)))
+    for owner, names in (extra_ns or {}).items():
+        response.authority.append(dns.rrset.from_text_list(owner, 3600, "IN", "NS", names))
+    for name, ip in nameservers.items():
+        if ip is not None:
+            response.additional.append(dns.rrset.from_text(name, 3600, "IN", "A", ip))
+    return response
+
+
+def serve(monkeypatch, responses: dict):
+    """answers every upstream query of the resolver from `responses`, keyed by server address."""
+    async def exchange_wire(qname, rdtype, ns, port=53, infra=None, dnssec=False, rdclass=None):
+        return responses[ns].to_wire()
+    monkeypatch.setattr(src.resolver, "exchange_wire", exchange_wire)
+
+
+def walk(monkeypatch, respond) -> list:
+    """answers every upstream query with `respond(qname, server)` and returns the servers asked, in order."""
+    asked = []
+
+    async def exchange_wire(qname, rdtype, ns, port=53, infra=None, dnssec=False, rdclass=None):
+        asked.append(ns)
+        return respond(qname, ns).to_wire()
+    monkeypatch.setattr(src.resolver, "exchange_wire", exchange_wire)
+    return asked
+
+
+def limits(resolver: DNSResolver, name: str) -> tuple:
+    """resolves `name` and returns the response with the reasons of the limits it hit."""
+    reasons = []
+
+    def sink(event):
+        if event["event"] == "limit":
+            reasons.append(event["reason"])
+    tracer.add_sink(sink)
+    try:
+        response, ok = resolver.resolve(name, "A")
+    finally:
+        tracer.remove_sink(sink)
+    assert not ok and response.rcode() == dns.rcode.SERVFAIL
+    return response, reasons
+
+
+def tld(qname: dns.name.Name) -> tuple:
+    """refers a name to the stand-in server of its top-level domain."""
+    zone = dns.name.Name(qname.labels[-2:])
+    return referral(qname, zone, {f"ns.{zone}": COM if zone.to_text() == "com." else NET})
+
+
+def glueless_chain(qname: dns.name.Name, ns: str) -> dns.message.Message:
+    """refers example0.com. and every zN.net. to a glueless nameserver under z(N + 1).net."""
+    if ns == ROOT:
+        return tld(qname)
+    zone = dns.name.Name(qname.labels[-3:])
+    step = int(zone.labels[0][1:]) + 1 if ns == NET else 1
+    return referral(qname, zone, {f"ns.z{step}.net.": None})
+
+
+def test_cyclic_delegation_is_a_loop(monkeypatch):
+    # example0.com. is served by ns.a.net., and a.net. by ns.example0.com., neither with glue
+    def respond(qname, ns):
+        if ns == ROOT:
+            return tld(qname)
+        if ns == COM:
+            return referral(qname, "example0.com.", {"ns.a.net.": None})
+        return referral(qname, "a.net.", {"ns.example0.com.": None})
+    asked = walk(monkeypatch, respond)
+
+    resolver = DNSResolver({"a": ROOT}, infra=InfraCache(), prefetch_window=0, max_queries=16)
+    _, reasons = limits(resolver, "www.example0.com.")
+    assert "loop" in reasons
+    assert len(asked) <= 16
+
+
+def test_glueless_chain_deeper_than_max_depth(monkeypatch):
+    asked = walk(monkeypatch, glueless_chain)
+
+    resolver = DNSResolver({"a": ROOT}, infra=InfraCache(), prefetch_window=0, max_depth=3, max_queries=32)
+    _, reasons = limits(resolver, "www.example0.com.")
+    assert "depth" in reasons
+    assert len(asked) <= 32
+    # the chain is followed three lookups deep and no further
+    assert resolver.delegations.nameservers(dns.name.from_text("z3.net."))
+    assert not resolver.delegations.nameservers(dns.name.from_text("z4.net."))
+
+
+def test_query_budget_is_shared_with_glueless_lookups(monkeypatch):
+    asked = walk(monkeypatch, glueless_chain)
+
+    resolver = DNSResolver({"a": ROOT}, infra=InfraCache(), prefetch_window=0, max_depth=64, max_queries=5)
+    _, reasons = limits(resolver, "www.example0.com.")
+    assert "queries" in reasons
+    assert len(asked) == 5
+
+
+def test_deadline_ends_the_walk(monkeypatch):
+    async def exchange_wire(qname, rdtype, ns, port=53, infra=None, dnssec=False, rdclass=None):
+        await asyncio.sleep(5)
+    monkeypatch.setattr(src.resolver, "exchange_wire", exchange_wire)
+
+    # the walk gives up on the first root at the deadline instead of trying the second
+    resolver = DNSResolver({"a": ROOT, "b": COM}, infra=InfraCache(unknown_rtt=1.0), prefetch_window=0, timeout=0.2)
+    start = time.monotonic()
+    _, reasons = limits(resolver, "www.example0.com.")
+    assert reasons == ["deadline"]
+    assert time.monotonic() - start < 1.0
+
+
+def test_referral_outside_bailiwick_is_not_cached(monkeypatch):
+    name = "www.example0.com."
+    poisoned = referral(name, "example0.com.", {"ns.example0.com.": EXAMPLE}, {"google.com.": ["ns1.google.com."]})
+    poisoned.additional.append(dns.rrset.from_text("ns1.google.com.", 3600, "IN", "A", "6.6.6.6"))
+    poisoned.additional.append(dns.rrset.from_text("ns.evil.net.", 3600, "IN", "A", "6.6.6.6"))
+
+    answer = dns.message.make_response(dns.message.make_query(name, "A"))
+    answer.answer.append(dns.rrset.from_text(name, 300, "IN", "A", "192.0.2.80"))
+    serve(monkeypatch, {
+        ROOT: referral(name, "com.", {"ns.com.": COM}),
+        COM: poisoned,
+        EXAMPLE: answer,
+    })
+
+    resolver = DNSResolver({"a": ROOT}, infra=InfraCache(), prefetch_window=0)
+    response, ok = resolver.resolve(name, "A")
+    assert ok and response.answer[0][0].address == "192.0.2.80"
+
+    delegations = resolver.delegations
+    assert delegations.closest(dns.name.from_text(name)) == (dns.name.from_text("example0.com."), [EXAMPLE])
+    assert delegations.closest(dns.name.from_text("www.google.com.")) == (dns.name.from_text("com."), [COM])
+    assert delegations.nameservers(dns.name.from_text("google.com.")) == set()
+    assert delegations.addresses(dns.name.from_text("ns1.google.com.")) == []
+    assert delegations.addresses(dns.name.from_text("ns.evil.net.")) == []
+
+
+def test_glue_outside_the_servers_zone_is_not_followed(monkeypatch):
+    name = "www.example0.com."
+    # a com. server may not vouch for the address of a nameserver under net.
+    serve(monkeypatch, {
+        ROOT: referral(name, "com.", {"ns.com.": COM}),
+        COM: referral(name, "example0.com.", {"ns.example0.net.": "6.6.6.6"}),
+    })
+
+    resolver = DNSResolver({"a": ROOT}, infra=InfraCache(), prefetch_window=0, max_queries=8)
+    resolver.resolve(name, "A")
+    assert resolver.delegations.addresses(dns.name.from_text("ns.example0.net.")) == []
+
+
+def test_servers_that_failed_in_a_hedge_are_not_asked_again(monkeypatch):
+    roots = {"a": "192.0.2.11", "b": "192.0.2.12", "c": "192.0.2.13"}
+    asked = []
+
+    async def exchange_wire(qname, rdtype, ns, port=53, infra=None, dnssec=False, rdclass=None):
+        asked.append(ns)
+        # the second server fails at once, the others after a while
+        if len(asked) != 2:
+            await asyncio.sleep(0.1)
+        raise OSError("unreachable")
+    monkeypatch.setattr(src.resolver, "exchange_wire", exchange_wire)
+
+    resolver = DNSResolver(roots, infra=InfraCache(unknown_rtt=0.05), prefetch_window=0)
+    response, ok = resolver.resolve("www.example0.com.", "A")
+    assert not ok and response.rcode() == dns.rcode.SERVFAIL
+    assert sorted(asked) == sorted(roots.values())
@@ -0,0 +1,95 @@
+import socket
+import time
+
+import dns.flags
+import dns.message
+import dns.opcode
+import dns.query
+import dns.rcode
+import dns.rrset
+import pytest
+
+from src.mock import MockHierarchy
+from src.resolver import AsyncDNSResolver
+from src.server import ResolverServer
+from src.utils import run_sync
+
+
+
+BIG = "big.example0.com."
+STRINGS = 10
+
+
+@pytest.fixture(scope="module")
+def server():
+    hierarchy = MockHierarchy(tlds=("com",), zones_per_tld=2)
+    zone = next(zone for zone in hierarchy.zones if zone.origin.to_text() == "example0.com.")
+    zone.add(dns.rrset.from_text_list(BIG, 300, "IN", "TXT", [f'"{i:02d}{"x" * 200}"' for i in range(STRINGS)]))
+
+    with hierarchy:
+        server = ResolverServer(AsyncDNSResolver(hierarchy.roots, port=hierarchy.port))
+
+        # the mock zones own 127.0.0.2 and up, so the shared port is free on 127.0.0.1
+        address = ("127.0.0.1", hierarchy.port)
+        run_sync(server.start(*address))
+
+        async def close():
+            server.close()
+        try:
+            yield address
+        finally:
+            run_sync(close())
+
+
+def test_udp_answer(server):
+    response = dns.query.udp(dns.message.make_query("www.example0.com.", "A"), server[0], timeout=5, port=server[1])
+    assert response.rcode() == dns.rcode.NOERROR
+    assert response.flags & dns.flags.RA
+    assert response.answer[0][0].address == "10.0.0.1"
+
+
+def test_tcp_answer(server):
+    response = dns.query.tcp(dns.message.make_query("mail.example1.com.", "A"), server[0], timeout=5, port=server[1])
+    assert response.rcode() == dns.rcode.NOERROR
+    assert response.answer[0][0].address == "10.1.1.1"
+
+
+def test_nxdomain(server):
+    response = dns.query.udp(dns.message.make_query("missing.example0.com.", "A"), server[0], timeout=5, port=server[1])
+    assert response.rcode() == dns.rcode.NXDOMAIN
+
+
+def test_large_answer_is_truncated_over_udp_and_complete_over_tcp(server):
+    query = dns.message.make_query(BIG, "TXT")
+    response = dns.query.udp(query, server[0], timeout=5, port=server[1], ignore_trailing=True)
+    assert response.flags & dns.flags.TC
+    assert not response.answer
+
+    response = dns.query.tcp(query, server[0], timeout=5, port=server[1])
+    assert not response.flags & dns.flags.TC
+    assert len(response.answer[0]) == STRINGS
+
+
+def test_cached_answer_ttl_counts_down(server):
+    query = dns.message.make_query("api.example0.com.", "A")
+    first = dns.query.udp(query, server[0], timeout=5, port=server[1])
+    time.sleep(1.1)
+    second = dns.query.udp(query, server[0], timeout=5, port=server[1])
+    assert second.answer[0].ttl < first.answer[0].ttl
+
+
+def test_responses_are_dropped(server):
+    response = dns.message.make_response(dns.message.make_query("www.example0.com.", "A"))
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(0.3)
+        sock.sendto(response.to_wire(), server)
+        with pytest.raises(socket.timeout):
+            sock.recv(512)
+    assert run_sync(ResolverServer(None).handle(response.to_wire())) is None
+
+
+def test_other_opcodes_are_not_implemented(server):
+    query = dns.message.make_query("www.example0.com.", "A")
+    query.set_opcode(dns.opcode.NOTIFY)
+    response = dns.query.udp(query, server[0], timeout=5, port=server[1])
+    assert response.rcode() == dns.rcode.NOTIMP
@@ -0,0 +1,44 @@
+import dns.message
+import dns.name
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+import pytest
+
+from src.cache import AnswerCache, CompactAnswerCache, DelegationCache
+from src.store import SharedStore
+
+
+
+def response(name: dns.name.Name) -> dns.message.Message:
+    response = dns.message.make_response(dns.message.make_query(name, "A"))
+    response.answer.append(dns.rrset.from_text(name, 300, "IN", "A", "192.0.2.80"))
+    return response
+
+
+@pytest.fixture
+def store():
+    store = SharedStore(slots=64)
+    yield store
+    store.close(unlink=True)
+
+
+@pytest.mark.parametrize("cache", [AnswerCache, CompactAnswerCache])
+def test_only_changes_are_published(store, cache):
+    answers, delegations = cache(), DelegationCache()
+    first, second = dns.name.from_text("www.example0.com."), dns.name.from_text("www.example1.com.")
+    answers.put(first, dns.rdatatype.A, response(first))
+    delegations.add_zone(dns.name.from_text("example0.com."), [dns.name.from_text("ns.example0.com.")], 3600)
+
+    # the first pass publishes everything, later ones only what was added since
+    assert len(answers.changes()["answers"]) == 1
+    assert answers.changes() == {"answers": []}
+    assert delegations.changes()["zones"] and delegations.changes() == {"zones": [], "glue": []}
+
+    answers.put(second, dns.rdatatype.A, response(second))
+    store.save(delegations, answers)
+    assert store.load("answers", (first, dns.rdatatype.A, dns.rdataclass.IN)) is None
+    assert store.load("answers", (second, dns.rdatatype.A, dns.rdataclass.IN))[1].answer == response(second).answer
+
+    # another worker finds the entry on its miss
+    assert AnswerCache(store).get(second, dns.rdatatype.A).answer[0][0].address == "192.0.2.80"
@@ -0,0 +1,156 @@
+import asyncio
+import struct
+
+import dns.message
+import dns.name
+import dns.rdatatype
+import dns.rrset
+
+from src.cache import InfraCache
+from src.transport import TCPPool
+from src.utils import exchange_wire, run_sync
+
+
+
+class Upstream:
+    """a loopback dns server over TCP and UDP that records what it is sent.
+
+    over TCP it answers every `pipeline` queries of a connection at once, in
+    reverse order, and hangs up instead of answering the queries numbered in `hang_up`.
+    """
+    def __init__(self, pipeline: int = 1, hang_up: tuple = ()):
+        self.pipeline = pipeline
+        self.hang_up = hang_up
+        self.connections = 0
+        self.queries = []
+        self.port = None
+        self.__servers = []
+
+    @staticmethod
+    def answer(query: dns.message.Message) -> bytes:
+        response = dns.message.make_response(query)
+        response.answer.append(dns.rrset.from_text(query.question[0].name, 300, "IN", "A", "192.0.2.80"))
+        return response.to_wire()
+
+    async def __serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        batch = []
+        try:
+            while True:
+                size = struct.unpack("!H", await reader.readexactly(2))[0]
+                query = dns.message.from_wire(await reader.readexactly(size))
+                self.queries.append(query)
+                if len(self.queries) in self.hang_up:
+                    return
+                batch.append(query)
+                if len(batch) == self.pipeline:
+                    for query in reversed(batch):
+                        wire = self.answer(query)
+                        writer.write(struct.pack("!H", len(wire)) + wire)
+                    batch = []
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        server = await asyncio.start_server(self.__serve, "127.0.0.1", 0)
+        self.port = server.sockets[0].getsockname()[1]
+        upstream = self
+
+        class Datagrams(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, addr):
+                query = dns.message.from_wire(data)
+                upstream.queries.append(query)
+                self.transport.sendto(upstream.answer(query), addr)
+
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(Datagrams, local_addr=("127.0.0.1", self.port))
+        self.__servers = [server, transport]
+
+    async def stop(self):
+        for server in self.__servers:
+            server.close()
+
+
+def upstream(**options) -> Upstream:
+    server = Upstream(**options)
+    run_sync(server.start())
+    return server
+
+
+def test_pipelined_queries_share_one_connection():
+    server = upstream(pipeline=2)
+    queries = [dns.message.make_query(name, "A") for name in ("a.example0.com.", "b.example0.com.")]
+
+    async def pair():
+        pool = TCPPool()
+        try:
+            answers = await asyncio.gather(*(pool.query(query.to_wire(), "127.0.0.1", server.port) for query in queries))
+            return answers, pool.connects
+        finally:
+            pool.close()
+
+    try:
+        answers, connects = run_sync(pair())
+    finally:
+        run_sync(server.stop())
+
+    # both queries were outstanding on one connection, and the reversed answers still reach their queries
+    assert connects == 1 and server.connections == 1
+    assert len({query.id for query in server.queries}) == 2
+    for query, wire in zip(queries, answers):
+        answer = dns.message.from_wire(wire)
+        assert answer.id == query.id
+        assert answer.question == query.question
+
+
+def test_closed_connection_is_reopened_once():
+    server = upstream(hang_up=(2,))
+    query = dns.message.make_query("a.example0.com.", "A")
+
+    async def twice():
+        pool = TCPPool()
+        try:
+            answers = [await pool.query(query.to_wire(), "127.0.0.1", server.port) for _ in range(2)]
+            return answers, pool.connects
+        finally:
+            pool.close()
+
+    try:
+        answers, connects = run_sync(twice())
+    finally:
+        run_sync(server.stop())
+
+    # the server hung up on the second query, which was sent again on a new connection
+    assert connects == 2 and server.connections == 2
+    assert len(server.queries) == 3
+    assert all(dns.message.from_wire(wire).id == query.id for wire in answers)
+
+
+def test_payload_is_lowered_and_raised_again():
+    server = upstream()
+    infra = InfraCache(probe_after=2)
+    name = dns.name.from_text("a.example0.com.")
+
+    def offered() -> int:
+        run_sync(exchange_wire(name, dns.rdatatype.A, "127.0.0.1", server.port, infra))
+        return server.queries[-1].payload
+
+    try:
+        assert offered() == infra.max_payload
+
+        # one timeout may be a lost packet, the second in a row lowers the payload
+        infra.timed_out("127.0.0.1")
+        assert offered() == infra.max_payload
+        infra.timed_out("127.0.0.1")
+        infra.timed_out("127.0.0.1")
+        assert offered() == infra.min_payload
+
+        # after `probe_after` answers in a row at the lowered payload it is raised again
+        assert offered() == infra.min_payload
+        assert offered() == infra.max_payload
+    finally:
+        run_sync(server.stop())
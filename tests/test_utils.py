@@ -0,0 +1,62 @@
+import asyncio
+
+import dns.name
+import dns.rdatatype
+import pytest
+
+from src.cache import InfraCache
+from src.mock import MockHierarchy
+from src.utils import exchange_wire, hedged, run_sync
+
+
+
+@pytest.fixture(scope="module")
+def hierarchy():
+    with MockHierarchy(tlds=("com",), zones_per_tld=1) as hierarchy:
+        yield hierarchy
+
+
+def test_identical_queries_are_coalesced(hierarchy):
+    zone = hierarchy.zones[-1]
+    name = dns.name.from_text("www.example0.com.")
+
+    async def both():
+        return await asyncio.gather(*(exchange_wire(name, dns.rdatatype.A, zone.ip, hierarchy.port, InfraCache()) for _ in range(2)))
+
+    before = zone.queries
+    first, second = run_sync(both())
+    assert zone.queries - before == 1
+    assert first == second
+
+
+def test_different_names_are_not_coalesced(hierarchy):
+    zone = hierarchy.zones[-1]
+    names = [dns.name.from_text(name) for name in ("www.example0.com.", "mail.example0.com.")]
+
+    async def both():
+        return await asyncio.gather(*(exchange_wire(name, dns.rdatatype.A, zone.ip, hierarchy.port, InfraCache()) for name in names))
+
+    before = zone.queries
+    run_sync(both())
+    assert zone.queries - before == 2
+
+
+def test_failure_is_hedged_at_once():
+    async def send(server):
+        if server == "b":
+            raise OSError("refused")
+        await asyncio.sleep(0.01 if server == "c" else 5)
+        return server
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        failed = []
+        answer = await hedged(send, ["a", "b", "c"], InfraCache(unknown_rtt=0.2), failed=failed)
+        return answer, failed, loop.time() - start
+
+    # b fails right after the first hedge, so c is asked without waiting another 0.2 s
+    answer, failed, elapsed = run_sync(run())
+    assert answer == ("c", "c")
+    assert failed == ["b"]
+    assert elapsed < 0.35
@@ -0,0 +1,105 @@
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rdataclass
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+import pytest
+
+from src.wire import Referral, query_template, truncated
+
+
+
+NAME = dns.name.from_text("www.example0.com.")
+
+
+def response(query: dns.message.Message) -> dns.message.Message:
+    """an answer to `query`, whose names dnspython compresses against the question."""
+    answer = dns.message.make_response(query)
+    answer.answer.append(dns.rrset.from_text(query.question[0].name, 300, "IN", "A", "192.0.2.80"))
+    return answer
+
+
+def test_template_renders_the_query_dnspython_builds():
+    template = query_template(NAME, dns.rdatatype.A, dnssec=True, payload=1232)
+    query = dns.message.make_query(NAME, dns.rdatatype.A, use_edns=0, want_dnssec=True, payload=1232)
+    query.id = 4660
+    assert template.render(4660) == query.to_wire()
+
+    parsed = dns.message.from_wire(template.render(4660))
+    assert parsed.id == 4660
+    assert parsed.question == query.question
+    assert parsed.payload == 1232 and parsed.ednsflags & dns.flags.DO
+
+
+def test_matches_the_response_to_its_query():
+    template = query_template(NAME, dns.rdatatype.A)
+    query = dns.message.from_wire(template.render(4660))
+    wire = response(query).to_wire()
+    assert b"\xc0\x0c" in wire  # the answer owner points back at the question
+    assert template.matches(wire, 4660)
+
+    # dns 0x20 may change the case of the name, but nothing else
+    mixed = dns.message.from_wire(query_template(dns.name.from_text("WwW.ExAmPlE0.cOm."), dns.rdatatype.A).render(4660))
+    assert template.matches(response(mixed).to_wire(), 4660)
+
+
+def test_matches_rejects_other_messages():
+    template = query_template(NAME, dns.rdatatype.A)
+    query = dns.message.from_wire(template.render(4660))
+    assert not template.matches(response(query).to_wire(), 4661)
+    assert not template.matches(template.render(4660), 4660)  # not a response
+    assert not template.matches(response(query).to_wire()[:20], 4660)
+
+    for other in (query_template(NAME, dns.rdatatype.AAAA), query_template(dns.name.from_text("mail.example0.com."), dns.rdatatype.A)):
+        assert not template.matches(response(dns.message.from_wire(other.render(4660))).to_wire(), 4660)
+
+
+def test_referral_reads_nameservers_and_glue():
+    query = dns.message.make_query(NAME, "A", use_edns=0)
+    referral = dns.message.make_response(query)
+    referral.authority.append(dns.rrset.from_text_list("example0.com.", 3600, "IN", "NS", ["ns1.example0.com.", "ns2.example0.com."]))
+    referral.additional.append(dns.rrset.from_text("ns1.example0.com.", 600, "IN", "A", "192.0.2.1", "192.0.2.2"))
+    referral.additional.append(dns.rrset.from_text("ns1.example0.com.", 600, "IN", "AAAA", "2001:db8::1"))
+    referral.additional.append(dns.rrset.from_text("ns2.example0.com.", 300, "IN", "A", "192.0.2.3"))
+    wire = referral.to_wire()
+    assert wire.count(b"\xc0") >= 5  # owners, nameservers and glue names are all compressed
+
+    parsed = Referral(wire)
+    assert parsed.rcode == dns.rcode.NOERROR and parsed.answers == 0
+    assert not parsed.soa and not parsed.truncated and not truncated(wire)
+    ns1, ns2 = dns.name.from_text("ns1.example0.com."), dns.name.from_text("ns2.example0.com.")
+    (zone, ttl, nameservers), = parsed.zones
+    assert zone == dns.name.from_text("example0.com.") and ttl == 3600
+    assert sorted(nameservers) == [ns1, ns2]
+    assert sorted(parsed.glue) == [ns1, ns2]
+    assert parsed.glue[ns1][0] == 600 and sorted(parsed.glue[ns1][1]) == ["192.0.2.1", "192.0.2.2"]
+    assert parsed.glue[ns2] == (300, ["192.0.2.3"])
+
+    # the fast path reads the same records, in the same order, as the full parser
+    full = dns.message.from_wire(wire)
+    assert nameservers == [rr.target for rr in full.authority[0]]
+    assert parsed.glue[ns1][1] == [rr.address for rr in full.find_rrset(full.additional, ns1, dns.rdataclass.IN, dns.rdatatype.A)]
+
+
+def test_referral_of_answers_and_denials():
+    query = dns.message.make_query(NAME, "A")
+    assert Referral(response(query).to_wire()).answers == 1
+
+    nodata = dns.message.make_response(query)
+    nodata.authority.append(dns.rrset.from_text("example0.com.", 300, "IN", "SOA", "ns1.example0.com. admin.example0.com. 1 7200 900 1209600 300"))
+    assert Referral(nodata.to_wire()).soa
+
+    nxdomain = dns.message.make_response(query)
+    nxdomain.set_rcode(dns.rcode.NXDOMAIN)
+    nxdomain.flags |= dns.flags.TC
+    parsed = Referral(nxdomain.to_wire())
+    assert parsed.rcode == dns.rcode.NXDOMAIN and parsed.truncated
+
+
+def test_malformed_referral_is_a_form_error():
+    wire = response(dns.message.make_query(NAME, "A")).to_wire()
+    with pytest.raises(dns.exception.FormError):
+        Referral(wire[:-6])